@@ -530,16 +530,16 @@ def generate_meta_module_files(version: str, modules_dir: Path, boost_modules: l
     run_buildifier([version_dir])
 
 
-def update_integrity(module: str, version: str, registry_root: Path) -> None:
-    """Run bazel update_integrity for a module."""
+def update_integrity(modules: list[str], version: str, registry_root: Path) -> None:
+    """Run bazel update_integrity for all given modules in a single batch."""
     subprocess.run(
         [
             "bazel",
             "run",
             "//tools:update_integrity",
             "--",
-            module,
             f"--version={version}",
+            *modules,
         ],
         capture_output=True,
         text=True,
@@ -705,9 +705,8 @@ def main() -> None:
         len([v for v in modules_with_version.values() if v]),
     )
 
-    for module in modules_with_version:
-        logging.info("Updating integrity: %s", module)
-        update_integrity(module, args.version, registry_root)
+    if modules_with_version:
+        update_integrity(sorted(modules_with_version), args.version, registry_root)
 
     if needs_manual_creation:
         logging.error("The following modules need manual creation: %s", needs_manual_creation)
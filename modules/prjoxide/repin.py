@@ -19,6 +19,7 @@ HERE = Path(__file__).resolve().parent
 REGISTRY_ROOT = HERE.parent.parent  # modules/prjoxide -> modules -> <registry root>
 
 sys.path.insert(0, str(REGISTRY_ROOT / "tools"))
+import patcher  # noqa: E402
 from registry import RegistryClient, download_file, integrity_for_comparison, read  # noqa: E402
 
 
@@ -81,7 +82,9 @@ def _apply_patches(version_dir: Path, source: dict, work_tree: Path) -> None:
         patch_file = patches_dir / patch_name
         if not patch_file.exists():
             raise SystemExit(f"patch listed in source.json not found on disk: {patch_file}")
-        _run(["patch", f"-p{patch_strip}", "-i", str(patch_file)], cwd=work_tree)
+        _log(f"applying {patch_name} (strip={patch_strip})")
+        # The default fuzz factor of `patch -p<N> -i <file>`.
+        patcher.apply_patch(read(patch_file), patcher.DirectoryTree(work_tree), strip=patch_strip, fuzz=2)
 
 
 def _cargo_lock(work_tree: Path) -> Path:
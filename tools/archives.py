@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Read source archives with the fastest decompressor at hand.
+
+`detect_format` tells the archive format from the magic bytes of a file, so
+that archives in the download cache, which have no file extension, are read
+correctly. `open_archive` memory-maps the file and reads tar archives as a
+stream through a `Decompressor`. Large archives go through a parallel
+external tool such as `pigz` or `xz -T0` if one is installed; everything else
+is decompressed in-process. Run this file with archives or module versions to
+compare the decompressors:
+
+    bazel run //tools:archives -- --registry=. zlib@1.3.1 boost.math@1.89.0
+"""
+
+import argparse
+import bz2
+import contextlib
+import gzip
+import lzma
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+import zstandard
+
+import tracing
+from registry import DownloadCache
+from registry import RegistryClient
+from registry import get_download_cache
+
+# The archive formats, named like the formats of `shutil.unpack_archive`, and their compression.
+COMPRESSIONS = {"gztar": "gz", "bztar": "bz2", "xztar": "xz", "zstdtar": "zst", "tar": None, "zip": None}
+FORMATS = frozenset(COMPRESSIONS)
+
+# Magic bytes at the start of a file. Compressed files are expected to contain a tar archive.
+_MAGIC = [
+    (b"\x1f\x8b", "gztar"),
+    (b"BZh", "bztar"),
+    (b"\xfd7zXZ\x00", "xztar"),
+    (b"\x28\xb5\x2f\xfd", "zstdtar"),
+    (b"PK\x03\x04", "zip"),
+    # An empty zip archive.
+    (b"PK\x05\x06", "zip"),
+]
+# POSIX and GNU tar archives have a magic string in the header of the first member.
+_TAR_MAGIC_OFFSET = 257
+
+# Starting an external decompressor takes a few milliseconds, which only pays off for larger archives.
+EXTERNAL_MIN_SIZE = 1024 * 1024
+
+
+class ArchiveError(Exception):
+    """Raised when an archive can't be read."""
+
+
+def detect_format(path):
+    """Return the format of the archive at `path` (see `FORMATS`), or None if it isn't recognized."""
+    with open(path, "rb") as file:
+        header = file.read(_TAR_MAGIC_OFFSET + 8)
+    for magic, format in _MAGIC:
+        if header.startswith(magic):
+            return format
+    if header[_TAR_MAGIC_OFFSET : _TAR_MAGIC_OFFSET + 5] == b"ustar":
+        return "tar"
+    return None
+
+
+class Decompressor:
+    """Decompresses files of one kind of `compression`, see `DECOMPRESSORS`."""
+
+    def __init__(self, name, compression, min_size=0):
+        self.name = name
+        self.compression = compression
+        # The size of the smallest file this decompressor is used for by default.
+        self.min_size = min_size
+
+    def available(self):
+        return True
+
+    def open(self, path, mapped):
+        """Return a context manager for a stream of the decompressed content of the file at `path`,
+        which is also mapped into memory as `mapped`."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return self.name
+
+
+class InProcessDecompressor(Decompressor):
+    """Decompresses the memory-mapped file with a Python module."""
+
+    def __init__(self, name, compression, open_stream):
+        super().__init__(name, compression)
+        self._open_stream = open_stream
+
+    def open(self, path, mapped):
+        return contextlib.closing(self._open_stream(mapped))
+
+
+class ExternalDecompressor(Decompressor):
+    """Decompresses the file in a separate process, which may use several threads."""
+
+    def __init__(self, name, compression, command, min_size=EXTERNAL_MIN_SIZE):
+        super().__init__(name, compression, min_size)
+        self.command = command
+
+    def available(self):
+        return shutil.which(self.command[0]) is not None
+
+    @contextlib.contextmanager
+    def open(self, path, mapped):
+        tracing.add(tracing.SUBPROCESSES)
+        with tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen([*self.command, "--", os.fspath(path)], stdout=subprocess.PIPE, stderr=stderr)
+            try:
+                yield process.stdout
+            except BaseException:
+                # A failing decompressor shows up as a truncated archive first, give it a moment to exit, so
+                # that its own error is reported.
+                with contextlib.suppress(subprocess.TimeoutExpired):
+                    process.wait(timeout=1)
+                raise
+            finally:
+                # Only extracting some members may stop reading early. The integrity of the archive was
+                # checked before, so there is nothing to learn from the rest of the output.
+                returncode = process.poll()
+                if returncode is None:
+                    process.kill()
+                process.stdout.close()
+                process.wait()
+                if returncode:
+                    stderr.seek(0)
+                    message = stderr.read().decode(errors="replace").strip()
+                    raise ArchiveError(f"{self.name} failed to decompress {path}: {message}")
+
+
+# All decompressors, the fastest ones first. See `select_decompressor`.
+DECOMPRESSORS = [
+    ExternalDecompressor("pigz", "gz", ["pigz", "-dc"]),
+    ExternalDecompressor("lbzip2", "bz2", ["lbzip2", "-dc"]),
+    ExternalDecompressor("pbzip2", "bz2", ["pbzip2", "-dc"]),
+    ExternalDecompressor("xz", "xz", ["xz", "-dc", "-T0"]),
+    ExternalDecompressor("zstd", "zst", ["zstd", "-dcq"]),
+    InProcessDecompressor("zlib", "gz", lambda file: gzip.GzipFile(fileobj=file, mode="rb")),
+    InProcessDecompressor("bz2", "bz2", bz2.BZ2File),
+    InProcessDecompressor("lzma", "xz", lzma.LZMAFile),
+    InProcessDecompressor(
+        "zstandard", "zst", lambda file: zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True)
+    ),
+]
+
+
+def select_decompressor(compression, size=0, decompressors=None):
+    """Return the first available decompressor for `compression` that is meant for files of `size` bytes."""
+    for decompressor in decompressors or DECOMPRESSORS:
+        if decompressor.compression == compression and size >= decompressor.min_size and decompressor.available():
+            return decompressor
+    raise ArchiveError(f"No decompressor for {compression} is available.")
+
+
+@contextlib.contextmanager
+def open_archive(path, format=None, decompressor=None):
+    """Open the archive at `path` as a `zipfile.ZipFile` or a `tarfile.TarFile` that is read as a stream
+    from the memory-mapped file.
+
+    The format is detected from the file's content unless given. Tar archives are decompressed by
+    `decompressor`, which defaults to the one `select_decompressor` picks for the file's size.
+    """
+    format = format or detect_format(path)
+    if format not in FORMATS:
+        raise ArchiveError(f"{path} is not an archive of a supported format.")
+    with contextlib.ExitStack() as stack:
+        file = stack.enter_context(open(path, "rb"))
+        size = os.fstat(file.fileno()).st_size
+        if not size:
+            raise ArchiveError(f"{path} is empty.")
+        if format == "zip":
+            # Zip members are read by their offsets in the file anyway.
+            yield stack.enter_context(zipfile.ZipFile(file))
+            return
+        mapped = stack.enter_context(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        stream = mapped
+        if COMPRESSIONS[format]:
+            decompressor = decompressor or select_decompressor(COMPRESSIONS[format], size)
+            stream = stack.enter_context(decompressor.open(path, mapped))
+        yield stack.enter_context(tarfile.open(fileobj=stream, mode="r|"))
+
+
+def extract_all(path, output_dir, format=None, decompressor=None):
+    """Extract the archive at `path` into `output_dir`, see `open_archive`."""
+    with open_archive(path, format, decompressor) as archive:
+        # Use PEP 706 safe extraction if available (Python 3.12+). ZipFile sanitizes member names itself.
+        if isinstance(archive, tarfile.TarFile) and sys.version_info >= (3, 12):
+            archive.extractall(output_dir, filter="data")
+        else:
+            archive.extractall(output_dir)
+
+
+def benchmark(path, decompressors=None, repeat=3):
+    """Return `(decompressor, best seconds, members)` for reading all members of the archive at `path`
+    with each available decompressor for its format, or with `open_archive` for uncompressed formats."""
+    format = detect_format(path)
+    if format not in FORMATS:
+        raise ArchiveError(f"{path} is not an archive of a supported format.")
+    compression = COMPRESSIONS[format]
+    candidates = [
+        d for d in decompressors or DECOMPRESSORS if compression and d.compression == compression and d.available()
+    ]
+    results = []
+    for decompressor in candidates or [None]:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            members = 0
+            with open_archive(path, format, decompressor) as archive:
+                if isinstance(archive, zipfile.ZipFile):
+                    for info in archive.infolist():
+                        archive.read(info)
+                        members += 1
+                else:
+                    for info in archive:
+                        if info.isfile():
+                            archive.extractfile(info).read()
+                        members += 1
+            timings.append(time.perf_counter() - start)
+        results.append((decompressor, min(timings), members))
+    return results
+
+
+def _fetch_module_archive(registry, spec):
+    module_name, version = spec.split("@", 1)
+    source = registry.get_source(module_name, version)
+    cache = get_download_cache() or DownloadCache(os.path.join(tempfile.gettempdir(), "bcr-archive-benchmark"))
+    path, _ = cache.fetch(source["url"], source.get("integrity"))
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the decompressors on source archives.")
+    parser.add_argument(
+        "archives",
+        nargs="+",
+        help="Archive files or module versions (e.g. zlib@1.3.1), whose source archives are downloaded "
+        + "through the download cache.",
+    )
+    parser.add_argument("--registry", default=".", help="The registry to look up module versions in.")
+    parser.add_argument("--repeat", type=int, default=3, help="Report the best of this many runs.")
+    args = parser.parse_args(argv)
+
+    registry = RegistryClient(args.registry)
+    print(f"{'seconds':>8} {'MiB/s':>8} {'members':>8}  decompressor  archive")
+    for spec in args.archives:
+        path = spec if os.path.exists(spec) else _fetch_module_archive(registry, spec)
+        size = os.path.getsize(path)
+        for decompressor, seconds, members in benchmark(path, repeat=args.repeat):
+            name = decompressor.name if decompressor else "-"
+            print(f"{seconds:8.3f} {size / seconds / 2**20:8.1f} {members:8d}  {name:<12}  {spec}")
+    return 0
+
+
+if __name__ == "__main__":
+    # Under 'bazel run' we want to run within the source folder instead of the execroot.
+    if os.getenv("BUILD_WORKSPACE_DIRECTORY"):
+        os.chdir(os.getenv("BUILD_WORKSPACE_DIRECTORY"))
+    sys.exit(main())
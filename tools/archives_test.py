@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import bz2
+import gzip
+import io
+import lzma
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+import zstandard
+
+import archives
+from archives import ArchiveError
+from archives import ExternalDecompressor
+from archives import InProcessDecompressor
+
+FILES = {"foo-1.0/MODULE.bazel": b'module(name = "foo")\n', "foo-1.0/src/lib.c": b"int x;\n" * 1000}
+
+COMPRESS = {
+    "gz": gzip.compress,
+    "bz2": bz2.compress,
+    "xz": lzma.compress,
+    "zst": lambda data: zstandard.ZstdCompressor().compress(data),
+}
+
+
+def make_tar(files):
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w", format=tarfile.GNU_FORMAT) as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+    return buf.getvalue()
+
+
+def make_zip(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buf.getvalue()
+
+
+# An external decompressor that is always available. The file name is the last argument.
+GUNZIP = ExternalDecompressor(
+    "gunzip.py",
+    "gz",
+    [sys.executable, "-c", "import gzip, sys; sys.stdout.buffer.write(gzip.open(sys.argv[-1]).read())"],
+)
+
+
+class ArchivesTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def write_archive(self, format, files=FILES):
+        """Write an archive of `files` in `format` to a file without an extension, like in the download cache."""
+        compression = archives.COMPRESSIONS[format]
+        if format == "zip":
+            data = make_zip(files)
+        else:
+            data = make_tar(files)
+            if compression:
+                data = COMPRESS[compression](data)
+        path = self.tmp / f"blob-{format}"
+        path.write_bytes(data)
+        return path
+
+    def extracted(self, output_dir):
+        return {str(p.relative_to(output_dir)): p.read_bytes() for p in output_dir.rglob("*") if p.is_file()}
+
+
+class TestDetectFormat(ArchivesTestCase):
+    def test_formats(self):
+        for format in sorted(archives.FORMATS):
+            with self.subTest(format=format):
+                self.assertEqual(archives.detect_format(self.write_archive(format)), format)
+
+    def test_unknown(self):
+        for content in [b"", b"7z\xbc\xaf\x27\x1c", b"plain text"]:
+            path = self.tmp / "unknown"
+            path.write_bytes(content)
+            self.assertIsNone(archives.detect_format(path))
+            with self.assertRaisesRegex(ArchiveError, "not an archive of a supported format"):
+                archives.extract_all(path, self.tmp / "out")
+
+
+class TestExtract(ArchivesTestCase):
+    def test_extract_all(self):
+        for format in sorted(archives.FORMATS):
+            with self.subTest(format=format):
+                output_dir = self.tmp / f"out-{format}"
+                archives.extract_all(self.write_archive(format), output_dir)
+                self.assertEqual(self.extracted(output_dir), FILES)
+
+    def test_every_available_decompressor(self):
+        for decompressor in archives.DECOMPRESSORS:
+            if not decompressor.available():
+                continue
+            format = {"gz": "gztar", "bz2": "bztar", "xz": "xztar", "zst": "zstdtar"}[decompressor.compression]
+            # External decompressors are only used for large files by default, so pass them explicitly.
+            with self.subTest(decompressor=decompressor.name):
+                output_dir = self.tmp / f"out-{decompressor.name}"
+                archives.extract_all(self.write_archive(format), output_dir, decompressor=decompressor)
+                self.assertEqual(self.extracted(output_dir), FILES)
+
+    def test_stop_reading_early(self):
+        files = {f"foo/{i}.txt": bytes([i]) * 100_000 for i in range(50)}
+        path = self.write_archive("gztar", files)
+        # The decompressor is killed once the archive is closed, without reporting an error.
+        with archives.open_archive(path, decompressor=GUNZIP) as tar:
+            self.assertEqual(next(iter(tar)).name, "foo/0.txt")
+
+    def test_external_decompressor_failure(self):
+        decompressor = ExternalDecompressor("broken", "gz", [sys.executable, "-c", "raise SystemExit('corrupt')"])
+        with self.assertRaisesRegex(ArchiveError, "broken.*corrupt"):
+            archives.extract_all(self.write_archive("gztar"), self.tmp / "out", decompressor=decompressor)
+
+    def test_empty_file(self):
+        path = self.tmp / "empty.tar.gz"
+        path.write_bytes(b"")
+        with self.assertRaisesRegex(ArchiveError, "is empty"):
+            archives.extract_all(path, self.tmp / "out", format="gztar")
+
+
+class TestSelectDecompressor(unittest.TestCase):
+    def test_prefers_external_tools_for_large_files(self):
+        external = ExternalDecompressor("fast", "xz", [sys.executable], min_size=100)
+        missing = ExternalDecompressor("missing", "xz", ["no-such-decompressor"])
+        in_process = InProcessDecompressor("slow", "xz", lzma.LZMAFile)
+        decompressors = [missing, external, in_process]
+        self.assertIs(archives.select_decompressor("xz", 1000, decompressors), external)
+        self.assertIs(archives.select_decompressor("xz", 10, decompressors), in_process)
+        with self.assertRaisesRegex(ArchiveError, "No decompressor for gz"):
+            archives.select_decompressor("gz", 10, decompressors)
+
+    def test_in_process_fallback_for_every_compression(self):
+        for compression in COMPRESS:
+            with self.subTest(compression=compression):
+                self.assertIsInstance(archives.select_decompressor(compression, 0), InProcessDecompressor)
+
+
+class TestBenchmark(ArchivesTestCase):
+    def test_compares_decompressors(self):
+        path = self.write_archive("xztar")
+        results = archives.benchmark(path, repeat=1)
+        names = [decompressor.name for decompressor, _, _ in results]
+        self.assertIn("lzma", names)
+        self.assertEqual({members for _, _, members in results}, {len(FILES)})
+
+    def test_uncompressed(self):
+        ((decompressor, seconds, members),) = archives.benchmark(self.write_archive("zip"), repeat=1)
+        self.assertIsNone(decompressor)
+        self.assertEqual(members, len(FILES))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -26,38 +26,67 @@ Validations performed are:
     - If not, we should require BCR maintainer review.
   - Verify the checked in MODULE.bazel file matches the one in the extracted and patched source tree.
   - Verify attestations (SLSA provenance / VSA) referenced by attestations.json (if it exists).
+  - Verify the modules/ directory has no symlinks, module names that only differ in case or missing files,
+    see registry_walker.py.
 """
 
 import argparse
 import ast
+import concurrent.futures
+import contextlib
+import dataclasses
+import functools
+import hashlib
+import io
 import json
+import multiprocessing.util
 import os
+import posixpath
 import re
 import requests
 import shutil
 import subprocess
 import sys
-import tarfile
 import tempfile
+import threading
+import time
+import warnings
 import yaml
-import zstandard
 
 from difflib import unified_diff
 from enum import Enum
 from pathlib import Path
 from urllib.parse import urlparse
 
+import archives
 import attestations as attestations_lib
+import github_users
+import patcher
+import registry_walker
 import slsa
+import tracing
+import transport
 
+from registry import DownloadCache
+from registry import GitUpstreamBackend
+from registry import ModuleAttributeTable
 from registry import RegistryClient
 from registry import UpstreamRegistry
 from registry import Version
-from registry import download
-from registry import download_file
+from registry import content_length
+from registry import download_and_hash
+from registry import file_integrity
+from registry import get_download_cache
 from registry import integrity
-from registry import integrity_for_comparison
+from registry import parse_module_attributes
 from registry import read
+from registry import set_download_cache
+from registry import upstream_backend
+from registry import url_integrity_for_comparison
+from scratch import DEFAULT_QUOTA_MB
+from scratch import SCRATCH_DIR_ENV
+from scratch import ScratchSpace
+from scratch import disk_usage
 from verify_stable_archives import UrlStability
 from verify_stable_archives import verify_stable_archive
 
@@ -83,13 +112,22 @@ UPSTREAM_MODULES_DIR_URL = "https://bcr.bazel.build/modules"
 
 DEFAULT_SLSA_VERIFIER_VERSION = "v2.7.1"
 
+# Environment variable pointing at the directory of the validation result cache.
+RESULT_CACHE_ENV = "BCR_RESULT_CACHE"
+
+# Environment variable pointing at the file that remembers which refs belong to their GitHub repository.
+GITHUB_REF_CACHE_ENV = "BCR_GITHUB_REF_CACHE"
+
+# How long the passing results of checks that depend on the network are reused, in hours.
+DEFAULT_RESULT_CACHE_TTL_HOURS = 24
+
 ATTESTATIONS_DOCS_URL = "https://github.com/bazelbuild/bazel-central-registry/blob/main/docs/attestations.md"
 
 GITHUB_REPO_RE = re.compile(r"^github:([^/]+/[^/]+)$")
-GITHUB_URL_RE = re.compile(r"^https://github.com/([^/]+/[^/]+)")
 
-# Global cache for GitHub user IDs
-GITHUB_USER_ID_CACHE = {}
+# How many refs `prefetch_github_ref_checks` checks at the same time.
+GITHUB_REF_CHECK_THREADS = 8
+GITHUB_URL_RE = re.compile(r"^https://github.com/([^/]+/[^/]+)")
 
 # For the following modules, going from a release with attestations to one without
 # is merely a warning, not a fatal error.
@@ -126,15 +164,184 @@ def parse_module_versions(registry, check_all, inputs):
     return result
 
 
-def apply_patch(work_dir, patch_strip, patch_file):
-    # Requires patch to be installed
-    subprocess.run(
-        ["patch", "--strip", str(patch_strip), "--force", "--fuzz", "0", "--ignore-whitespace", "--input", patch_file],
-        shell=False,
-        check=True,
-        env=os.environ,
-        cwd=work_dir,
+def _git(registry_root, *args):
+    tracing.add(tracing.SUBPROCESSES)
+    try:
+        result = subprocess.run(["git", "-C", str(registry_root), *args], capture_output=True, check=True)
+    except FileNotFoundError:
+        raise BcrValidationException("Finding the changed module versions requires `git`.")
+    except subprocess.CalledProcessError as e:
+        raise BcrValidationException(f"`git {' '.join(args)}` failed: {e.stderr.decode().strip()}")
+    return result.stdout
+
+
+def changed_module_paths(registry_root, ref):
+    """Return the paths below modules/ that differ between the merge base of `ref` and HEAD and the
+    working tree, including untracked files, relative to `registry_root`."""
+    merge_base = _git(registry_root, "merge-base", ref, "HEAD").decode().strip()
+    changed = _git(
+        registry_root, "diff", "--name-only", "--no-renames", "--relative", "-z", merge_base, "--", "modules"
     )
+    untracked = _git(registry_root, "ls-files", "--others", "--exclude-standard", "-z", "--", "modules")
+    paths = {os.fsdecode(path) for path in (changed + untracked).split(b"\0") if path}
+    return merge_base, sorted(paths)
+
+
+def _compatibility_level_context(table, version):
+    """Everything the compatibility_level check of `version` looks at, see `verify_module_dot_bazel`.
+
+    The compatibility_level of a MODULE.bazel file that can't be read or parsed is None.
+    """
+    if version not in table:
+        return None
+
+    def compatibility_level(v):
+        try:
+            return table[v].compatibility_level
+        except (OSError, SyntaxError, UnicodeDecodeError):
+            return None
+
+    previous_version, next_version = table.neighbors(version)
+    return [(v, compatibility_level(v) if v is not None else None) for v in (version, previous_version, next_version)]
+
+
+def parse_changed_module_versions(registry, ref):
+    """Return the module versions and the modules whose metadata.json need to be validated after the changes
+    since `ref` (see `changed_module_paths`).
+
+    Besides the module versions whose files changed, this includes the other versions of the same modules
+    whose compatibility_level check compares against different versions or compatibility levels than
+    before, e.g. the versions next to a newly added one. The previous state of the registry is read
+    from the git object database.
+    """
+    merge_base, paths = changed_module_paths(registry.root, ref)
+    module_versions = set()
+    metadata_modules = set()
+    touched_modules = set()
+    for path in paths:
+        parts = path.split("/")
+        if len(parts) < 3:
+            continue
+        name = parts[1]
+        touched_modules.add(name)
+        if len(parts) > 3:
+            module_versions.add((name, parts[2]))
+        elif parts[2] == "metadata.json":
+            metadata_modules.add(name)
+    # Deleted module versions aren't validated.
+    module_versions = {(name, version) for name, version in module_versions if registry.contains(name, version)}
+    metadata_modules = {name for name in metadata_modules if registry.contains(name)}
+
+    prefix = _git(registry.root, "rev-parse", "--show-prefix").decode().strip()
+    previous = GitUpstreamBackend(registry.root, merge_base, modules_dir=posixpath.join(prefix, "modules"))
+    try:
+        for name in sorted(touched_modules):
+            if not registry.contains(name):
+                continue
+            table = registry.get_module_attribute_table(name)
+            previous_metadata = previous.get_if_exists(f"{name}/metadata.json")
+            previous_metadata = json.loads(previous_metadata) if previous_metadata else {"versions": []}
+
+            def previous_attributes(version):
+                path = f"{name}/{version}/MODULE.bazel"
+                content = previous.get_if_exists(path)
+                if content is None:
+                    raise FileNotFoundError(path)
+                return parse_module_attributes("MODULE.bazel", content.decode())
+
+            previous_table = ModuleAttributeTable(
+                previous_metadata["versions"], previous_metadata.get("yanked_versions", {}), previous_attributes
+            )
+            for version in table.versions:
+                if (name, version) in module_versions or not registry.contains(name, version):
+                    continue
+                if _compatibility_level_context(table, version) != _compatibility_level_context(
+                    previous_table, version
+                ):
+                    module_versions.add((name, version))
+    finally:
+        previous.close()
+    return sorted(module_versions, key=lambda mv: (mv[0], Version.parse(mv[1]))), sorted(metadata_modules)
+
+
+def apply_patch(work_dir, patch_strip, patch_file):
+    # Behaves like `patch --strip <patch_strip> --force --fuzz 0 --ignore-whitespace`, without spawning it.
+    with tracing.span("patch", "patch", patch=os.path.basename(patch_file)):
+        patcher.apply_patch(
+            read(patch_file), patcher.DirectoryTree(work_dir), strip=patch_strip, ignore_whitespace=True
+        )
+
+
+# Header lines of a (git) unified diff that name the files it touches.
+_PATCH_FILE_HEADER_RE = re.compile(r"^(?:--- |\+\+\+ |Index: |rename from |rename to |copy from |copy to )(.*)$")
+
+
+def patched_files(patch_file, patch_strip):
+    """Return the paths of all files named in the headers of `patch_file`, after stripping
+    `patch_strip` leading components, or None if a file name can't be determined reliably."""
+    files = set()
+    with open(patch_file, "r", encoding="utf-8", errors="surrogateescape") as f:
+        for line in f:
+            m = _PATCH_FILE_HEADER_RE.match(line.rstrip("\r\n"))
+            if not m:
+                continue
+            # The file name ends at a tab, which may be followed by a timestamp. Hand-written
+            # patches sometimes use spaces instead, so consider the first word as well.
+            name = m.group(1).split("\t", 1)[0]
+            if name.startswith('"'):
+                # Quoted names may contain escape sequences.
+                return None
+            for candidate in {name.rstrip(), *name.split()[:1]}:
+                if candidate == "/dev/null":
+                    continue
+                if line.startswith(("rename ", "copy ")):
+                    # Git doesn't prefix these names with a/ and b/.
+                    files.add(candidate)
+                    continue
+                parts = [p for p in candidate.split("/") if p]
+                if len(parts) > patch_strip:
+                    files.add("/".join(parts[patch_strip:]))
+    return files
+
+
+def extract_members(archive_file, format, output_dir, members):
+    """Extract only `members` (paths relative to the archive root) of an archive into `output_dir`.
+
+    Tar archives are read as a stream that stops as soon as all members were found. Returns False
+    if the archive has to be unpacked completely instead, because the format isn't supported or a
+    member, or a directory containing it, is a link in the archive.
+    """
+    wanted = {posixpath.normpath(m) for m in members}
+    wanted = {m for m in wanted if not m.startswith(("../", "/"))}
+    ancestors = set()
+    for member in wanted:
+        parent = posixpath.dirname(member)
+        while parent:
+            ancestors.add(parent)
+            parent = posixpath.dirname(parent)
+    if format not in archives.FORMATS:
+        return False
+    if format == "zip":
+        with archives.open_archive(archive_file, format) as zf:
+            for info in zf.infolist():
+                if not info.is_dir() and posixpath.normpath(info.filename) in wanted:
+                    zf.extract(info, output_dir)
+        return True
+    remaining = set(wanted)
+    with archives.open_archive(archive_file, format) as tar:
+        for member in tar:
+            name = posixpath.normpath(member.name)
+            if (name in wanted or name in ancestors) and (member.issym() or member.islnk()):
+                return False
+            if name in remaining and member.isfile():
+                if sys.version_info >= (3, 12):
+                    tar.extract(member, output_dir, filter="data")
+                else:
+                    tar.extract(member, output_dir)
+                remaining.discard(name)
+                if not remaining:
+                    break
+    return True
 
 
 def fix_line_endings(lines):
@@ -159,6 +366,113 @@ def extract_reference(repo_path, path):
     return None
 
 
+_github_session = None
+_github_session_lock = threading.Lock()
+
+
+def get_github_session():
+    """Return the `requests.Session` shared by all GitHub requests of this process, which keeps their
+    connections alive."""
+    global _github_session
+    with _github_session_lock:
+        if _github_session is None:
+            _github_session = requests.Session()
+            # Allow as many idle connections as `prefetch_github_ref_checks` uses threads.
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=GITHUB_REF_CHECK_THREADS)
+            network = transport.get_network()
+            _github_session.mount("https://", network.requests_adapter(adapter) if network else adapter)
+        return _github_session
+
+
+def set_network(network):
+    """Send all HTTP requests through `network`, see the transport module, or through the real network with None."""
+    global _github_session
+    transport.set_network(network)
+    with _github_session_lock:
+        _github_session = None
+
+
+def make_network(spec):
+    """Return the network for `spec`, which is `("record",)`, `("replay", cassette, latency, bandwidth)` or None
+    for the real network, see `--record_network` and `--replay_network`."""
+    if spec is None:
+        return None
+    if spec[0] == "record":
+        return transport.RecordingNetwork()
+    _, cassette, latency, bandwidth = spec
+    return transport.ReplayNetwork(transport.Cassette.load(cassette), latency, bandwidth)
+
+
+def _github_get(url, headers):
+    tracing.add(tracing.HTTP_REQUESTS)
+    with tracing.span("GET " + urlparse(url).path, "github", url=url):
+        response = get_github_session().get(url, headers=headers)
+    tracing.add(tracing.BYTES_DOWNLOADED, len(response.content))
+    return response
+
+
+class GithubRefCache:
+    """Remembers the answers of `is_ref_in_original_repo` for existing refs, which don't change.
+
+    With a `path`, the answers are also kept in a JSON file mapping `<owner>/<repo>@<ref>` to
+    whether the ref belongs to the repository, so that later runs don't ask GitHub again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._new = {}
+        self._entries = self._load()
+
+    def _load(self):
+        if not self.path:
+            return {}
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def get(self, repo_path, reference):
+        """Return the remembered answer for the ref, or None."""
+        with self._lock:
+            return self._entries.get(f"{repo_path}@{reference}")
+
+    def put(self, repo_path, reference, in_repo):
+        with self._lock:
+            self._entries[f"{repo_path}@{reference}"] = in_repo
+            self._new[f"{repo_path}@{reference}"] = in_repo
+
+    def save(self):
+        """Add the new answers to the file, keeping those that other processes added in the meantime."""
+        with self._lock:
+            new, self._new = self._new, {}
+        if not self.path or not new:
+            return
+        entries = {**self._load(), **new}
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "w") as file:
+            json.dump(entries, file, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+# The `GithubRefCache` of this process, see `get_github_ref_cache`.
+_github_ref_cache = None
+
+
+def set_github_ref_cache(cache):
+    global _github_ref_cache
+    _github_ref_cache = cache
+
+
+def get_github_ref_cache():
+    global _github_ref_cache
+    if _github_ref_cache is None:
+        _github_ref_cache = GithubRefCache()
+    return _github_ref_cache
+
+
 def is_ref_in_original_repo(repo_path, reference) -> bool:
     """
     Checks if the given reference is truly part of the original GitHub repository's history.
@@ -181,11 +495,16 @@ def is_ref_in_original_repo(repo_path, reference) -> bool:
     if re.match(r"^(refs/)?pull/\d+/(head|merge)$", reference):
         return False
 
+    cache = get_github_ref_cache()
+    in_repo = cache.get(repo_path, reference)
+    if in_repo is not None:
+        return in_repo
+
     url = f"https://github.com/{repo_path}/latest-commit/{reference}"
     headers = {"Accept": "application/json"}
 
     try:
-        response = requests.get(url, headers=headers)
+        response = _github_get(url, headers)
     except requests.RequestException:
         raise BcrValidationException(f"Failed to check if reference is from the original repository via {url}")
 
@@ -197,26 +516,82 @@ def is_ref_in_original_repo(repo_path, reference) -> bool:
     if "isSpoofed" not in data:
         raise BcrValidationException(f"Missing 'isSpoofed' attribute in response from {url}: {data}")
 
-    return not data.get("isSpoofed")
+    in_repo = not data.get("isSpoofed")
+    cache.put(repo_path, reference, in_repo)
+    return in_repo
 
 
-def check_github_url(repo_path, source_url):
+def _github_archive_reference(repo_path, source_url):
+    """Return (allowed, reference) for a source URL of the GitHub repository `repo_path`: whether the URL is
+    allowed without further checks, and the ref whose origin has to be checked otherwise, if any."""
     parts = urlparse(source_url)
     # Avoid potential path manipulations with "../"
     normalized_path = os.path.abspath(parts.path)
 
     # If the URL doesn't start with https://github.com/<repo_path>, return False
     if parts.scheme != "https" or parts.netloc != "github.com" or not normalized_path.startswith(f"/{repo_path}/"):
-        return False
+        return False, None
 
     # Allow paths under /<repo_path>/releases/download
     if normalized_path.startswith(f"/{repo_path}/releases/download/"):
-        return True
+        return True, None
 
     # Otherwise, the source archive must match /<repo_path>/archive/<reference>.<extension>
     # And we check if the reference does come from the original repository.
-    reference = extract_reference(repo_path, normalized_path)
-    return reference and is_ref_in_original_repo(repo_path, reference)
+    return False, extract_reference(repo_path, normalized_path)
+
+
+def check_github_url(repo_path, source_url):
+    allowed, reference = _github_archive_reference(repo_path, source_url)
+    return allowed or bool(reference and is_ref_in_original_repo(repo_path, reference))
+
+
+def prefetch_github_ref_checks(registry, module_versions, max_workers=None):
+    """Check concurrently whether the refs of the GitHub archive URLs of `module_versions` belong to their
+    repositories, so that `check_github_url` answers from the `GithubRefCache`. Failures are left for the
+    source_repo check to report."""
+    refs = set()
+    for module_name, version in module_versions:
+        try:
+            # git_repository sources have no URL.
+            source_url = registry.get_source(module_name, version).get("url")
+            repositories = registry.get_metadata(module_name).get("repository", [])
+        except (FileNotFoundError, json.JSONDecodeError):
+            # The existence and source_repo checks report these.
+            continue
+        if not source_url:
+            continue
+        for repository in repositories:
+            match = GITHUB_REPO_RE.match(repository)
+            if match:
+                _, reference = _github_archive_reference(match.group(1), source_url)
+                if reference:
+                    refs.add((match.group(1), reference))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or GITHUB_REF_CHECK_THREADS) as executor:
+        futures = [executor.submit(is_ref_in_original_repo, *ref) for ref in sorted(refs)]
+        for future in futures:
+            try:
+                future.result()
+            except (BcrValidationException, requests.RequestException):
+                # Failed requests, see above.
+                pass
+
+
+# Looks up the GitHub user IDs of maintainers, see `get_github_users`.
+_github_users = None
+
+
+def set_github_users(users):
+    """Look up GitHub user IDs with `users` (a `github_users.GitHubUsers` or None for the default)."""
+    global _github_users
+    _github_users = users
+
+
+def get_github_users():
+    global _github_users
+    if _github_users is None:
+        _github_users = github_users.GitHubUsers(token=os.getenv("GITHUB_TOKEN"), session=get_github_session())
+    return _github_users
 
 
 def get_github_user_id(github_username):
@@ -227,22 +602,15 @@ def get_github_user_id(github_username):
         github_username: The GitHub username to look up.
 
     Returns:
-        The GitHub user ID if found, otherwise None.
+        The GitHub user ID.
+
+    Raises:
+        github_users.GitHubUsersError: If there is no such user or the lookup failed.
     """
-    if github_username in GITHUB_USER_ID_CACHE:
-        return GITHUB_USER_ID_CACHE[github_username]
-
-    url = f"https://api.github.com/users/{github_username}"
-    headers = {}
-    github_token = os.getenv("GITHUB_TOKEN")
-    if github_token:
-        headers["Authorization"] = f"token {github_token}"
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:
-        user_id = response.json().get("id")
-        GITHUB_USER_ID_CACHE[github_username] = user_id
-        return user_id
-    raise requests.HTTPError(f"unexpected {response.status_code} status code from {url}", response=response)
+    user_id = get_github_users().get(github_username)
+    if user_id is None:
+        raise github_users.GitHubUsersError(f"There is no GitHub user named {github_username}.")
+    return user_id
 
 
 def is_valid_bazel_compatibility_for_overlay(bazel_compatibility):
@@ -278,14 +646,243 @@ class BcrValidationException(Exception):
     """
 
 
+class SourceArchiveStore:
+    """Downloads every artifact URL at most once during the validation of a module version.
+
+    The integrity is computed while the file is streamed to disk, so the integrity check,
+    the MODULE.bazel extraction and the attestation verification all share a single download.
+    Files come from the shared `DownloadCache` instead when one is configured. Otherwise they
+    are downloaded into `scratch` and handed back to it as finished work by `close`, so that
+    other module versions with the same source archive can reuse them until they are evicted.
+    Checks of what a URL serves pass `revalidate` so that they aren't answered by the index of
+    the `DownloadCache`.
+    """
+
+    def __init__(self, timeout=None, scratch=None):
+        self.timeout = timeout
+        # Without a scratch space of the validator, keep no downloads once the module version is done.
+        self.scratch = scratch or ScratchSpace(quota=0)
+        # (path, integrities by algorithm, the directory in the scratch space or None) by URL.
+        self._files = {}
+        # The URLs in `_files` that the DownloadCache answered without downloading them again.
+        self._unrevalidated = set()
+
+    def fetch(self, url, expected_integrity=None, revalidate=False):
+        """Return `(path, integrity)` for `url`, where `integrity` uses the algorithm of `expected_integrity`.
+
+        With `revalidate`, `url` is downloaded again unless it already was for this module version.
+        """
+        algorithm = expected_integrity.split("-", 1)[0] if expected_integrity else "sha256"
+        entry = self._files.get(url)
+        if entry is None or (revalidate and url in self._unrevalidated):
+            self._unrevalidated.discard(url)
+            entry = self._files[url] = self._reuse(url, expected_integrity) or self._download(
+                url, expected_integrity, algorithm, revalidate
+            )
+        path, integrities, _ = entry
+        if algorithm not in integrities:
+            integrities[algorithm] = file_integrity(path, algorithm)
+        return path, integrities[algorithm]
+
+    def _reuse(self, url, expected_integrity):
+        """Return the entry of a download of `url` for a previous module version, if it is still around."""
+        finished = self.scratch.reuse(("download", url))
+        if finished is None:
+            return None
+        work_dir, (path, integrities) = finished
+        if expected_integrity:
+            algorithm = expected_integrity.split("-", 1)[0]
+            if algorithm not in integrities:
+                integrities[algorithm] = file_integrity(path, algorithm)
+            # The file at the URL may have changed since, don't reuse a download that doesn't match.
+            if integrities[algorithm] != expected_integrity:
+                self.scratch.remove(work_dir)
+                return None
+        return path, integrities, work_dir
+
+    def _download(self, url, expected_integrity, algorithm, revalidate):
+        with tracing.span("download", "download", url=url):
+            return self._download_uncached(url, expected_integrity, algorithm, revalidate)
+
+    def _download_uncached(self, url, expected_integrity, algorithm, revalidate):
+        cache = get_download_cache()
+        if cache:
+            path, actual = cache.fetch(url, expected_integrity, algorithm, timeout=self.timeout, revalidate=revalidate)
+            if not revalidate:
+                self._unrevalidated.add(url)
+            return path, {algorithm: actual}, None
+        work_dir = self.scratch.new_dir("download")
+        # Keep the original file name, it is used to guess the archive type.
+        path = work_dir / url.split("/")[-1].split("?")[0]
+        try:
+            integrities = download_and_hash(url, (algorithm,), file=path, timeout=self.timeout)
+        except BaseException:
+            self.scratch.remove(work_dir)
+            raise
+        self.scratch.add_usage(work_dir, path.stat().st_size)
+        return path, integrities, work_dir
+
+    def close(self):
+        for url, (path, integrities, work_dir) in self._files.items():
+            if work_dir is not None:
+                self.scratch.finish(("download", url), work_dir, (path, integrities))
+        self._files.clear()
+        self._unrevalidated.clear()
+
+
+def tree_hash(path):
+    """Return a Merkle hash of the directory `path`, covering the names, contents and executable bits
+    of all files below it as well as the targets of symlinks."""
+    h = hashlib.sha256()
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        name = os.fsencode(entry.name)
+        if entry.is_symlink():
+            h.update(b"l %s %s\0" % (name, os.fsencode(os.readlink(entry.path))))
+        elif entry.is_dir():
+            h.update(b"d %s %s\0" % (name, tree_hash(entry.path).encode()))
+        else:
+            executable = entry.stat().st_mode & 0o111 != 0
+            h.update(b"f %s %d %s\0" % (name, executable, hashlib.sha256(read(entry.path)).hexdigest().encode()))
+    return h.hexdigest()
+
+
+def _local_imports(path):
+    """Return the paths of the modules next to `path` that the module at `path` imports, directly or not."""
+    directory = os.path.dirname(path)
+    paths = [path]
+    for current in paths:
+        with warnings.catch_warnings():
+            # E.g. invalid escape sequences, which are reported when the module is imported anyway.
+            warnings.simplefilter("ignore")
+            tree = ast.parse(read(current))
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and not node.level and node.module:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_path = os.path.join(directory, f"{name}.py")
+                if module_path not in paths and os.path.exists(module_path):
+                    paths.append(module_path)
+    return sorted(paths)
+
+
+@functools.cache
+def _validator_code_version():
+    """Return a hash of the code of the validator and all the local modules it imports, so that cached
+    results are dropped whenever any of them changes."""
+    h = hashlib.sha256()
+    for path in _local_imports(os.path.abspath(__file__)):
+        h.update(os.path.basename(path).encode() + b"\0")
+        h.update(read(path))
+    return h.hexdigest()
+
+
+class _Tee(io.TextIOBase):
+    """A text stream that writes to several streams at once."""
+
+    def __init__(self, *streams):
+        self.streams = streams
+
+    def write(self, s):
+        for stream in self.streams:
+            stream.write(s)
+        return len(s)
+
+    def flush(self):
+        for stream in self.streams:
+            stream.flush()
+
+
+class ValidationResultCache:
+    """A persistent cache of the results of the checks of module versions.
+
+    An entry is keyed by the check, a Merkle hash of the module version's directory, the module's
+    metadata.json, whatever other inputs the check reads, the code of the validator and `config`,
+    so a check only runs again after one of them changed. Its printed output and its results are
+    replayed instead. Checks that depend on the network, e.g. whether the source archive URLs
+    are still alive, are only cached if they passed, and only for `ttl` seconds.
+
+    Entries are written atomically to `<root>/<key[:2]>/<key>.json`, so that the `--jobs`
+    workers can share the cache.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, root, ttl=DEFAULT_RESULT_CACHE_TTL_HOURS * 3600, config=None):
+        self.root = Path(root)
+        self.ttl = ttl
+        self._salt = json.dumps([self.FORMAT_VERSION, _validator_code_version(), config or {}], sort_keys=True)
+
+    def key(self, check, module_name, version, inputs):
+        data = json.dumps([self._salt, check, module_name, version, inputs], sort_keys=True)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def _path(self, key):
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key, network=False):
+        """Return the `(output, results)` of a cache entry, or None if there is no usable one."""
+        try:
+            entry = json.loads(self._path(key).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if network and time.time() - entry["time"] > self.ttl:
+            return None
+        return entry["output"], [(BcrValidationResult[type], message) for type, message in entry["results"]]
+
+    def put(self, key, output, results):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {"time": time.time(), "output": output, "results": [[type.name, message] for type, message in results]}
+        tmp = path.with_name(f".{path.name}.{os.getpid()}")
+        tmp.write_text(json.dumps(entry))
+        os.replace(tmp, path)
+
+
 class BcrValidator:
-    def __init__(self, registry, upstream, should_fix, slsa_verifier_version=DEFAULT_SLSA_VERIFIER_VERSION):
+    def __init__(
+        self,
+        registry,
+        upstream,
+        should_fix,
+        slsa_verifier_version=DEFAULT_SLSA_VERIFIER_VERSION,
+        url_timeout=None,
+        check_mirror_sizes=False,
+        result_cache=None,
+        scratch=None,
+    ):
         self.validation_results = []
         self.registry = registry
         self.upstream = upstream
         # Whether the validator should try to fix the detected error.
         self.should_fix = should_fix
-        self._verifier = slsa.Verifier(slsa_verifier_version, tempfile.mkdtemp())
+        # Timeout in seconds for downloading a single source archive URL, None for no limit.
+        self.url_timeout = url_timeout
+        # Whether to compare the sizes of mirror URLs against the main URL before downloading them.
+        self.check_mirror_sizes = check_mirror_sizes
+        # The ScratchSpace for all temporary files, see `_mkdtemp`.
+        self.scratch = scratch or ScratchSpace()
+        # The directory for the temporary files of the module version currently being validated.
+        self._work_dir = None
+        self._verifier = slsa.Verifier(slsa_verifier_version, self.scratch.new_dir("slsa-verifier"))
+        # Artifacts downloaded for the module version currently being validated.
+        self._artifacts = SourceArchiveStore(url_timeout, self.scratch)
+        # A ValidationResultCache to reuse the results of checks whose inputs didn't change, or None.
+        self.result_cache = result_cache
+        # The checks of the current module version whose results were replayed from the result cache.
+        self._replayed_checks = []
+        # The hashes of the current module version's directory and of the module's metadata.json, which are
+        # inputs of all cached checks, or None if there is no result cache or the module version doesn't exist.
+        self._version_hashes = None
+
+    def _mkdtemp(self, label):
+        """Return a new temporary directory, which is removed once the current module version is validated."""
+        return Path(tempfile.mkdtemp(prefix=f"{label}-", dir=self._work_dir or self.scratch.root))
 
     def report(self, type, message):
         color = COLOR[type]
@@ -377,10 +974,32 @@ class BcrValidator:
         for i, mirror_url in enumerate(mirror_urls):
             urls_to_check.append((mirror_url, f"mirror URL #{i + 1}"))
 
+        expected_size = None
+        if self.check_mirror_sizes and mirror_urls:
+            expected_size = self._content_length(source["url"])
+
+        def check(url):
+            # Check what the URLs serve now, not what the download cache remembers they served.
+            if url == source["url"]:
+                return self._artifacts.fetch(url, expected_integrity, revalidate=True)[1]
+            if expected_size is not None:
+                size = self._content_length(url)
+                if size is not None and size != expected_size:
+                    raise ValueError(
+                        f"its size is {size} bytes, but the main source archive URL has {expected_size} bytes"
+                    )
+            return url_integrity_for_comparison(url, expected_integrity, self.url_timeout, revalidate=True)
+
+        # Download and hash all URLs concurrently, but report in a deterministic order. A mirror URL that repeats
+        # the main URL or another mirror is only fetched once, concurrent fetches of a URL would race on its files.
+        urls = list(dict.fromkeys(url for url, _ in urls_to_check))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(urls), 8)) as executor:
+            futures = {url: executor.submit(check, url) for url in urls}
+
         all_good = True
         for url, description in urls_to_check:
             try:
-                real_integrity = integrity_for_comparison(download(url), expected_integrity)
+                real_integrity = futures[url].result()
                 if real_integrity != expected_integrity:
                     self.report(
                         BcrValidationResult.FAILED,
@@ -401,6 +1020,13 @@ class BcrValidator:
                 "The source archive's integrity value matches all provided URLs.",
             )
 
+    def _content_length(self, url):
+        try:
+            return content_length(url, self.url_timeout)
+        except OSError:
+            # Not every server supports HEAD requests, skip the pre-check then.
+            return None
+
     def verify_presubmit_yml_change(self, module_name, version):
         """Verify if the presubmit.yml is similar enough to the previous version."""
         latest_snapshot = self.upstream.get_latest_module_version(module_name)
@@ -478,74 +1104,67 @@ class BcrValidator:
         source_json_content = json.dumps(source, indent=4) + "\n"
         self.registry.get_source_json_path(module_name, version).write_text(source_json_content)
 
-    def _download_source_archive(self, source, output_dir):
+    def _download_source_archive(self, source, output_dir, members=None):
+        """Download the source archive and unpack it into `output_dir`.
+
+        If `members` is given, only these paths are extracted where the archive format allows it.
+        """
         source_url = source["url"]
-        tmp_dir = Path(tempfile.mkdtemp())
-        archive_file = tmp_dir.joinpath(source_url.split("/")[-1].split("?")[0])
-        download_file(source_url, archive_file)
-        # Use archive_type from source.json if specified, otherwise let shutil guess from filename
+        archive_file, _ = self._artifacts.fetch(source_url, source.get("integrity"))
+        archive_name = source_url.split("/")[-1].split("?")[0]
+        with tracing.span("extract", "extract", archive=archive_name, partial=members is not None):
+            self._unpack_source_archive(source, archive_file, archive_name, output_dir, members)
+        if self._work_dir:
+            # Extracted source trees take up the most scratch space, measure them once they are complete.
+            self.scratch.add_usage(self._work_dir, disk_usage(output_dir))
+
+    def _unpack_source_archive(self, source, archive_file, archive_name, output_dir, members):
+        # Use archive_type from source.json if specified, otherwise look at the content of the archive and
+        # only then at the file name in the URL.
         # https://bazel.build/rules/lib/repo/http#http_archive-type
         # https://docs.python.org/3/library/shutil.html#shutil.unpack_archive
-        archive_type = source.get("archive_type")
-        if not archive_type:
-            for ext in ["tar.gz", "tgz", "tar.bz2", "tar.xz", "tar.zst", "tzst", "tar", "zip", "jar", "war", "aar"]:
-                if str(archive_file).endswith("." + ext):
-                    archive_type = ext
-                    break
-        # shutil has no native zstd support, so stream-decompress with the
-        # `zstandard` package straight into tarfile.
-        if archive_type in ("tar.zst", "tzst"):
-            with open(archive_file, "rb") as fh, zstandard.ZstdDecompressor().stream_reader(fh) as reader:
-                with tarfile.open(fileobj=reader, mode="r|") as tar:
-                    if sys.version_info >= (3, 12):
-                        tar.extractall(output_dir, filter="data")
-                    else:
-                        tar.extractall(output_dir)
-            return
         format = {
             "tar.gz": "gztar",
             "tgz": "gztar",
             "tar.bz2": "bztar",
             "tar.xz": "xztar",
+            "tar.zst": "zstdtar",
+            "tzst": "zstdtar",
             "tar": "tar",
             "zip": "zip",
             "jar": "zip",
             "war": "zip",
             "aar": "zip",
-        }.get(archive_type)
+        }.get(source.get("archive_type"))
+        if format is None:
+            format = archives.detect_format(archive_file)
+        if format is None:
+            # Fall back to the file name for other formats registered with shutil.
+            for name, extensions, _ in shutil.get_unpack_formats():
+                if archive_name.endswith(tuple(extensions)):
+                    format = name
+                    break
+        if members is not None and extract_members(archive_file, format, output_dir, members):
+            return
+        if format in archives.FORMATS:
+            archives.extract_all(archive_file, output_dir, format)
+            return
         # Use PEP 706 safe extraction if available (Python 3.12+)
-        if sys.version_info >= (3, 12) and format != "zip":
+        if sys.version_info >= (3, 12):
             shutil.unpack_archive(str(archive_file), output_dir, format=format, filter="data")
         else:
             # Fallback for older Python versions. Since CI is 3.12+, this handles local dev compatibility.
             shutil.unpack_archive(str(archive_file), output_dir, format=format)
 
-    @staticmethod
-    def extract_attribute_from_module(module_dot_bazel_file, attribute, default=None):
-        """Extract the value of the given attribute from `module()` call in the MODULE.bazel file content"""
-        with open(module_dot_bazel_file, "r") as file:
-            tree = ast.parse(file.read(), filename=module_dot_bazel_file)
-            for node in tree.body:
-                if (
-                    isinstance(node, ast.Expr)
-                    and isinstance(node.value, ast.Call)
-                    and isinstance(node.value.func, ast.Name)
-                    and node.value.func.id == "module"
-                ):
-                    for k in node.value.keywords:
-                        if k.arg == attribute:
-                            if isinstance(k.value, ast.Constant):
-                                return k.value.value
-                            if isinstance(k.value, ast.List):
-                                return [v.value for v in k.value.elts if isinstance(v, ast.Constant)]
-                    return default
+    def _compatibility_level_neighbors(self, module_name, version):
+        return self.registry.get_module_attribute_table(module_name).neighbors(version)
 
     def verify_module_dot_bazel(self, module_name, version, check_compatibility_level=True):
         source = self.registry.get_source(module_name, version)
         if source.get("type", "archive") != "archive":
             raise BcrValidationException('Module source "type" must be "archive" (the default)')
 
-        tmp_dir = Path(tempfile.mkdtemp())
+        tmp_dir = self._mkdtemp("module_dot_bazel")
         output_dir = tmp_dir.joinpath("source_root")
         # Validate the stripped output directory.
         strip_prefix = source.get("strip_prefix", "")
@@ -564,7 +1183,23 @@ class BcrValidator:
                 raise BcrValidationException(error_msg)
         source_root = output_dir / strip_prefix
 
-        self._download_source_archive(source, output_dir)
+        # Only MODULE.bazel and the files that patches and overlays touch matter for this check.
+        members = [posixpath.join(strip_prefix, "MODULE.bazel")]
+        patch_strip = int(source.get("patch_strip", 0))
+        for patch_name in source.get("patches", {}):
+            try:
+                files = patched_files(self.registry.get_patch_file_path(module_name, version, patch_name), patch_strip)
+            except OSError:
+                files = None
+            if files is None:
+                members = None
+                break
+            members.extend(posixpath.join(strip_prefix, f) for f in files)
+        if members is not None:
+            members.extend(posixpath.join(strip_prefix, f) for f in source.get("overlay", {}))
+        self._download_source_archive(source, output_dir, members)
+        # Patches may create all files they touch, so the source root doesn't necessarily exist yet.
+        source_root.mkdir(parents=True, exist_ok=True)
 
         module_file = self.registry.get_module_dot_bazel_path(module_name, version)
         if module_file.is_symlink():
@@ -588,7 +1223,13 @@ class BcrValidator:
                         f"The patch file `{patch_name}` is a symlink to `{patch_file.readlink()}`, "
                         "which is not allowed because https://raw.githubusercontent.com/ will not follow it.",
                     )
-                apply_patch(source_root, int(source.get("patch_strip", 0)), str(patch_file.resolve()))
+                try:
+                    apply_patch(source_root, int(source.get("patch_strip", 0)), str(patch_file.resolve()))
+                except patcher.PatchError as e:
+                    error_msg = f"Failed to apply the patch file `{patch_name}`:\n{e}"
+                    self.report(BcrValidationResult.FAILED, error_msg)
+                    shutil.rmtree(tmp_dir)
+                    raise BcrValidationException(error_msg)
         if "overlay" in source:
             overlay_dir = self.registry.get_overlay_dir(module_name, version)
             for overlay_file, expected_integrity in source["overlay"].items():
@@ -658,9 +1299,13 @@ class BcrValidator:
         else:
             self.report(BcrValidationResult.GOOD, "No MODULE.bazel in the source archive.")
 
+        # The attributes of the checked in MODULE.bazel files are parsed once per module and shared between
+        # the checks of all its versions.
+        table = self.registry.get_module_attribute_table(module_name)
+        attributes = table[version]
+
         # Check the version in MODULE.bazel matches the version in directory name
-        version_in_module_dot_bazel = BcrValidator.extract_attribute_from_module(bcr_module_dot_bazel, "version")
-        if version_in_module_dot_bazel != version:
+        if attributes.declared_version != version:
             self.report(
                 BcrValidationResult.FAILED,
                 "Checked in MODULE.bazel version does not match the version of the module directory added.",
@@ -669,18 +1314,10 @@ class BcrValidator:
         # Check the compatibility_level in MODULE.bazel is monotonically increasing. Also cautiously fail if
         # it doesn't match the previous version's compatibility_level. Both checks are skippable.
         if check_compatibility_level:
-            versions = self.registry.get_metadata(module_name)["versions"]
-            versions.sort(key=Version)
-            index = versions.index(version)
-            current_compatibility_level = BcrValidator.extract_attribute_from_module(
-                bcr_module_dot_bazel, "compatibility_level", 0
-            )
-            if index < len(versions) - 1:
-                next_version = versions[index + 1]
-                next_module_dot_bazel = self.registry.get_module_dot_bazel_path(module_name, next_version)
-                next_compatibility_level = BcrValidator.extract_attribute_from_module(
-                    next_module_dot_bazel, "compatibility_level", 0
-                )
+            previous_version, next_version = table.neighbors(version)
+            current_compatibility_level = attributes.compatibility_level
+            if next_version is not None:
+                next_compatibility_level = table[next_version].compatibility_level
                 if current_compatibility_level > next_compatibility_level:
                     self.report(
                         BcrValidationResult.FAILED,
@@ -688,36 +1325,19 @@ class BcrValidator:
                         + "If this is intentional, please comment on your PR `@bazel-io skip_check compatibility_level`\n"
                         + "Learn more about when to increase the compatibility level at https://bazel.build/external/faq#incrementing-compatibility-level",
                     )
-            if index > 0:
-                # Find the most recent non-yanked version before the current one
-                metadata = self.registry.get_metadata(module_name)
-                yanked_versions = metadata.get("yanked_versions", {})
-                previous_version = None
-
-                for i in range(index - 1, -1, -1):
-                    candidate_version = versions[i]
-                    if candidate_version not in yanked_versions:
-                        previous_version = candidate_version
-                        break
-
-                if previous_version is not None:
-                    previous_module_dot_bazel = self.registry.get_module_dot_bazel_path(module_name, previous_version)
-                    previous_compatibility_level = BcrValidator.extract_attribute_from_module(
-                        previous_module_dot_bazel, "compatibility_level", 0
+            if previous_version is not None:
+                previous_compatibility_level = table[previous_version].compatibility_level
+                if current_compatibility_level != previous_compatibility_level:
+                    self.report(
+                        BcrValidationResult.FAILED,
+                        f"The compatibility_level in the new module version ({current_compatibility_level}) doesn't match the previous version ({previous_compatibility_level}).\n"
+                        + "If this is intentional, please comment on your PR `@bazel-io skip_check compatibility_level`\n"
+                        + "Learn more about when to increase the compatibility level at https://bazel.build/external/faq#incrementing-compatibility-level",
                     )
-                    if current_compatibility_level != previous_compatibility_level:
-                        self.report(
-                            BcrValidationResult.FAILED,
-                            f"The compatibility_level in the new module version ({current_compatibility_level}) doesn't match the previous version ({previous_compatibility_level}).\n"
-                            + "If this is intentional, please comment on your PR `@bazel-io skip_check compatibility_level`\n"
-                            + "Learn more about when to increase the compatibility level at https://bazel.build/external/faq#incrementing-compatibility-level",
-                        )
 
         # Check that bazel_compatability is sufficient when using "overlay"
         if "overlay" in source:
-            current_bazel_compatibility = BcrValidator.extract_attribute_from_module(
-                bcr_module_dot_bazel, "bazel_compatibility", []
-            )
+            current_bazel_compatibility = attributes.bazel_compatibility
             if not is_valid_bazel_compatibility_for_overlay(current_bazel_compatibility):
                 self.report(
                     BcrValidationResult.FAILED,
@@ -754,56 +1374,130 @@ class BcrValidator:
         if report_num_new == report_num_old:
             self.report(BcrValidationResult.GOOD, "The presubmit.yml file is valid.")
 
-    def verify_module_name_conflict(self):
-        """Verify no module name conflict when ignoring case sensitivity."""
-        module_names = self.registry.get_all_modules()
-        conflict_found = False
-        module_group = {}
-        for name in module_names:
-            module_group.setdefault(name.lower(), []).append(name)
-
-        for name, modules in module_group.items():
-            if len(modules) > 1:
-                conflict_found = True
-                self.report(
-                    BcrValidationResult.FAILED,
-                    f"Module name conflict found: {', '.join(modules)}",
-                )
-
-        if not conflict_found:
-            self.report(BcrValidationResult.GOOD, "No module name conflict found.")
-
-    def verify_no_symlinks(self):
-        """Check there is no symlink under modules/ dir"""
-        for dirpath, dirnames, filenames in os.walk(self.registry.root / "modules"):
-            for name in dirnames + filenames:
-                full_path = os.path.join(dirpath, name)
-                if os.path.islink(full_path):
-                    self.report(
-                        BcrValidationResult.FAILED,
-                        f"Symlink is not allowed: {full_path}",
-                    )
+    def _run_check(self, check, func, module_name, version, *args, network=False, inputs=()):
+        """Run `func(module_name, version, *args)`, or replay its output and results from the result cache.
+
+        `inputs` are the inputs of the check besides the module version's directory and the module's
+        metadata.json, `network` tells whether it also depends on the network or the upstream registry.
+        """
+        with tracing.span(check, "check", module=module_name, version=version, cached=False) as span_args:
+            if self._version_hashes is None:
+                # No result cache, or the module version doesn't exist and the check reports that.
+                func(module_name, version, *args)
+                return
+            key = self.result_cache.key(check, module_name, version, [*self._version_hashes, list(args), list(inputs)])
+            cached = self.result_cache.get(key, network)
+            if cached:
+                output, results = cached
+                sys.stdout.write(output)
+                self.validation_results.extend(results)
+                self._replayed_checks.append(check)
+                span_args["cached"] = True
+                return
+            first = len(self.validation_results)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(_Tee(sys.stdout, output)):
+                func(module_name, version, *args)
+            results = self.validation_results[first:]
+            # Network failures may be transient, so check again next time.
+            if not (network and any(type == BcrValidationResult.FAILED for type, _ in results)):
+                self.result_cache.put(key, output.getvalue(), results)
+
+    def _module_dot_bazel_inputs(self, module_name, version):
+        """Return the hashes of the other MODULE.bazel files that `verify_module_dot_bazel` compares with."""
+        inputs = []
+        for neighbor in self._compatibility_level_neighbors(module_name, version):
+            if neighbor is not None:
+                path = self.registry.get_module_dot_bazel_path(module_name, neighbor)
+                inputs.append([neighbor, integrity(read(path))])
+        return inputs
 
     def validate_module(self, module_name, version, skipped_validations):
         print_expanded_group(f"Validating {module_name}@{version}")
-        self.verify_module_existence(module_name, version)
-        if "source_repo" not in skipped_validations:
-            self.verify_source_archive_url_match_github_repo(module_name, version)
-        if "url_stability" not in skipped_validations:
-            self.verify_source_archive_url_stability(module_name, version)
-        self.verify_source_archive_url_integrity(module_name, version)
-        if "presubmit_yml" not in skipped_validations:
-            self.verify_presubmit_yml_change(module_name, version)
-        if "presubmit_task" not in skipped_validations:
-            self.validate_presubmit_tasks(module_name, version)
-        self.verify_module_dot_bazel(module_name, version, "compatibility_level" not in skipped_validations)
-        if "attestations" not in skipped_validations:
-            self.verify_attestations(module_name, version)
+        self._replayed_checks = []
+        self._work_dir = self.scratch.new_dir(f"{module_name}@{version}")
+        try:
+            if self.result_cache is not None:
+                # Hashed once for all checks instead of once per check.
+                try:
+                    self._version_hashes = [
+                        tree_hash(self.registry.get_version_dir(module_name, version)),
+                        integrity(read(self.registry.get_metadata_path(module_name))),
+                    ]
+                except FileNotFoundError:
+                    pass
+            with tracing.span(f"{module_name}@{version}", "module", module=module_name, version=version):
+                self._run_check("existence", self.verify_module_existence, module_name, version)
+                if "source_repo" not in skipped_validations:
+                    self._run_check(
+                        "source_repo",
+                        self.verify_source_archive_url_match_github_repo,
+                        module_name,
+                        version,
+                        network=True,
+                    )
+                if "url_stability" not in skipped_validations:
+                    self._run_check("url_stability", self.verify_source_archive_url_stability, module_name, version)
+                self._run_check(
+                    "url_integrity", self.verify_source_archive_url_integrity, module_name, version, network=True
+                )
+                if "presubmit_yml" not in skipped_validations:
+                    self._run_check(
+                        "presubmit_yml", self.verify_presubmit_yml_change, module_name, version, network=True
+                    )
+                if "presubmit_task" not in skipped_validations:
+                    self._run_check("presubmit_task", self.validate_presubmit_tasks, module_name, version)
+                check_compatibility_level = "compatibility_level" not in skipped_validations
+                self._run_check(
+                    "module_dot_bazel",
+                    self.verify_module_dot_bazel,
+                    module_name,
+                    version,
+                    check_compatibility_level,
+                    inputs=(
+                        self._module_dot_bazel_inputs(module_name, version)
+                        if self.result_cache and check_compatibility_level
+                        else ()
+                    ),
+                )
+                if "attestations" not in skipped_validations:
+                    self._run_check("attestations", self.verify_attestations, module_name, version, network=True)
+        finally:
+            # The source archive is only shared between the checks of a single module version, later ones may
+            # reuse it from the scratch space. Everything else the checks left behind is removed.
+            self._artifacts.close()
+            self.scratch.remove(self._work_dir)
+            self._work_dir = None
+            self._version_hashes = None
+            get_github_ref_cache().save()
+        if self._replayed_checks:
+            print(
+                f"Reused the cached results of these unchanged checks: {', '.join(self._replayed_checks)}. "
+                "Pass --no-cache to run them again.\n"
+            )
 
     def validate_metadata(self, modules):
         print_expanded_group(f"Validating metadata.json files for {modules}")
+        self.prefetch_github_user_ids(modules)
+        for module_name in modules:
+            with tracing.span(f"metadata.json of {module_name}", "metadata", module=module_name):
+                self.verify_metadata_json(module_name)
+
+    def prefetch_github_user_ids(self, modules):
+        """Look up the GitHub user IDs of all maintainers of `modules` in as few requests as possible."""
+        logins = set()
         for module_name in modules:
-            self.verify_metadata_json(module_name)
+            try:
+                maintainers = self.registry.get_metadata(module_name).get("maintainers", [])
+            except (FileNotFoundError, json.JSONDecodeError):
+                # verify_metadata_json reports these.
+                continue
+            logins.update(m["github"] for m in maintainers if isinstance(m, dict) and "github" in m)
+        try:
+            get_github_users().prefetch(logins)
+        except (github_users.GitHubUsersError, requests.RequestException):
+            # Users that couldn't be looked up are reported by verify_metadata_json.
+            pass
 
     def verify_metadata_json(self, module_name):
         """Verify the metadata.json file is valid."""
@@ -816,7 +1510,7 @@ class BcrValidator:
             )
             return
 
-        sorted_versions = sorted(metadata["versions"], key=Version)
+        sorted_versions = sorted(metadata["versions"], key=Version.parse)
         if sorted_versions != metadata["versions"]:
             self.report(
                 BcrValidationResult.FAILED,
@@ -932,9 +1626,14 @@ class BcrValidator:
             return
 
         success = True
-        tmp_dir = tempfile.mkdtemp()
+        tmp_dir = self._mkdtemp("attestations")
+        source = self.registry.get_source(module_name, version)
         for attestation in attestations:
             try:
+                if attestation.artifact_url_or_path == source.get("url"):
+                    # Verify the archive that was already downloaded for the integrity check.
+                    archive_file, _ = self._artifacts.fetch(source["url"], source.get("integrity"))
+                    attestation = dataclasses.replace(attestation, artifact_url_or_path=str(archive_file))
                 self._verifier.run(module_name, attestation, source_uri, version, tmp_dir)
             except attestations_lib.Error as ex:
                 self.report(BcrValidationResult.FAILED, f"{module_name}@{version}: {ex}")
@@ -958,10 +1657,23 @@ class BcrValidator:
 
         return f"github.com/{m.group(1)}"
 
-    def global_checks(self):
-        """General global checks for BCR"""
-        self.verify_module_name_conflict()
-        self.verify_no_symlinks()
+    def global_checks(self, jobs=1):
+        """General global checks for BCR, in a single pass over the modules/ directory with `jobs` threads."""
+        modules_dir = self.registry.root / "modules"
+        checks = [
+            (registry_walker.ModuleNameConflictCheck(), "No module name conflict found."),
+            (registry_walker.SymlinkCheck(str(modules_dir)), None),
+            (registry_walker.RequiredFilesCheck(), None),
+        ]
+        with tracing.span("walk_registry", "global"):
+            registry_walker.walk_registry(modules_dir, [check for check, _ in checks], jobs)
+        for check, good_message in checks:
+            for message in check.errors:
+                self.report(BcrValidationResult.FAILED, message)
+            for message in check.warnings:
+                self.report(BcrValidationResult.NEED_BCR_MAINTAINER_REVIEW, message)
+            if good_message and not check.errors:
+                self.report(BcrValidationResult.GOOD, good_message)
 
     def getValidationReturnCode(self):
         # Calculate the overall return code
@@ -977,6 +1689,109 @@ class BcrValidator:
         return 0
 
 
+# The validator of a `--jobs` worker process, see `_init_worker`.
+_worker_validator = None
+
+
+def _init_worker(
+    scratch_dir,
+    scratch_quota,
+    registry_root,
+    index_path,
+    upstream,
+    upstream_cache,
+    download_cache,
+    github_ref_cache,
+    validator_args,
+    trace,
+    network,
+):
+    global _worker_validator
+    # Give every worker its own scratch space in `scratch_dir`, which is removed together with it, with a share of
+    # the quota.
+    scratch = ScratchSpace(scratch_dir, scratch_quota, prefix=f"worker-{os.getpid()}-")
+    tempfile.tempdir = str(scratch.root)
+    if download_cache:
+        set_download_cache(DownloadCache(download_cache))
+    if trace:
+        tracing.set_tracer(tracing.Tracer())
+    # Don't share connections with the parent process.
+    set_network(make_network(network))
+    set_github_ref_cache(GithubRefCache(github_ref_cache))
+    registry = RegistryClient(registry_root, index_path=index_path)
+    upstream = UpstreamRegistry(backend=upstream_backend(upstream, cache_dir=upstream_cache))
+    # Stop e.g. the `git cat-file` process of the upstream registry when the worker exits.
+    multiprocessing.util.Finalize(upstream, upstream.close, exitpriority=0)
+    _worker_validator = BcrValidator(registry, upstream, scratch=scratch, **validator_args)
+
+
+def _validate_module_in_worker(module_name, version, skipped_validations):
+    """Validate a module version and return its captured output, its validation results, the
+    BcrValidationException that stopped the validation, if any, the spans it recorded, the
+    peak usage and evictions of the worker's scratch space and the HTTP interactions it recorded
+    with --record_network."""
+    validator = _worker_validator
+    validator.validation_results = []
+    evictions = validator.scratch.evictions
+    stdout, stderr = io.StringIO(), io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            validator.validate_module(module_name, version, skipped_validations)
+        except BcrValidationException as e:
+            error = e
+    tracer = tracing.get_tracer()
+    spans = tracer.take_spans() if tracer else []
+    scratch_stats = (os.getpid(), validator.scratch.peak_usage, validator.scratch.evictions - evictions)
+    network = transport.get_network()
+    interactions = network.cassette.take_new() if isinstance(network, transport.RecordingNetwork) else []
+    return stdout.getvalue(), stderr.getvalue(), validator.validation_results, error, spans, scratch_stats, interactions
+
+
+def write_trace(spans, jsonl_file=None, chrome_file=None, summary=False):
+    """Write the spans recorded with `--trace_*`, see the tracing module."""
+    if jsonl_file:
+        tracing.write_json_lines(spans, jsonl_file)
+    if chrome_file:
+        tracing.write_chrome_trace(spans, chrome_file)
+    if summary:
+        print_expanded_group("Slowest module versions and checks")
+        print(tracing.summary(spans))
+
+
+def validate_modules_in_parallel(validator, module_versions, skipped_validations, jobs, worker_args):
+    """Validate module versions in `jobs` processes.
+
+    The report of each module version is printed as a whole, in the order of `module_versions`,
+    and its results are added to `validator.validation_results`. The workers create their scratch
+    spaces in the one of `validator` and share its quota equally.
+    """
+    scratch = validator.scratch
+    quota = None if scratch.quota is None else scratch.quota // jobs
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, initializer=_init_worker, initargs=(str(scratch.root), quota, *worker_args)
+    ) as executor:
+        futures = [
+            executor.submit(_validate_module_in_worker, name, version, skipped_validations)
+            for name, version in module_versions
+        ]
+        for future in futures:
+            stdout, stderr, results, error, spans, scratch_stats, interactions = future.result()
+            if tracing.get_tracer():
+                tracing.get_tracer().extend(spans)
+            if interactions:
+                transport.get_network().cassette.extend(interactions)
+            scratch.observe(*scratch_stats)
+            sys.stdout.write(stdout)
+            sys.stdout.flush()
+            sys.stderr.write(stderr)
+            sys.stderr.flush()
+            validator.validation_results.extend(results)
+            if error:
+                executor.shutdown(cancel_futures=True)
+                raise error
+
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
@@ -1001,6 +1816,15 @@ def main(argv=None):
         action="store_true",
         help="Check all Bazel modules in the registry, ignore other --check flags.",
     )
+    parser.add_argument(
+        "--changed_since",
+        "--changed-since",
+        dest="changed_since",
+        type=str,
+        help="Check the module versions and metadata.json files that changed since the merge base of the given "
+        + "git ref (e.g. origin/main) and HEAD, including uncommitted changes, as well as other versions of the "
+        + "changed modules whose compatibility_level check is affected. Can be combined with --check.",
+    )
     parser.add_argument(
         "--check_metadata",
         action="append",
@@ -1029,43 +1853,300 @@ def main(argv=None):
         + '"attestations", to skip the attestations check. '
         + "This flag can be repeated to skip multiple validations.",
     )
+    parser.add_argument(
+        "--download_cache",
+        type=str,
+        help="Specify a directory for a content-addressable cache of downloaded source archives, "
+        + "so that archives already fetched by a previous run are read from disk instead of the network. "
+        + "The source archive URL integrity check still downloads them to verify what the URLs serve "
+        + "(default: $BCR_DOWNLOAD_CACHE if set, otherwise no cache).",
+    )
+    parser.add_argument(
+        "--registry_index",
+        type=str,
+        help="Specify a snapshot file that caches parsed metadata.json, source.json and MODULE.bazel files "
+        + "between runs; it is refreshed incrementally for files that changed "
+        + "(default: $BCR_REGISTRY_INDEX if set, otherwise no index).",
+    )
+    parser.add_argument(
+        "--upstream",
+        type=str,
+        default=UPSTREAM_MODULES_DIR_URL,
+        help="Specify the upstream registry that changes are compared against: the URL of its modules/ directory "
+        + "(e.g. a mirror), a local checkout of the registry, or `git:<repo>[#<ref>]` to read it from a git "
+        + f"repository without a checkout (default: {UPSTREAM_MODULES_DIR_URL}).",
+    )
+    parser.add_argument(
+        "--upstream_cache",
+        type=str,
+        help="Specify a directory to cache files fetched from an HTTP upstream registry; "
+        + "cached files are revalidated with conditional requests (default: no cache).",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Specify the number of module versions to validate in parallel, each in its own process. "
+        + "Reports are still printed one module version at a time, in order. The global checks of the modules/ "
+        + "directory use as many threads (default: 1).",
+    )
+    parser.add_argument(
+        "--scratch_dir",
+        type=str,
+        default=os.getenv(SCRATCH_DIR_ENV),
+        help="Specify a directory to create the directory for temporary files, e.g. extracted source archives, in. "
+        + "A tmpfs speeds up the validation. Everything is removed at the end "
+        + f"(default: ${SCRATCH_DIR_ENV} if set, otherwise the system's temporary directory).",
+    )
+    parser.add_argument(
+        "--scratch_quota",
+        type=int,
+        default=DEFAULT_QUOTA_MB,
+        help="Specify how many MiB of temporary files, i.e. downloaded and extracted source archives, may be used "
+        + "before the source archives downloaded for validated module versions, which other versions with the same "
+        + "source archive reuse, are removed, least recently used first; 0 to remove them right away. With --jobs, "
+        + "every worker gets an equal share. Files in use are never removed, so the peak usage reported at the end "
+        + f"may be higher (default: {DEFAULT_QUOTA_MB}).",
+    )
+    parser.add_argument(
+        "--url_timeout",
+        type=float,
+        help="Specify the maximum number of seconds downloading a source archive from a single URL may take "
+        + "(default: no limit).",
+    )
+    parser.add_argument(
+        "--check_mirror_sizes",
+        action="store_true",
+        help="Before downloading mirror URLs, compare the sizes they announce in response to HEAD requests "
+        + "with the size of the main source archive URL and fail early if they differ.",
+    )
+    parser.add_argument(
+        "--result_cache",
+        type=str,
+        default=os.getenv(RESULT_CACHE_ENV),
+        help="Specify a directory to cache the results of module version checks in. Checks whose inputs "
+        + "(the module version's files, metadata.json, the validator's code and flags) didn't change since a "
+        + "previous run are skipped and their results are replayed; ignored with --fix "
+        + f"(default: ${RESULT_CACHE_ENV} if set, otherwise no cache).",
+    )
+    parser.add_argument(
+        "--result_cache_ttl",
+        type=float,
+        default=DEFAULT_RESULT_CACHE_TTL_HOURS,
+        help="Specify for how many hours the cached results of checks that depend on the network or the upstream "
+        + "registry, e.g. whether the source archive URLs are alive, are reused. Failures of these checks are "
+        + f"never cached (default: {DEFAULT_RESULT_CACHE_TTL_HOURS}).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        "--no_cache",
+        dest="no_cache",
+        action="store_true",
+        help=f"Run all checks, even if --result_cache or ${RESULT_CACHE_ENV} is set.",
+    )
+    parser.add_argument(
+        "--github_user_cache",
+        type=str,
+        default=os.getenv(github_users.USER_ID_CACHE_ENV),
+        help="Specify a file to cache the GitHub user IDs of maintainers in, so that they aren't looked up again by "
+        + f"the next run (default: ${github_users.USER_ID_CACHE_ENV} if set, otherwise no cache).",
+    )
+    parser.add_argument(
+        "--github_user_cache_ttl",
+        type=float,
+        default=github_users.DEFAULT_USER_ID_CACHE_TTL_HOURS,
+        help="Specify for how many hours cached GitHub user IDs are reused "
+        + f"(default: {github_users.DEFAULT_USER_ID_CACHE_TTL_HOURS}).",
+    )
+    parser.add_argument(
+        "--github_ref_cache",
+        type=str,
+        default=os.getenv(GITHUB_REF_CACHE_ENV),
+        help="Specify a file to remember whether the refs of GitHub archive URLs belong to their repository in, "
+        + f"so that the next run doesn't ask GitHub again (default: ${GITHUB_REF_CACHE_ENV} if set, otherwise no "
+        + "cache).",
+    )
+    parser.add_argument(
+        "--record_network",
+        type=str,
+        metavar="CASSETTE",
+        help="Record the responses to all HTTP requests, e.g. source archive downloads, upstream registry files and "
+        + "GitHub API calls, into a compressed cassette file for --replay_network.",
+    )
+    parser.add_argument(
+        "--replay_network",
+        type=str,
+        metavar="CASSETTE",
+        help="Answer all HTTP requests from a cassette written by --record_network instead of the network, "
+        + "requests that weren't recorded fail. Use the same flags, in particular the same caches, as for recording.",
+    )
+    parser.add_argument(
+        "--replay_latency",
+        type=float,
+        default=0.0,
+        help="Specify how many seconds every replayed response takes to arrive (default: 0).",
+    )
+    parser.add_argument(
+        "--replay_bandwidth",
+        type=float,
+        help="Specify how many MiB per second of a replayed response arrive (default: no limit).",
+    )
+    parser.add_argument(
+        "--trace_jsonl",
+        type=str,
+        help="Specify a file to write the timing of every check, module version, download, archive extraction, "
+        + "patch and GitHub API request to, as one JSON object per line with the wall and CPU time, the "
+        + "downloaded bytes, the HTTP requests and the spawned processes.",
+    )
+    parser.add_argument(
+        "--trace_chrome",
+        type=str,
+        help="Like --trace_jsonl, but in the Chrome trace event format, to be opened with chrome://tracing or "
+        + "https://ui.perfetto.dev.",
+    )
+    parser.add_argument(
+        "--trace_summary",
+        action="store_true",
+        help="Print tables of the slowest module versions and checks at the end.",
+    )
 
     args = parser.parse_args(argv)
 
-    if not args.check_all and not args.check and not args.check_all_metadata and not args.check_metadata:
+    if (
+        not args.check_all
+        and not args.check
+        and not args.changed_since
+        and not args.check_all_metadata
+        and not args.check_metadata
+    ):
         parser.print_help()
         return -1
 
-    registry = RegistryClient(args.registry)
+    if args.record_network and args.replay_network:
+        parser.error("--record_network and --replay_network can't be combined.")
 
-    # Parse what module versions we should validate
-    module_versions = parse_module_versions(registry, args.check_all, args.check)
-    if module_versions:
-        print_expanded_group("Module versions to be validated:")
-        for name, version in module_versions:
-            print(f"{name}@{version}")
-
-    # TODO: Read url from flags to support forks.
-    upstream = UpstreamRegistry(modules_dir_url=UPSTREAM_MODULES_DIR_URL)
-
-    # Validate given module version.
-    validator = BcrValidator(registry, upstream, args.fix)
-    for name, version in module_versions:
-        validator.validate_module(name, version, args.skip_validation)
-
-    if args.check_all_metadata:
-        # Validate all metadata.json
-        validator.validate_metadata(validator.registry.get_all_modules())
-    else:
-        # Validate metadata.json for given modules and all modified modules.
-        modules = [] if not args.check_metadata else args.check_metadata
-        modules_to_validate = set(modules + [name for name, _ in module_versions])
-        validator.validate_metadata(list(modules_to_validate))
-
-    # Perform some global checks
-    validator.global_checks()
-
-    return validator.getValidationReturnCode()
+    network_spec = None
+    if args.record_network:
+        network_spec = ("record",)
+    elif args.replay_network:
+        bandwidth = args.replay_bandwidth * 1024 * 1024 if args.replay_bandwidth else None
+        network_spec = ("replay", args.replay_network, args.replay_latency, bandwidth)
+    try:
+        network = make_network(network_spec)
+    except transport.CassetteError as e:
+        parser.error(str(e))
+    set_network(network)
+
+    scratch = ScratchSpace(args.scratch_dir, args.scratch_quota * 1024 * 1024)
+    # The temporary files of the libraries we use, e.g. for applying patches, end up in the scratch space, too.
+    default_tempdir, tempfile.tempdir = tempfile.tempdir, str(scratch.root)
+    tracer = tracing.Tracer() if args.trace_jsonl or args.trace_chrome or args.trace_summary else None
+    tracing.set_tracer(tracer)
+    upstream = None
+    try:
+        registry = RegistryClient(args.registry, index_path=args.registry_index)
+        if args.download_cache:
+            set_download_cache(DownloadCache(args.download_cache))
+        user_id_cache = None
+        if args.github_user_cache:
+            user_id_cache = github_users.UserIdCache(args.github_user_cache, ttl=args.github_user_cache_ttl * 3600)
+        set_github_users(
+            github_users.GitHubUsers(token=os.getenv("GITHUB_TOKEN"), cache=user_id_cache, session=get_github_session())
+        )
+        set_github_ref_cache(GithubRefCache(args.github_ref_cache))
+
+        # Parse what module versions we should validate
+        module_versions = parse_module_versions(registry, args.check_all, args.check)
+        changed_metadata = []
+        if args.changed_since and not args.check_all:
+            changed_versions, changed_metadata = parse_changed_module_versions(registry, args.changed_since)
+            module_versions += [mv for mv in changed_versions if mv not in module_versions]
+            if not changed_versions and not changed_metadata:
+                print(f"No module versions or metadata.json files changed since {args.changed_since}.")
+        if module_versions:
+            print_expanded_group("Module versions to be validated:")
+            for name, version in module_versions:
+                print(f"{name}@{version}")
+
+        upstream = UpstreamRegistry(backend=upstream_backend(args.upstream, cache_dir=args.upstream_cache))
+
+        # Validate given module version.
+        validator_args = dict(
+            should_fix=args.fix,
+            url_timeout=args.url_timeout,
+            check_mirror_sizes=args.check_mirror_sizes,
+        )
+        # Fixes change the registry, so don't skip any check then.
+        if args.result_cache and not args.no_cache and not args.fix:
+            validator_args["result_cache"] = ValidationResultCache(
+                args.result_cache,
+                ttl=args.result_cache_ttl * 3600,
+                config=dict(
+                    url_timeout=args.url_timeout,
+                    check_mirror_sizes=args.check_mirror_sizes,
+                    upstream=args.upstream,
+                ),
+            )
+        validator = BcrValidator(registry, upstream, scratch=scratch, **validator_args)
+        if args.check_all_metadata:
+            # Validate all metadata.json
+            metadata_modules = validator.registry.get_all_modules()
+        else:
+            # Validate metadata.json for given modules and all modified modules.
+            modules = [] if not args.check_metadata else args.check_metadata
+            metadata_modules = list(set(modules + changed_metadata + [name for name, _ in module_versions]))
+
+        # Fetch what the checks need from the network in the background while the module versions are validated.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            prefetches = [executor.submit(validator.prefetch_github_user_ids, metadata_modules)]
+            if args.jobs > 1 and len(module_versions) > 1:
+                worker_args = (
+                    args.registry,
+                    args.registry_index,
+                    args.upstream,
+                    args.upstream_cache,
+                    args.download_cache,
+                    args.github_ref_cache,
+                    validator_args,
+                    tracing.get_tracer() is not None,
+                    network_spec,
+                )
+                validate_modules_in_parallel(validator, module_versions, args.skip_validation, args.jobs, worker_args)
+            else:
+                # The upstream files the presubmit.yml and attestations checks need and the refs of GitHub archive
+                # URLs are only shared within this process.
+                if not {"presubmit_yml", "attestations"}.issubset(args.skip_validation):
+                    prefetches.append(executor.submit(upstream.prefetch, sorted({name for name, _ in module_versions})))
+                if "source_repo" not in args.skip_validation:
+                    prefetches.append(executor.submit(prefetch_github_ref_checks, registry, module_versions))
+                for name, version in module_versions:
+                    validator.validate_module(name, version, args.skip_validation)
+            # Network failures are left for the checks to report, anything else is a bug.
+            for future in prefetches:
+                future.result()
+
+        validator.validate_metadata(metadata_modules)
+
+        # Perform some global checks
+        validator.global_checks(jobs=args.jobs)
+        registry.save_index()
+
+        return validator.getValidationReturnCode()
+    finally:
+        if upstream:
+            upstream.close()
+        tracing.set_tracer(None)
+        tempfile.tempdir = default_tempdir
+        scratch.close()
+        set_network(None)
+        if args.record_network:
+            network.cassette.save(args.record_network)
+            print(f"Recorded {len(network.cassette)} HTTP requests into {args.record_network}.", file=sys.stderr)
+        # Not part of the report on stdout, which doesn't depend on --jobs.
+        evicted = f", {scratch.evictions} downloads were removed to stay below the quota" if scratch.evictions else ""
+        print(f"Peak scratch space usage: {scratch.peak_usage / 2**20:.1f} MiB{evicted}.", file=sys.stderr)
+        if tracer:
+            write_trace(tracer.spans, args.trace_jsonl, args.trace_chrome, args.trace_summary)
 
 
 if __name__ == "__main__":
@@ -14,11 +14,31 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import contextlib
+import functools
+import http.server
+import io
+import json
+import os
+import requests
+import subprocess
+import tarfile
+import tempfile
+import threading
 import unittest
+import zipfile
+from pathlib import Path
+from registry import DownloadCache
 from registry import RegistryClient
+from registry import set_download_cache
+from registry import hash_chunks
+from scratch import ScratchSpace
+import transport
+from tools import bcr_validation
 from tools.bcr_validation import BcrValidator, BcrValidationException, is_ref_in_original_repo
 
 from unittest.mock import MagicMock
+from unittest.mock import patch
 
 
 class TestBcrValidation(unittest.TestCase):
@@ -66,5 +86,683 @@ class TestBcrValidation(unittest.TestCase):
             self.assertFalse(is_ref_in_original_repo("fake/repo", ref), ref)
 
 
+class TestSourceArchiveStore(unittest.TestCase):
+    URL = "https://example.com/foo/archive/v1.0.tar.gz"
+
+    def setUp(self):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+            content = b'module(name = "foo", version = "1.0")\n'
+            info = tarfile.TarInfo("foo-1.0/MODULE.bazel")
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        self.archive = buf.getvalue()
+        self.downloads = []
+
+        def fake_download_and_hash(url, algorithms=("sha256",), file=None, timeout=None):
+            self.downloads.append(url)
+            return hash_chunks([self.archive], algorithms, file)
+
+        patcher = patch.object(bcr_validation, "download_and_hash", side_effect=fake_download_and_hash)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_downloads_once_per_validation(self):
+        registry = RegistryClient("/fake")
+        validator = BcrValidator(registry=registry, upstream=None, should_fix=False)
+        integrity = bcr_validation.integrity(self.archive)
+        registry.get_source = MagicMock(return_value={"url": self.URL, "integrity": integrity})
+
+        validator.verify_source_archive_url_integrity("foo", "1.0")
+        with tempfile.TemporaryDirectory() as output_dir:
+            validator._download_source_archive(registry.get_source("foo", "1.0"), output_dir)
+            self.assertTrue(Path(output_dir, "foo-1.0", "MODULE.bazel").exists())
+        self.assertEqual(self.downloads, [self.URL])
+        self.assertEqual(validator.validation_results[-1][0], bcr_validation.BcrValidationResult.GOOD)
+
+    def test_reports_integrity_mismatch(self):
+        store = bcr_validation.SourceArchiveStore()
+        self.addCleanup(store.close)
+        path, actual = store.fetch(self.URL, "sha256-AAAA")
+        self.assertNotEqual(actual, "sha256-AAAA")
+        self.assertEqual(path.read_bytes(), self.archive)
+        self.assertEqual(path.name, "v1.0.tar.gz")
+        # Other algorithms are computed from the local file.
+        self.assertEqual(store.fetch(self.URL, "sha512-AAAA")[1], bcr_validation.integrity(self.archive, "sha512"))
+        self.assertEqual(self.downloads, [self.URL])
+        store.close()
+        self.assertFalse(path.exists())
+
+    def test_downloads_are_reused_by_later_module_versions(self):
+        scratch = ScratchSpace()
+        self.addCleanup(scratch.close)
+        store = bcr_validation.SourceArchiveStore(scratch=scratch)
+        integrity = bcr_validation.integrity(self.archive)
+        path, _ = store.fetch(self.URL)
+        store.close()
+        self.assertTrue(path.exists())
+        self.assertEqual(store.fetch(self.URL, integrity), (path, integrity))
+        store.close()
+        # The file at the URL changed in the meantime.
+        store.fetch(self.URL, "sha256-AAAA")
+        store.close()
+        self.assertFalse(path.exists())
+        self.assertEqual(self.downloads, [self.URL, self.URL])
+
+    def test_mirror_size_check(self):
+        registry = RegistryClient("/fake")
+        validator = BcrValidator(registry=registry, upstream=None, should_fix=False, check_mirror_sizes=True)
+        integrity = bcr_validation.integrity(self.archive)
+        mirrors = ["https://mirror.example.com/good.tar.gz", "https://mirror.example.com/truncated.tar.gz"]
+        registry.get_source = MagicMock(return_value={"url": self.URL, "integrity": integrity, "mirror_urls": mirrors})
+        sizes = {self.URL: len(self.archive), mirrors[0]: len(self.archive), mirrors[1]: 10}
+
+        with patch.object(bcr_validation, "content_length", side_effect=lambda url, timeout: sizes[url]), patch.object(
+            bcr_validation, "url_integrity_for_comparison", return_value=integrity
+        ) as url_integrity:
+            validator.verify_source_archive_url_integrity("foo", "1.0")
+
+        # The truncated mirror is never downloaded.
+        url_integrity.assert_called_once_with(mirrors[0], integrity, None, revalidate=True)
+        self.assertEqual(len(validator.validation_results), 1)
+        result, message = validator.validation_results[0]
+        self.assertEqual(result, bcr_validation.BcrValidationResult.FAILED)
+        self.assertIn("mirror URL #2", message)
+        self.assertIn("its size is 10 bytes", message)
+
+    def test_repeated_mirror_urls_are_fetched_once(self):
+        registry = RegistryClient("/fake")
+        validator = BcrValidator(registry=registry, upstream=None, should_fix=False)
+        self.addCleanup(validator.scratch.close)
+        integrity = bcr_validation.integrity(self.archive)
+        mirror = "https://mirror.example.com/foo.tar.gz"
+        source = {"url": self.URL, "integrity": integrity, "mirror_urls": [self.URL, mirror, mirror]}
+        registry.get_source = MagicMock(return_value=source)
+
+        with patch.object(bcr_validation, "url_integrity_for_comparison", return_value=integrity) as url_integrity:
+            validator.verify_source_archive_url_integrity("foo", "1.0")
+
+        self.assertEqual(self.downloads, [self.URL])
+        url_integrity.assert_called_once_with(mirror, integrity, None, revalidate=True)
+        self.assertEqual(
+            validator.validation_results,
+            [
+                (
+                    bcr_validation.BcrValidationResult.GOOD,
+                    "The source archive's integrity value matches all provided URLs.",
+                )
+            ],
+        )
+
+
+def make_tar_gz(path, files, symlinks=None):
+    with tarfile.open(path, mode="w:gz") as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        for name, target in (symlinks or {}).items():
+            info = tarfile.TarInfo(name)
+            info.type = tarfile.SYMTYPE
+            info.linkname = target
+            tar.addfile(info)
+
+
+class TestSelectiveExtraction(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+
+    def test_patched_files(self):
+        patch_file = self.tmp / "fix.patch"
+        patch_file.write_text(
+            "--- a/MODULE.bazel\t2024-01-01 00:00:00\n"
+            "+++ b/MODULE.bazel\t2024-01-01 00:00:00\n"
+            "@@ -1 +1 @@\n"
+            "-old\n"
+            "+new\n"
+            "diff --git a/src/old.c b/src/new.c\n"
+            "rename from src/old.c\n"
+            "rename to src/new.c\n"
+            "--- /dev/null\n"
+            "+++ b/BUILD.bazel\n"
+        )
+        self.assertEqual(
+            bcr_validation.patched_files(patch_file, 1),
+            {"MODULE.bazel", "src/old.c", "src/new.c", "BUILD.bazel"},
+        )
+        patch_file.write_text('--- "a/with\\ttab"\n')
+        self.assertIsNone(bcr_validation.patched_files(patch_file, 1))
+
+    def test_extract_members_from_tar(self):
+        archive = self.tmp / "foo.tar.gz"
+        files = {f"foo-1.0/src/{i}.c": b"x" * 100 for i in range(100)}
+        files["foo-1.0/MODULE.bazel"] = b"module()"
+        make_tar_gz(archive, files)
+        output_dir = self.tmp / "out"
+        members = ["foo-1.0/MODULE.bazel", "foo-1.0/src/7.c", "foo-1.0/missing.txt"]
+        self.assertTrue(bcr_validation.extract_members(archive, "gztar", output_dir, members))
+        extracted = sorted(str(p.relative_to(output_dir)) for p in output_dir.rglob("*") if p.is_file())
+        self.assertEqual(extracted, ["foo-1.0/MODULE.bazel", "foo-1.0/src/7.c"])
+
+    def test_extract_members_from_zip(self):
+        archive = self.tmp / "foo.zip"
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("foo/MODULE.bazel", b"module()")
+            zf.writestr("foo/BUILD", b"")
+        output_dir = self.tmp / "out"
+        self.assertTrue(bcr_validation.extract_members(archive, "zip", output_dir, ["foo/MODULE.bazel"]))
+        self.assertTrue((output_dir / "foo" / "MODULE.bazel").exists())
+        self.assertFalse((output_dir / "foo" / "BUILD").exists())
+
+    def test_links_require_full_extraction(self):
+        archive = self.tmp / "foo.tar.gz"
+        make_tar_gz(archive, {"foo/real/MODULE.bazel": b"module()"}, symlinks={"foo/link": "real"})
+        output_dir = self.tmp / "out"
+        self.assertFalse(bcr_validation.extract_members(archive, "gztar", output_dir, ["foo/link/MODULE.bazel"]))
+        self.assertFalse(bcr_validation.extract_members(archive, "7z", output_dir, ["foo/MODULE.bazel"]))
+
+    def test_format_is_detected_from_content(self):
+        # A zip archive served under a .tar.gz name.
+        archive = self.tmp / "download"
+        with zipfile.ZipFile(archive, "w") as zf:
+            zf.writestr("foo/MODULE.bazel", b"module()")
+        validator = BcrValidator(registry=RegistryClient(self.tmp), upstream=None, should_fix=False)
+        validator._unpack_source_archive({}, archive, "foo-1.0.tar.gz", self.tmp / "out", None)
+        self.assertEqual((self.tmp / "out" / "foo" / "MODULE.bazel").read_bytes(), b"module()")
+
+    def test_verify_module_dot_bazel_with_patch(self):
+        registry_root = self.tmp / "registry"
+        version_dir = registry_root / "modules" / "foo" / "1.0"
+        (version_dir / "patches").mkdir(parents=True)
+        (version_dir.parent / "metadata.json").write_text('{"versions": ["1.0"]}')
+        (version_dir / "MODULE.bazel").write_text('module(name = "foo", version = "1.0")\n')
+        patch_file = version_dir / "patches" / "module_dot_bazel.patch"
+        patch_file.write_text(
+            "--- a/MODULE.bazel\n"
+            "+++ b/MODULE.bazel\n"
+            "@@ -1 +1 @@\n"
+            '-module(name = "foo", version = "0.0.0")\n'
+            '+module(name = "foo", version = "1.0")\n'
+        )
+        archive = self.tmp / "foo-1.0.tar.gz"
+        files = {f"foo-1.0/src/{i}.c": b"x" for i in range(50)}
+        files["foo-1.0/MODULE.bazel"] = b'module(name = "foo", version = "0.0.0")\n'
+        make_tar_gz(archive, files)
+        source = {
+            "url": "https://example.com/foo-1.0.tar.gz",
+            "integrity": bcr_validation.integrity(archive.read_bytes()),
+            "strip_prefix": "foo-1.0",
+            "patch_strip": 1,
+            "patches": {"module_dot_bazel.patch": bcr_validation.integrity(patch_file.read_bytes())},
+        }
+        (version_dir / "source.json").write_text(json.dumps(source))
+
+        validator = BcrValidator(registry=RegistryClient(registry_root), upstream=None, should_fix=False)
+        fetch = MagicMock(return_value=(archive, source["integrity"]))
+        with patch.object(validator._artifacts, "fetch", fetch), patch.object(
+            bcr_validation, "extract_members", wraps=bcr_validation.extract_members
+        ) as extract_members:
+            validator.verify_module_dot_bazel("foo", "1.0", check_compatibility_level=False)
+
+        self.assertEqual(
+            extract_members.call_args.args[3],
+            ["foo-1.0/MODULE.bazel", "foo-1.0/MODULE.bazel"],
+        )
+        self.assertIn(
+            (bcr_validation.BcrValidationResult.GOOD, "Checked in MODULE.bazel matches the sources."),
+            validator.validation_results,
+        )
+
+
+class ValidationTestCase(unittest.TestCase):
+    """Sets up a registry with a few module versions whose source archives are served over HTTP."""
+
+    MODULES = ["foo", "bar", "baz"]
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.registry = Path(tmp.name, "registry")
+        self.download_cache = Path(tmp.name, "cache")
+        self.www = Path(tmp.name, "www")
+        self.www.mkdir()
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=str(self.www))
+        handler.log_message = lambda *args: None
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        for name in self.MODULES:
+            module_dot_bazel = f'module(name = "{name}", version = "1.0")\n'.encode()
+            buf = io.BytesIO()
+            with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+                info = tarfile.TarInfo(f"{name}-1.0/MODULE.bazel")
+                info.size = len(module_dot_bazel)
+                tar.addfile(info, io.BytesIO(module_dot_bazel))
+            archive_integrity = bcr_validation.integrity(buf.getvalue())
+            (self.www / f"{name}-1.0.tar.gz").write_bytes(buf.getvalue())
+            url = f"http://127.0.0.1:{self.server.server_address[1]}/{name}-1.0.tar.gz"
+
+            version_dir = self.registry / "modules" / name / "1.0"
+            version_dir.mkdir(parents=True)
+            (version_dir / "MODULE.bazel").write_bytes(module_dot_bazel)
+            source = {"url": url, "integrity": archive_integrity, "strip_prefix": f"{name}-1.0"}
+            (version_dir / "source.json").write_text(json.dumps(source))
+            (version_dir / "presubmit.yml").write_text("bcr_test_module: {}\n")
+            metadata = {"maintainers": [], "repository": [], "versions": ["1.0"], "yanked_versions": {}}
+            (version_dir.parent / "metadata.json").write_text(json.dumps(metadata))
+        self.addCleanup(set_download_cache, None)
+
+    SKIPPED = ["url_stability", "presubmit_yml", "presubmit_task", "source_repo", "attestations"]
+
+    def run_main(self, jobs=1, extra_args=(), download_cache=True, skipped=SKIPPED):
+        argv = [f"--registry={self.registry}", f"--jobs={jobs}", f"--upstream={self.registry}", *extra_args]
+        if download_cache:
+            argv.append(f"--download_cache={self.download_cache}")
+        argv += [f"--check={name}@1.0" for name in self.MODULES]
+        argv += [f"--skip_validation={check}" for check in skipped]
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            returncode = bcr_validation.main(argv)
+        return returncode, out.getvalue()
+
+
+class TestParallelValidation(ValidationTestCase):
+    def test_reports_match_serial_run(self):
+        serial_returncode, serial_output = self.run_main(jobs=1)
+        parallel_returncode, parallel_output = self.run_main(jobs=3)
+        self.assertEqual(serial_returncode, 0, serial_output)
+        self.assertEqual(parallel_returncode, serial_returncode)
+        self.assertEqual(parallel_output, serial_output)
+        positions = [parallel_output.index(f"Validating {name}@1.0") for name in self.MODULES]
+        self.assertEqual(positions, sorted(positions))
+
+
+class TestScratchSpace(ValidationTestCase):
+    def test_work_dirs_are_removed(self):
+        set_download_cache(DownloadCache(self.download_cache))
+        validator = BcrValidator(RegistryClient(self.registry), upstream=None, should_fix=False)
+        self.addCleanup(validator.scratch.close)
+        validator.validate_module("foo", "1.0", self.SKIPPED)
+        self.assertIn(
+            (bcr_validation.BcrValidationResult.GOOD, "Checked in MODULE.bazel matches the sources."),
+            validator.validation_results,
+        )
+        self.assertEqual([path.name.split("-")[0] for path in validator.scratch.root.iterdir()], ["slsa"])
+        # The download is in the download cache, so the usage was that of the extracted source tree.
+        self.assertGreater(validator.scratch.peak_usage, 0)
+        self.assertEqual(validator.scratch.usage(), 0)
+
+    def test_scratch_dir_is_removed(self):
+        scratch_dir = self.registry.parent / "scratch"
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                err = io.StringIO()
+                with contextlib.redirect_stderr(err):
+                    returncode, output = self.run_main(jobs=jobs, extra_args=[f"--scratch_dir={scratch_dir}"])
+                self.assertEqual(returncode, 0, output)
+                self.assertEqual(list(scratch_dir.iterdir()), [])
+                self.assertRegex(err.getvalue(), r"Peak scratch space usage: \d+\.\d MiB\.")
+
+
+class TestDownloadCacheRevalidation(ValidationTestCase):
+    def test_url_integrity_is_checked_against_the_url(self):
+        # The download cache remembers that the URL served the expected archive, but it changed since.
+        source = json.loads((self.registry / "modules" / "foo" / "1.0" / "source.json").read_text())
+        DownloadCache(self.download_cache).fetch(source["url"], source["integrity"])
+        module_dot_bazel = (self.registry / "modules" / "foo" / "1.0" / "MODULE.bazel").read_bytes()
+        with tarfile.open(self.www / "foo-1.0.tar.gz", "w:gz") as tar:
+            info = tarfile.TarInfo("foo-1.0/MODULE.bazel")
+            info.size = len(module_dot_bazel)
+            tar.addfile(info, io.BytesIO(module_dot_bazel))
+            tar.addfile(tarfile.TarInfo("foo-1.0/changed"), io.BytesIO())
+        returncode, output = self.run_main()
+        self.assertEqual(returncode, 1)
+        self.assertIn(f"foo@1.0's main source archive URL `{source['url']}` has expected integrity value", output)
+
+
+class TestUpstreamRegistry(ValidationTestCase):
+    def test_is_closed(self):
+        with patch.object(bcr_validation.UpstreamRegistry, "close", autospec=True) as close:
+            returncode, output = self.run_main()
+        self.assertEqual(returncode, 0, output)
+        close.assert_called_once()
+
+
+class TestNetworkReplay(ValidationTestCase):
+    def test_replay_without_network(self):
+        cassette = self.registry.parent / "network.cassette"
+        returncode, recorded_output = self.run_main(
+            jobs=2, download_cache=False, extra_args=[f"--record_network={cassette}"]
+        )
+        self.assertEqual(returncode, 0, recorded_output)
+        # The source archive of every module version, downloaded in the worker processes.
+        self.assertEqual(len(transport.Cassette.load(cassette)), len(self.MODULES))
+        self.server.shutdown()
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                returncode, output = self.run_main(
+                    jobs=jobs,
+                    download_cache=False,
+                    extra_args=[f"--replay_network={cassette}", "--replay_latency=0.01"],
+                )
+                self.assertEqual(returncode, 0, output)
+                self.assertEqual(output, recorded_output)
+
+    def test_missing_cassette(self):
+        with self.assertRaises(SystemExit), contextlib.redirect_stderr(io.StringIO()) as err:
+            self.run_main(extra_args=[f"--replay_network={self.registry.parent / 'missing'}"])
+        self.assertIn("missing", err.getvalue())
+
+
+class TestResultCache(ValidationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.result_cache = self.registry.parent / "results"
+
+    def run_cached(self, *extra_args):
+        return self.run_main(extra_args=[f"--result_cache={self.result_cache}", *extra_args])
+
+    def test_replays_unchanged_checks(self):
+        returncode, output = self.run_cached()
+        self.assertEqual(returncode, 0, output)
+        self.assertNotIn("Reused the cached results", output)
+        with patch.object(bcr_validation.BcrValidator, "verify_module_dot_bazel", side_effect=AssertionError):
+            cached_returncode, cached_output = self.run_cached()
+        self.assertEqual(cached_returncode, 0)
+        reused = "Reused the cached results of these unchanged checks: existence, url_integrity, module_dot_bazel."
+        self.assertEqual(cached_output.count(reused), len(self.MODULES))
+        # Apart from that note, the report is the same.
+        self.assertEqual(cached_output.replace(reused + " Pass --no-cache to run them again.\n\n", ""), output)
+
+    def test_checks_changed_module_versions_again(self):
+        self.run_cached()
+        module_dot_bazel = self.registry / "modules" / "foo" / "1.0" / "MODULE.bazel"
+        module_dot_bazel.write_text(module_dot_bazel.read_text() + "# changed\n")
+        returncode, output = self.run_cached()
+        self.assertEqual(returncode, 1)
+        self.assertIn("Checked in MODULE.bazel file doesn't match", output)
+        self.assertEqual(output.count("Reused the cached results"), len(self.MODULES) - 1)
+
+    def test_network_checks_expire(self):
+        self.run_cached()
+        _, output = self.run_cached("--result_cache_ttl=0")
+        self.assertEqual(
+            output.count("Reused the cached results of these unchanged checks: existence, module_dot_bazel."),
+            len(self.MODULES),
+        )
+
+    def test_no_cache(self):
+        self.run_cached()
+        _, output = self.run_cached("--no-cache")
+        self.assertNotIn("Reused the cached results", output)
+
+    def test_hashes_each_module_version_once(self):
+        with patch.object(bcr_validation, "tree_hash", wraps=bcr_validation.tree_hash) as tree_hash:
+            self.run_cached()
+        version_dirs = [str(self.registry / "modules" / name / "1.0") for name in self.MODULES]
+        hashed = [str(call.args[0]) for call in tree_hash.call_args_list if str(call.args[0]) in version_dirs]
+        self.assertCountEqual(hashed, version_dirs)
+
+    def test_tree_hash(self):
+        version_dir = self.registry / "modules" / "foo" / "1.0"
+        original = bcr_validation.tree_hash(version_dir)
+        (version_dir / "patches").mkdir()
+        self.assertNotEqual(bcr_validation.tree_hash(version_dir), original)
+        (version_dir / "patches").rmdir()
+        self.assertEqual(bcr_validation.tree_hash(version_dir), original)
+        (version_dir / "source.json").chmod(0o755)
+        self.assertNotEqual(bcr_validation.tree_hash(version_dir), original)
+
+    def test_code_version_covers_imported_modules(self):
+        modules = {Path(path).stem for path in bcr_validation._local_imports(bcr_validation.__file__)}
+        self.assertLessEqual({"bcr_validation", "archives", "registry", "registry_walker", "github_users"}, modules)
+        self.assertNotIn("validation_benchmark", modules)
+
+
+class TestTracing(ValidationTestCase):
+    def run_traced(self, jobs, *extra_args):
+        trace_dir = Path(tempfile.mkdtemp(dir=self.registry.parent))
+        returncode, output = self.run_main(
+            jobs=jobs,
+            extra_args=[
+                *extra_args,
+                f"--trace_jsonl={trace_dir / 'trace.jsonl'}",
+                f"--trace_chrome={trace_dir / 'trace.json'}",
+                "--trace_summary",
+            ],
+        )
+        self.assertEqual(returncode, 0, output)
+        spans = [json.loads(line) for line in (trace_dir / "trace.jsonl").read_text().splitlines()]
+        events = json.loads((trace_dir / "trace.json").read_text())["traceEvents"]
+        self.assertEqual(len(events), len(spans))
+        return spans, output
+
+    def test_records_checks_and_module_versions(self):
+        for jobs in (1, 3):
+            with self.subTest(jobs=jobs):
+                spans, output = self.run_traced(jobs)
+                modules = [s for s in spans if s["category"] == "module"]
+                self.assertCountEqual([s["name"] for s in modules], [f"{name}@1.0" for name in self.MODULES])
+                checks = {(s["args"]["module"], s["name"]) for s in spans if s["category"] == "check"}
+                for name in self.MODULES:
+                    self.assertIn((name, "url_integrity"), checks)
+                    self.assertIn((name, "module_dot_bazel"), checks)
+                self.assertIn("extract", {s["category"] for s in spans})
+                self.assertIn("global", {s["category"] for s in spans})
+                self.assertIn("Slowest module versions:", output)
+                self.assertIn("url_integrity of foo@1.0", output)
+                if jobs > 1:
+                    # The spans of the module versions come from the worker processes.
+                    self.assertNotIn(os.getpid(), {s["pid"] for s in modules})
+                self.assertIsNone(bcr_validation.tracing.get_tracer())
+
+    def test_marks_replayed_checks(self):
+        result_cache = f"--result_cache={self.registry.parent / 'results'}"
+        self.run_main(extra_args=[result_cache])
+        spans, _ = self.run_traced(1, result_cache)
+        existence = [s for s in spans if s["name"] == "existence"]
+        self.assertEqual(len(existence), len(self.MODULES))
+        self.assertTrue(all(s["args"]["cached"] for s in existence))
+
+
+class TestGitHubUserIds(ValidationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.users = MagicMock()
+        self.users.get.side_effect = {"alice": 1, "bob": 2}.get
+        bcr_validation.set_github_users(self.users)
+        self.addCleanup(bcr_validation.set_github_users, None)
+        self.validator = BcrValidator(RegistryClient(self.registry), upstream=None, should_fix=False)
+
+    def set_maintainers(self, module_name, *maintainers):
+        path = self.registry / "modules" / module_name / "metadata.json"
+        metadata = json.loads(path.read_text())
+        metadata["maintainers"] = list(maintainers)
+        path.write_text(json.dumps(metadata))
+
+    def test_prefetches_all_maintainers(self):
+        self.set_maintainers("foo", {"github": "alice", "github_user_id": 1}, {"email": "foo@example.com"})
+        self.set_maintainers("bar", {"github": "alice", "github_user_id": 1}, {"github": "bob", "github_user_id": 3})
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.validator.validate_metadata(["foo", "bar", "baz"])
+        self.users.prefetch.assert_called_once_with({"alice", "bob"})
+        failures = [
+            msg
+            for result, msg in self.validator.validation_results
+            if result == bcr_validation.BcrValidationResult.FAILED
+        ]
+        self.assertEqual(len(failures), 1)
+        self.assertIn("bar's metadata.json file has an invalid GitHub user ID for bob", failures[0])
+
+    def test_prefetch_failures_are_not_hidden(self):
+        skipped = [check for check in self.SKIPPED if check != "source_repo"]
+        with patch.object(bcr_validation, "prefetch_github_ref_checks", side_effect=RuntimeError("bug")):
+            with self.assertRaisesRegex(RuntimeError, "bug"):
+                self.run_main(skipped=skipped)
+
+    def test_unknown_user(self):
+        self.set_maintainers("foo", {"github": "carol", "github_user_id": 1})
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaisesRegex(BcrValidationException, "Failed to get GitHub user ID for carol"):
+                self.validator.validate_metadata(["foo"])
+
+
+class TestGithubRefCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name, "refs.json")
+        self.spoofed = {"v1.0": False, "v2.0": True}
+        self.session = MagicMock()
+        self.session.get.side_effect = self.latest_commit
+        session_patch = patch.object(bcr_validation, "get_github_session", return_value=self.session)
+        session_patch.start()
+        self.addCleanup(session_patch.stop)
+        self.addCleanup(bcr_validation.set_github_ref_cache, None)
+
+    def latest_commit(self, url, headers):
+        ref = url.rsplit("/", 1)[-1]
+        response = MagicMock(status_code=200 if ref in self.spoofed else 404, content=b"{}")
+        response.json.return_value = {"isSpoofed": self.spoofed.get(ref)}
+        return response
+
+    def test_remembers_answers(self):
+        bcr_validation.set_github_ref_cache(bcr_validation.GithubRefCache(self.path))
+        for _ in range(2):
+            self.assertTrue(is_ref_in_original_repo("owner/repo", "v1.0"))
+            self.assertFalse(is_ref_in_original_repo("owner/repo", "v2.0"))
+            self.assertFalse(is_ref_in_original_repo("owner/repo", "v3.0"))
+        # Refs that don't exist (yet) are asked for again.
+        self.assertEqual(self.session.get.call_count, 4)
+        bcr_validation.get_github_ref_cache().save()
+        self.assertEqual(json.loads(self.path.read_text()), {"owner/repo@v1.0": True, "owner/repo@v2.0": False})
+
+        # A later run doesn't ask again, and keeps what other processes added to the file.
+        cache = bcr_validation.GithubRefCache(self.path)
+        bcr_validation.set_github_ref_cache(cache)
+        self.path.write_text(json.dumps({"owner/repo@v1.0": True, "owner/other@v1.0": True}))
+        self.assertTrue(is_ref_in_original_repo("owner/repo", "v1.0"))
+        self.spoofed["v3.0"] = False
+        self.assertTrue(is_ref_in_original_repo("owner/repo", "v3.0"))
+        self.assertEqual(self.session.get.call_count, 5)
+        cache.save()
+        self.assertEqual(
+            json.loads(self.path.read_text()),
+            {"owner/repo@v1.0": True, "owner/repo@v3.0": True, "owner/other@v1.0": True},
+        )
+
+    def test_prefetch(self):
+        registry = MagicMock()
+        sources = {
+            "foo": "https://github.com/owner/foo/archive/v1.0.tar.gz",
+            "bar": "https://github.com/owner/bar/archive/refs/tags/v2.0.zip",
+            "baz": "https://github.com/owner/baz/releases/download/v1.0/baz.tar.gz",
+        }
+        registry.get_source.side_effect = lambda name, version: {"url": sources[name]}
+        registry.get_metadata.side_effect = lambda name: {"repository": [f"github:owner/{name}"]}
+        bcr_validation.prefetch_github_ref_checks(registry, [("foo", "1.0"), ("bar", "2.0"), ("baz", "1.0")])
+        urls = sorted(call.args[0] for call in self.session.get.call_args_list)
+        self.assertEqual(
+            urls,
+            [
+                "https://github.com/owner/bar/latest-commit/refs/tags/v2.0",
+                "https://github.com/owner/foo/latest-commit/v1.0",
+            ],
+        )
+        self.assertTrue(bcr_validation.check_github_url("owner/foo", sources["foo"]))
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_prefetch_leaves_failures_to_the_checks(self):
+        registry = MagicMock()
+        registry.get_source.side_effect = lambda name, version: {
+            "foo": {"url": "https://github.com/owner/foo/archive/v1.0.zip"},
+            "bar": {"type": "git_repository", "remote": "https://github.com/owner/bar.git"},
+        }[name]
+        registry.get_metadata.side_effect = lambda name: {"repository": [f"github:owner/{name}"]}
+        self.session.get.side_effect = requests.ConnectionError("offline")
+        bcr_validation.prefetch_github_ref_checks(registry, [("foo", "1.0"), ("bar", "1.0")])
+        self.assertEqual(self.session.get.call_count, 1)
+
+
+class TestGlobalChecks(ValidationTestCase):
+    def test_symlinks_fail(self):
+        os.symlink("1.0", self.registry / "modules" / "bar" / "latest")
+        for jobs in (1, 2):
+            with self.subTest(jobs=jobs):
+                returncode, output = self.run_main(jobs=jobs)
+                self.assertEqual(returncode, 1, output)
+                self.assertIn("Symlink is not allowed: ", output)
+                self.assertIn("No module name conflict found.", output)
+
+
+class TestChangedSince(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+        self.git = ["git", "-C", str(self.root), "-c", "user.name=t", "-c", "user.email=t@example.com"]
+        subprocess.run(self.git + ["init", "-q"], check=True)
+        for version, level in [("1.0", 1), ("2.0", 1), ("3.0", 1)]:
+            self.add_version("foo", version, level)
+        self.add_version("bar", "1.0", 0)
+        self.commit()
+
+    def add_version(self, name, version, level, yanked=()):
+        version_dir = self.root / "modules" / name / version
+        version_dir.mkdir(parents=True, exist_ok=True)
+        (version_dir / "MODULE.bazel").write_text(
+            f'module(name = "{name}", version = "{version}", compatibility_level = {level})\n'
+        )
+        metadata_file = self.root / "modules" / name / "metadata.json"
+        metadata = json.loads(metadata_file.read_text()) if metadata_file.exists() else {"versions": []}
+        if version not in metadata["versions"]:
+            metadata["versions"].append(version)
+        metadata["yanked_versions"] = {v: "bad" for v in yanked}
+        metadata_file.write_text(json.dumps(metadata))
+
+    def commit(self):
+        subprocess.run(self.git + ["add", "."], check=True)
+        subprocess.run(self.git + ["commit", "-q", "-m", "change"], check=True)
+
+    def changes(self):
+        return bcr_validation.parse_changed_module_versions(RegistryClient(self.root), "HEAD")
+
+    def test_nothing_changed(self):
+        self.assertEqual(self.changes(), ([], []))
+
+    def test_changed_file_without_compatibility_level_change(self):
+        (self.root / "modules" / "foo" / "2.0" / "presubmit.yml").write_text("tasks: {}\n")
+        self.assertEqual(self.changes(), ([("foo", "2.0")], []))
+
+    def test_new_version_checks_neighbors(self):
+        self.add_version("foo", "2.5", 1)
+        # 2.0 now comes before 2.5 instead of 3.0, and 3.0 after 2.5 instead of 2.0.
+        self.assertEqual(self.changes(), ([("foo", "2.0"), ("foo", "2.5"), ("foo", "3.0")], ["foo"]))
+
+    def test_compatibility_level_change_checks_neighbors(self):
+        self.add_version("foo", "2.0", 2)
+        self.commit()
+        subprocess.run(self.git + ["branch", "-q", "base", "HEAD~1"], check=True)
+        changed, _ = bcr_validation.parse_changed_module_versions(RegistryClient(self.root), "base")
+        self.assertEqual(changed, [("foo", "1.0"), ("foo", "2.0"), ("foo", "3.0")])
+
+    def test_yanked_version_changes_previous_version(self):
+        self.add_version("foo", "3.0", 1, yanked=["2.0"])
+        # The compatibility_level of 3.0 is now compared with 1.0, which has the same level as 2.0.
+        self.assertEqual(self.changes(), ([("foo", "3.0")], ["foo"]))
+
+    def test_metadata_only_change(self):
+        metadata_file = self.root / "modules" / "bar" / "metadata.json"
+        metadata_file.write_text(json.dumps({**json.loads(metadata_file.read_text()), "homepage": "x"}))
+        self.assertEqual(self.changes(), ([], ["bar"]))
+
+    def test_deleted_version_is_not_checked(self):
+        subprocess.run(self.git + ["rm", "-q", "-r", "modules/bar/1.0"], check=True)
+        self.assertEqual(self.changes(), ([], []))
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -18,15 +18,14 @@ import validators
 import os
 import sys
 
-from registry import read
-from registry import download
-from registry import integrity
+from registry import file_integrity
+from registry import url_integrity
 
 if __name__ == "__main__":
     # Under 'bazel run' we want to run within the source folder instead of the execroot.
     if os.getenv("BUILD_WORKSPACE_DIRECTORY"):
         os.chdir(os.getenv("BUILD_WORKSPACE_DIRECTORY"))
     if validators.url(sys.argv[1]):
-        print(integrity(download(sys.argv[1])))
+        print(url_integrity(sys.argv[1]))
     else:
-        print(integrity(read(sys.argv[1])))
+        print(file_integrity(sys.argv[1]))
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Look up the numeric IDs of GitHub users, as recorded for the maintainers in metadata.json.
+
+`GitHubUsers` resolves many logins with a single GraphQL request when a token
+is available and falls back to one REST request per login otherwise. All
+requests go through a shared `RateLimiter`, which also honors the
+Retry-After and X-RateLimit-Reset headers GitHub sends once a limit is hit.
+Resolved IDs can be kept in a `UserIdCache` on disk, so that checking the
+metadata.json files of all modules doesn't look up the same maintainers
+over and over again.
+"""
+
+import json
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import tracing
+
+# Environment variable pointing at the file of the GitHub user ID cache.
+USER_ID_CACHE_ENV = "BCR_GITHUB_USER_CACHE"
+
+# How long looked up user IDs are reused, in hours. A login only maps to another ID
+# after its account was renamed or deleted and the login was taken again.
+DEFAULT_USER_ID_CACHE_TTL_HOURS = 7 * 24
+
+# The endpoints, overridden by GitHub Actions for GitHub Enterprise Server.
+DEFAULT_API_URL = "https://api.github.com"
+DEFAULT_GRAPHQL_URL = "https://api.github.com/graphql"
+
+# The maximum number of users looked up by a single GraphQL request.
+DEFAULT_BATCH_SIZE = 50
+
+# Requests per second and burst size of the default rate limiter. GitHub allows 5000
+# authenticated requests per hour, but also limits bursts of concurrent requests.
+DEFAULT_REQUESTS_PER_SECOND = 10
+DEFAULT_BURST = 10
+
+
+class GitHubUsersError(Exception):
+    """Raised when a user can't be looked up."""
+
+
+class RateLimiter:
+    """A token bucket shared by all threads that talk to the GitHub API."""
+
+    def __init__(self, rate=DEFAULT_REQUESTS_PER_SECOND, burst=DEFAULT_BURST, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = burst
+        self._updated = clock()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                else:
+                    wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def pause(self, seconds):
+        """Hold back all requests for `seconds`, e.g. as asked for by a Retry-After header."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, self._clock() + seconds)
+
+
+class UserIdCache:
+    """Remembers the IDs of GitHub logins in a JSON file for `ttl` seconds.
+
+    Logins are case-insensitive. Only found users are cached, so a typo in a
+    maintainer entry is reported again until it is fixed.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_USER_ID_CACHE_TTL_HOURS * 3600, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(path) as file:
+                self._entries = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._entries = {}
+
+    def get(self, login):
+        """Return the cached ID of `login`, or None if it isn't cached or has expired."""
+        with self._lock:
+            entry = self._entries.get(login.lower())
+        if entry and self._clock() - entry["time"] < self.ttl:
+            return entry["id"]
+        return None
+
+    def put(self, login, user_id):
+        with self._lock:
+            self._entries[login.lower()] = {"id": user_id, "time": self._clock()}
+            self._dirty = True
+
+    def save(self):
+        """Write the cache back to disk if it changed, dropping expired entries."""
+        with self._lock:
+            if not self._dirty:
+                return
+            now = self._clock()
+            entries = {k: v for k, v in self._entries.items() if now - v["time"] < self.ttl}
+            self._dirty = False
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp, "w") as file:
+            json.dump(entries, file, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
+
+
+def _retry_delay(response, clock=time.time):
+    """Return how many seconds to wait before retrying a rate limited `response`, or None if it isn't rate limited."""
+    if response.status_code not in (403, 429):
+        return None
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        if retry_after.isdigit():
+            return int(retry_after)
+        try:
+            return max(0, parsedate_to_datetime(retry_after).timestamp() - clock())
+        except (TypeError, ValueError):
+            return 60
+    if response.headers.get("X-RateLimit-Remaining") == "0":
+        reset = response.headers.get("X-RateLimit-Reset", "")
+        return max(0, int(reset) - clock()) if reset.isdigit() else 60
+    if response.status_code == 429:
+        return 60
+    # A 403 without rate limit headers means access was denied.
+    return None
+
+
+class GitHubUsers:
+    """Resolves GitHub logins to user IDs, see the module docstring."""
+
+    # How often a rate limited request is retried.
+    MAX_RETRIES = 3
+    # Never wait longer than this for a rate limit to reset, in seconds.
+    MAX_RETRY_DELAY = 15 * 60
+
+    def __init__(
+        self,
+        token=None,
+        cache=None,
+        limiter=None,
+        api_url=None,
+        graphql_url=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        session=None,
+    ):
+        self.token = token
+        self.cache = cache
+        self.limiter = limiter or RateLimiter()
+        self.api_url = (api_url or os.getenv("GITHUB_API_URL") or DEFAULT_API_URL).rstrip("/")
+        self.graphql_url = graphql_url or os.getenv("GITHUB_GRAPHQL_URL") or DEFAULT_GRAPHQL_URL
+        self.batch_size = batch_size
+        self.session = session or requests.Session()
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def _headers(self):
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = f"token {self.token}"
+        return headers
+
+    def _request(self, method, url, **kwargs):
+        """Send a request through the rate limiter, retrying while GitHub asks to back off."""
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.limiter.acquire()
+            tracing.add(tracing.HTTP_REQUESTS)
+            with tracing.span(f"{method} {url.removeprefix(self.api_url)}", "github", url=url):
+                response = self.session.request(method, url, headers=self._headers(), **kwargs)
+            tracing.add(tracing.BYTES_DOWNLOADED, len(response.content))
+            delay = _retry_delay(response)
+            if delay is None or attempt == self.MAX_RETRIES:
+                return response
+            if delay > self.MAX_RETRY_DELAY:
+                raise GitHubUsersError(f"GitHub rate limit for {url} resets only in {delay:.0f} seconds.")
+            self.limiter.pause(delay)
+        return response
+
+    def _remember(self, login, user_id):
+        with self._lock:
+            self._ids[login.lower()] = user_id
+        if self.cache is not None and user_id is not None:
+            self.cache.put(login, user_id)
+
+    def _known(self, login):
+        """Return (True, ID) if `login` was already looked up, where ID is None for unknown users."""
+        with self._lock:
+            if login.lower() in self._ids:
+                return True, self._ids[login.lower()]
+        if self.cache is not None:
+            user_id = self.cache.get(login)
+            if user_id is not None:
+                return True, user_id
+        return False, None
+
+    def prefetch(self, logins):
+        """Look up all `logins` that aren't known yet, in as few requests as possible."""
+        missing = sorted({login for login in logins if not self._known(login)[0]}, key=str.lower)
+        if self.token:
+            for i in range(0, len(missing), self.batch_size):
+                batch = missing[i : i + self.batch_size]
+                try:
+                    self._lookup_batch(batch)
+                except GitHubUsersError:
+                    # The REST API covers anything GraphQL couldn't resolve.
+                    pass
+        for login in missing:
+            if not self._known(login)[0]:
+                self._lookup_one(login)
+        if self.cache is not None:
+            self.cache.save()
+
+    def get(self, login):
+        """Return the ID of the GitHub user `login`, or None if there is no such user."""
+        known, user_id = self._known(login)
+        if not known:
+            self.prefetch([login])
+            _, user_id = self._known(login)
+        return user_id
+
+    def _lookup_batch(self, logins):
+        # Pass the logins as variables, so that they can't change the query.
+        variables = {f"u{i}": login for i, login in enumerate(logins)}
+        declarations = ", ".join(f"${name}: String!" for name in variables)
+        fields = " ".join(f"{name}: user(login: ${name}) {{ databaseId }}" for name in variables)
+        response = self._request(
+            "POST", self.graphql_url, json={"query": f"query({declarations}) {{ {fields} }}", "variables": variables}
+        )
+        if response.status_code != 200:
+            raise GitHubUsersError(f"unexpected {response.status_code} status code from {self.graphql_url}")
+        data = response.json().get("data") or {}
+        # Logins that `user` doesn't resolve come back as null with a NOT_FOUND error. They are left to the REST
+        # fallback, which also resolves organizations, and only remembered as unknown if it doesn't find them either.
+        for name, login in variables.items():
+            user = data.get(name)
+            if user and user.get("databaseId") is not None:
+                self._remember(login, user["databaseId"])
+
+    def _lookup_one(self, login):
+        url = f"{self.api_url}/users/{login}"
+        response = self._request("GET", url)
+        if response.status_code == 404:
+            self._remember(login, None)
+            return
+        if response.status_code != 200:
+            raise GitHubUsersError(f"unexpected {response.status_code} status code from {url}")
+        self._remember(login, response.json().get("id"))
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+import http.server
+import json
+import re
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from github_users import GitHubUsers
+from github_users import GitHubUsersError
+from github_users import RateLimiter
+from github_users import UserIdCache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeGitHub(http.server.ThreadingHTTPServer):
+    """Serves `GET /users/<login>` from `users` and `organizations`, and the `user(login:)` GraphQL query
+    from `users`."""
+
+    def __init__(self, users, organizations=None):
+        super().__init__(("127.0.0.1", 0), FakeGitHubHandler)
+        self.users = {login.lower(): user_id for login, user_id in users.items()}
+        self.organizations = {login.lower(): org_id for login, org_id in (organizations or {}).items()}
+        self.requests = []
+        # Responses to send instead of the real ones, as (status, headers).
+        self.failures = []
+        self.graphql_status = 200
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FakeGitHubHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body or {}).encode()
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _fail(self):
+        if self.server.failures:
+            status, headers = self.server.failures.pop(0)
+            self._send(status, {"message": "rate limited"}, headers)
+            return True
+        return False
+
+    def do_GET(self):
+        self.server.requests.append(("GET", self.path, self.headers.get("Authorization")))
+        if self._fail():
+            return
+        login = self.path.removeprefix("/users/")
+        accounts = self.server.users | self.server.organizations
+        if login.lower() in accounts:
+            self._send(200, {"login": login, "id": accounts[login.lower()]})
+        else:
+            self._send(404, {"message": "Not Found"})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(("POST", self.path, self.headers.get("Authorization")))
+        if self._fail():
+            return
+        if self.server.graphql_status != 200:
+            self._send(self.server.graphql_status, {"message": "Bad Gateway"})
+            return
+        data, errors = {}, []
+        for alias, variable in re.findall(r"(\w+): user\(login: \$(\w+)\)", body["query"]):
+            user_id = self.server.users.get(body["variables"][variable].lower())
+            if user_id is None:
+                data[alias] = None
+                errors.append({"type": "NOT_FOUND", "path": [alias], "message": "Could not resolve to a User"})
+            else:
+                data[alias] = {"databaseId": user_id}
+        self._send(200, {"data": data, **({"errors": errors} if errors else {})})
+
+
+class GitHubUsersTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeGitHub({f"user{i}": 1000 + i for i in range(120)} | {"MixedCase": 7}, {"some-org": 9})
+        thread = threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.clock = FakeClock()
+
+    def make_users(self, token="secret", cache=None, **kwargs):
+        return GitHubUsers(
+            token=token,
+            cache=cache,
+            limiter=RateLimiter(rate=1000, burst=1000, clock=self.clock, sleep=self.clock.sleep),
+            api_url=self.server.url,
+            graphql_url=self.server.url + "/graphql",
+            **kwargs,
+        )
+
+    def methods(self):
+        return [method for method, _, _ in self.server.requests]
+
+
+class TestBatching(GitHubUsersTestCase):
+    def test_batches_graphql_requests(self):
+        users = self.make_users(batch_size=50)
+        logins = [f"user{i}" for i in range(120)]
+        users.prefetch(logins + logins[:10])
+        self.assertEqual(self.methods(), ["POST"] * 3)
+        self.assertEqual({auth for _, _, auth in self.server.requests}, {"token secret"})
+        self.assertEqual([users.get(login) for login in logins], [1000 + i for i in range(120)])
+        # Everything was resolved by the prefetch.
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_unknown_user(self):
+        users = self.make_users()
+        users.prefetch(["user1", "nobody"])
+        self.assertEqual(users.get("nobody"), None)
+        self.assertEqual(users.get("user1"), 1001)
+        # GraphQL's NOT_FOUND is confirmed with the REST API before the login is remembered as unknown.
+        self.assertEqual(self.methods(), ["POST", "GET"])
+
+    def test_organization(self):
+        users = self.make_users()
+        users.prefetch(["user1", "some-org"])
+        self.assertEqual(users.get("some-org"), 9)
+        self.assertEqual(self.methods(), ["POST", "GET"])
+
+    def test_logins_are_case_insensitive(self):
+        users = self.make_users()
+        self.assertEqual(users.get("mixedcase"), 7)
+        self.assertEqual(users.get("MIXEDCASE"), 7)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_rest_without_token(self):
+        users = self.make_users(token=None)
+        users.prefetch(["user1", "user2", "nobody"])
+        paths = sorted(path for _, path, _ in self.server.requests)
+        self.assertEqual(paths, ["/users/nobody", "/users/user1", "/users/user2"])
+        self.assertEqual(users.get("user2"), 1002)
+        self.assertIsNone(users.get("nobody"))
+
+    def test_rest_fallback_if_graphql_fails(self):
+        self.server.graphql_status = 502
+        users = self.make_users()
+        self.assertEqual(users.get("user3"), 1003)
+        self.assertEqual(self.methods(), ["POST", "GET"])
+
+    def test_error(self):
+        # A 403 without rate limit headers isn't retried.
+        self.server.failures = [(403, {})]
+        users = self.make_users(token=None)
+        with self.assertRaisesRegex(GitHubUsersError, "unexpected 403 status code"):
+            users.get("user3")
+
+
+class TestRateLimits(GitHubUsersTestCase):
+    def test_retry_after(self):
+        self.server.failures = [(429, {"Retry-After": "30"}), (403, {"Retry-After": "5"})]
+        users = self.make_users()
+        self.assertEqual(users.get("user4"), 1004)
+        self.assertEqual(self.methods(), ["POST"] * 3)
+        self.assertEqual(self.clock.sleeps, [30, 5])
+
+    def test_rate_limit_reset(self):
+        reset = int(self.clock.now) + 1000
+        self.server.failures = [(403, {"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": str(reset)})]
+        users = self.make_users(token=None)
+        # The reset is compared with the wall clock, so it is far in the past.
+        self.assertEqual(users.get("user5"), 1005)
+        self.assertEqual(self.methods(), ["GET", "GET"])
+
+    def test_gives_up_on_long_delays(self):
+        self.server.failures = [(429, {"Retry-After": str(24 * 3600)})]
+        users = self.make_users(token=None)
+        with self.assertRaisesRegex(GitHubUsersError, "resets only in"):
+            users.get("user5")
+
+    def test_token_bucket(self):
+        clock = FakeClock()
+        limiter = RateLimiter(rate=2, burst=3, clock=clock, sleep=clock.sleep)
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(clock.sleeps, [])
+        limiter.acquire()
+        self.assertEqual(clock.sleeps, [0.5])
+        clock.now += 10
+        for _ in range(3):
+            limiter.acquire()
+        self.assertEqual(clock.sleeps, [0.5])
+        limiter.pause(7)
+        limiter.acquire()
+        self.assertEqual(clock.sleeps, [0.5, 7])
+
+
+class TestUserIdCache(GitHubUsersTestCase):
+    def test_persists_ids(self):
+        path = self.tmp / "cache" / "users.json"
+        users = self.make_users(cache=UserIdCache(path, ttl=3600, clock=self.clock))
+        users.prefetch(["user1", "user2", "nobody"])
+        # GraphQL and the REST API for the unknown user.
+        self.assertEqual(len(self.server.requests), 2)
+
+        users = self.make_users(cache=UserIdCache(path, ttl=3600, clock=self.clock))
+        users.prefetch(["user1", "USER2"])
+        self.assertEqual(users.get("user1"), 1001)
+        self.assertEqual(len(self.server.requests), 2)
+        # Unknown users aren't cached.
+        self.assertIsNone(users.get("nobody"))
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_expires(self):
+        path = self.tmp / "users.json"
+        users = self.make_users(cache=UserIdCache(path, ttl=3600, clock=self.clock))
+        users.prefetch(["user1"])
+        self.clock.now += 3600
+        users = self.make_users(cache=UserIdCache(path, ttl=3600, clock=self.clock))
+        self.assertEqual(users.get("user1"), 1001)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_ignores_corrupt_file(self):
+        path = self.tmp / "users.json"
+        path.write_text("{")
+        self.assertIsNone(UserIdCache(path).get("user1"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -50,17 +50,17 @@ def select_modules(registry, selections, random_percentage=None):
                 latest_version = module_versions[-1]
                 selected_modules.append(f"{module}@{latest_version}")
             elif version.startswith(">="):
-                selected_modules.extend(
-                    [f"{module}@{v}" for v in module_versions if Version(v) >= Version(version[2:])]
-                )
+                bound = Version.parse(version[2:])
+                selected_modules.extend([f"{module}@{v}" for v in module_versions if Version.parse(v) >= bound])
             elif version.startswith("<="):
-                selected_modules.extend(
-                    [f"{module}@{v}" for v in module_versions if Version(v) <= Version(version[2:])]
-                )
+                bound = Version.parse(version[2:])
+                selected_modules.extend([f"{module}@{v}" for v in module_versions if Version.parse(v) <= bound])
             elif version.startswith(">"):
-                selected_modules.extend([f"{module}@{v}" for v in module_versions if Version(v) > Version(version[1:])])
+                bound = Version.parse(version[1:])
+                selected_modules.extend([f"{module}@{v}" for v in module_versions if Version.parse(v) > bound])
             elif version.startswith("<"):
-                selected_modules.extend([f"{module}@{v}" for v in module_versions if Version(v) < Version(version[1:])])
+                bound = Version.parse(version[1:])
+                selected_modules.extend([f"{module}@{v}" for v in module_versions if Version.parse(v) < bound])
             else:
                 if version in module_versions:
                     selected_modules.append(f"{module}@{version}")
@@ -122,6 +122,7 @@ def main():
     random_percentage = args.random_percentage
 
     selected_module_versions = select_modules(registry, module_selections, random_percentage)
+    registry.save_index()
     for module_version in selected_module_versions:
         print(module_version)
 
@@ -0,0 +1,708 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""An in-process replacement for `patch` that applies unified diffs.
+
+It follows the behavior of GNU patch (`patch --strip N --force --fuzz F
+[--ignore-whitespace]`) for the diffs found in the registry: leading garbage,
+consistently indented diffs, git extended headers (creation, deletion,
+renames, copies and mode changes), "\\ No newline at end of file" markers,
+hunks that apply at an offset, and the way GNU patch picks the file to patch.
+Context and ed style diffs as well as binary git diffs are not supported.
+
+Patches are applied to a tree, either a directory on disk (`DirectoryTree`)
+or a dict of file contents (`MemoryTree`).
+"""
+
+import datetime
+import os
+import re
+import stat
+import warnings
+
+from pathlib import Path
+
+DEV_NULL = "/dev/null"
+
+_HUNK_HEADER_RE = re.compile(rb"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+_GIT_MODE_RE = re.compile(rb"^(?:new file mode|new mode) ([0-7]+)")
+_TIMESTAMP_RE = re.compile(r"\t(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:\.\d+)? ([+-]\d{4})\s*$")
+
+
+class PatchError(Exception):
+    """Raised when a patch is malformed or doesn't apply."""
+
+
+class PatchWarning(UserWarning):
+    """Issued for problems that GNU patch only warns about, e.g. a patch that ends in the middle of a line."""
+
+
+class Hunk:
+    """A unified diff hunk.
+
+    `old` holds the lines the hunk expects in the file (context and removed
+    lines), `new` the lines it leaves behind (context and added lines), both
+    as `(tag, line)` pairs where `tag` is one of " ", "-" and "+". Lines keep
+    their newline, unless the diff marked them with "\\ No newline at end of file".
+    """
+
+    def __init__(self, old_start, new_start):
+        self.old_start = old_start
+        self.new_start = new_start
+        self.old = []
+        self.new = []
+        # The tags of all lines, in the order of the diff.
+        self.tags = []
+
+    @property
+    def first(self):
+        """The line number where the pattern of the hunk starts, as in GNU patch."""
+        # An empty pattern inserts after the given line.
+        return self.old_start + (0 if self.old else 1)
+
+    def prefix_context(self):
+        """The number of context lines before the first change."""
+        return _count_context(self.tags)
+
+    def suffix_context(self):
+        """The number of context lines after the last change."""
+        return _count_context(reversed(self.tags))
+
+
+def _count_context(tags):
+    count = 0
+    for tag in tags:
+        if tag != " ":
+            break
+        count += 1
+    return count
+
+
+class FilePatch:
+    """The changes a patch makes to a single file."""
+
+    def __init__(self):
+        # File names as they appear in the patch, before stripping.
+        self.old_name = None
+        self.new_name = None
+        self.git = False
+        # Whether to strip the carriage returns of the lines of this diff.
+        self.strip_cr = False
+        self.rename = False
+        self.copy = False
+        self.deleted = False
+        # Whether the timestamp of the old file is the epoch, which diff uses for files that don't exist.
+        self.old_absent = False
+        # The mode a git diff sets on the file, e.g. 0o100755.
+        self.new_mode = None
+        self.hunks = []
+
+    @property
+    def creates(self):
+        return self.old_name == DEV_NULL or self.old_absent
+
+    @property
+    def deletes(self):
+        if self.deleted:
+            return True
+        # Like GNU patch, other diffs only remove files whose single hunk ends with no lines at line 0
+        # ("@@ -1 +0,0 @@"); a diff to /dev/null that doesn't leaves an empty file behind.
+        return len(self.hunks) == 1 and self.hunks[0].new_start == 0 and not self.hunks[0].new
+
+
+def _strip_name(name, strip):
+    """Strip the smallest prefix of `name` containing `strip` slashes, like `patch --strip`."""
+    if name is None or name == DEV_NULL:
+        return None
+    start = 0
+    i = 0
+    while i < len(name):
+        if name[i] == "/":
+            while i + 1 < len(name) and name[i + 1] == "/":
+                i += 1
+            if strip > 0:
+                strip -= 1
+                start = i + 1
+        i += 1
+    if strip > 0 or start >= len(name):
+        return None
+    return name[start:]
+
+
+def _fetch_name(rest):
+    """Parse the file name from the rest of a "---" or "+++" line.
+
+    Like GNU patch, a name only contains spaces if a tab separates it from the timestamp.
+    """
+    rest = rest.lstrip(" \t")
+    if rest.startswith('"'):
+        raise PatchError(f"Quoted file names are not supported: {rest.strip()}")
+    end = len(rest)
+    for i, c in enumerate(rest):
+        if c.isspace():
+            j = i
+            while rest[j] != "\t" and j + 1 < len(rest) and rest[j + 1].isspace():
+                j += 1
+            if rest[j] != "\t" and "\t" in rest[j + 1 :]:
+                continue
+            end = i
+            break
+    return rest[:end] or None
+
+
+def _is_epoch(rest):
+    """Whether the rest of a "---" line has a timestamp at the epoch, in any time zone."""
+    match = _TIMESTAMP_RE.search(rest)
+    if not match:
+        return False
+    try:
+        when = datetime.datetime.strptime(" ".join(match.groups()), "%Y-%m-%d %H:%M:%S %z")
+    except ValueError:
+        return False
+    return when.timestamp() == 0
+
+
+def _parse_git_names(rest):
+    """Return the file names of a `diff --git` line, or None for both if they can't be parsed.
+
+    Like GNU patch, the caller then falls back to the names of the "---" and "+++" lines.
+    """
+    names = rest.split()
+    if len(names) != 2 or any(n.startswith('"') for n in names):
+        return None, None
+    return names
+
+
+def _indent_width(line):
+    width = 0
+    for c in line:
+        if c == 0x20:
+            width += 1
+        elif c == 0x09:
+            width += 8 - width % 8
+        else:
+            break
+    return width
+
+
+def _unindent(line, indent):
+    """Remove up to `indent` columns of leading blanks from `line`."""
+    width = 0
+    i = 0
+    while i < len(line) and width < indent:
+        if line[i] == 0x20:
+            width += 1
+        elif line[i] == 0x09:
+            if width + 8 - width % 8 > indent:
+                break
+            width += 8 - width % 8
+        else:
+            break
+        i += 1
+    return line[i:]
+
+
+def split_lines(data):
+    """Split `data` into lines that keep their b"\\n"; other line terminators are part of the line."""
+    lines = data.split(b"\n")
+    last = lines.pop()
+    lines = [line + b"\n" for line in lines]
+    if last:
+        lines.append(last)
+    return lines
+
+
+def _decode(line):
+    return line.rstrip(b"\r\n").decode("utf-8", errors="surrogateescape")
+
+
+class _LineReader:
+    def __init__(self, lines):
+        self.lines = lines
+        self.pos = 0
+
+    def peek(self, offset=0):
+        pos = self.pos + offset
+        return self.lines[pos] if pos < len(self.lines) else None
+
+    def next(self):
+        line = self.lines[self.pos]
+        self.pos += 1
+        return line
+
+
+def parse_patch(data):
+    """Parse a (possibly git style) unified diff into a list of `FilePatch`es."""
+    reader = _LineReader(split_lines(data))
+    patches = []
+    while reader.peek() is not None:
+        line = reader.peek()
+        indent = _indent_width(line)
+        body = _unindent(line, indent)
+        if body.startswith(b"diff --git "):
+            reader.next()
+            patches.append(_parse_git_patch(reader, body, indent))
+        elif body.startswith(b"--- ") and _is_header(reader, indent):
+            patch = FilePatch()
+            _parse_file_names(reader, patch, indent)
+            _parse_hunks(reader, patch, indent)
+            patches.append(patch)
+        else:
+            # Leading garbage, e.g. a commit message.
+            reader.next()
+    if not patches and data:
+        raise PatchError("Only garbage was found in the patch input.")
+    return patches
+
+
+def _is_header(reader, indent):
+    plus = reader.peek(1)
+    hunk = reader.peek(2)
+    return (
+        plus is not None
+        and _unindent(plus, indent).startswith(b"+++ ")
+        and hunk is not None
+        and _unindent(hunk, indent).startswith(b"@@ -")
+    )
+
+
+def _parse_file_names(reader, patch, indent):
+    crlf = reader.peek().endswith(b"\r\n")
+    old_line = _decode(_unindent(reader.next(), indent))[4:]
+    patch.old_name = _fetch_name(old_line)
+    patch.old_absent = _is_epoch(old_line)
+    patch.new_name = _fetch_name(_decode(_unindent(reader.next(), indent))[4:])
+    # GNU patch strips the carriage returns of diffs whose headers end with CRLF.
+    patch.strip_cr = crlf
+
+
+def _parse_git_patch(reader, header, indent):
+    patch = FilePatch()
+    patch.git = True
+    patch.strip_cr = header.endswith(b"\r\n")
+    patch.old_name, patch.new_name = _parse_git_names(_decode(header)[len("diff --git ") :])
+    while reader.peek() is not None:
+        line = _unindent(reader.peek(), indent)
+        if line.startswith(b"--- ") and _is_header(reader, indent):
+            _parse_file_names(reader, patch, indent)
+            _parse_hunks(reader, patch, indent)
+            break
+        if line.startswith((b"diff --git ", b"@@ ")) or not line.strip():
+            break
+        reader.next()
+        if line.startswith(b"new file mode "):
+            patch.old_name = DEV_NULL
+        elif line.startswith(b"deleted file mode "):
+            patch.deleted = True
+        elif line.startswith((b"rename from ", b"rename to ")):
+            patch.rename = True
+        elif line.startswith((b"copy from ", b"copy to ")):
+            patch.copy = True
+        elif line.startswith((b"GIT binary patch", b"Binary files ")):
+            raise PatchError(f"Binary diffs are not supported: {_decode(header)}")
+        m = _GIT_MODE_RE.match(line)
+        if m:
+            patch.new_mode = int(m.group(1), 8)
+    if patch.new_name is None:
+        raise PatchError(f"Can't parse the file names of `{_decode(header)}`")
+    return patch
+
+
+def _parse_hunks(reader, patch, indent):
+    while reader.peek() is not None:
+        line = _unindent(reader.peek(), indent)
+        m = _HUNK_HEADER_RE.match(line)
+        if not m:
+            break
+        reader.next()
+        old_count = int(m.group(2)) if m.group(2) is not None else 1
+        new_count = int(m.group(4)) if m.group(4) is not None else 1
+        hunk = Hunk(int(m.group(1)), int(m.group(3)))
+        last = None
+        while old_count > 0 or new_count > 0:
+            raw = reader.peek()
+            if raw is None:
+                if 0 < new_count <= 3 and old_count > 0:
+                    # Like GNU patch, assume that trailing blank context lines got chopped.
+                    hunk.tags.append(" ")
+                    hunk.old.append((" ", b"\n"))
+                    hunk.new.append((" ", b"\n"))
+                    old_count -= 1
+                    new_count -= 1
+                    continue
+                raise PatchError(f"Unexpected end of patch in hunk `{_decode(line)}`")
+            line = _unindent(reader.next(), indent)
+            if not line.endswith(b"\n"):
+                # Only the last line of the patch can lack its newline. GNU patch only warns about it (and
+                # turns it into a blank context line), Bazel keeps the line, and so do we.
+                warnings.warn("The patch unexpectedly ends in the middle of a line.", PatchWarning, stacklevel=2)
+                line += b"\n"
+            if patch.strip_cr and line.endswith(b"\r\n"):
+                line = line[:-2] + b"\n"
+            if line in (b"\n", b"\r\n"):
+                # An empty line is a context line that lost its leading space.
+                tag, text = " ", line
+            else:
+                tag, text = chr(line[0]), line[1:]
+            if tag in " -+":
+                hunk.tags.append(tag)
+            if tag == " " and old_count > 0 and new_count > 0:
+                last = (tag, text)
+                hunk.old.append(last)
+                hunk.new.append(last)
+                old_count -= 1
+                new_count -= 1
+            elif tag == "-" and old_count > 0:
+                last = (tag, text)
+                hunk.old.append(last)
+                old_count -= 1
+            elif tag == "+" and new_count > 0:
+                last = (tag, text)
+                hunk.new.append(last)
+                new_count -= 1
+            elif tag == "\\" and last is not None:
+                _drop_newline(hunk, last)
+            else:
+                raise PatchError(f"Malformed hunk `{_decode(line)}` in the patch of {patch.new_name}")
+        if reader.peek() is not None and _unindent(reader.peek(), indent).startswith(b"\\"):
+            reader.next()
+            _drop_newline(hunk, last)
+        patch.hunks.append(hunk)
+
+
+def _drop_newline(hunk, last):
+    """Apply a "\\ No newline at end of file" marker to the line `last`."""
+    tag, text = last
+    stripped = (tag, text[:-1] if text.endswith(b"\n") else text)
+    for lines in (hunk.old, hunk.new):
+        for i in range(len(lines) - 1, -1, -1):
+            if lines[i] is last:
+                lines[i] = stripped
+                break
+
+
+def _canonicalize_ws(line):
+    """Normalize `line` the way `patch --ignore-whitespace` compares lines."""
+    if line.endswith(b"\n"):
+        line = line[:-1]
+    return re.sub(rb"[ \t]+", b" ", line.rstrip(b" \t"))
+
+
+class _HunkMatcher:
+    """Finds where hunks apply in a file, following `locate_hunk` of GNU patch."""
+
+    def __init__(self, lines, ignore_whitespace):
+        self.lines = lines
+        self.ignore_whitespace = ignore_whitespace
+        self._canonical = [_canonicalize_ws(l) for l in lines] if ignore_whitespace else None
+        # Lines up to this one (1-based) were consumed by previous hunks.
+        self.last_frozen_line = 0
+        self.offset = 0
+
+    def _same(self, pattern_line, index):
+        if self.ignore_whitespace:
+            return _canonicalize_ws(pattern_line) == self._canonical[index]
+        line = self.lines[index]
+        return pattern_line.rstrip(b"\n") == line.rstrip(b"\n")
+
+    def _match(self, pattern, where, prefix_fuzz, suffix_fuzz):
+        end = len(pattern) - suffix_fuzz
+        index = where - 1 + prefix_fuzz
+        if index < 0 or index + end - prefix_fuzz > len(self.lines):
+            return False
+        for p in range(prefix_fuzz, end):
+            if not self._same(pattern[p][1], index):
+                return False
+            index += 1
+        return True
+
+    def locate(self, hunk, fuzz):
+        """Return the 1-based line where `hunk` applies with `fuzz`, or 0 if it doesn't."""
+        pattern = hunk.old
+        first_guess = hunk.first + self.offset
+        pat_lines = len(pattern)
+        input_lines = len(self.lines)
+        prefix_context = hunk.prefix_context()
+        suffix_context = hunk.suffix_context()
+        context = max(prefix_context, suffix_context)
+        prefix_fuzz = fuzz + prefix_context - context
+        suffix_fuzz = fuzz + suffix_context - context
+        max_where = input_lines - (pat_lines - suffix_fuzz) + 1
+        min_where = self.last_frozen_line + 1 - (prefix_context - prefix_fuzz)
+        max_pos_offset = max_where - first_guess
+        max_neg_offset = first_guess - min_where
+        max_offset = max(max_pos_offset, max_neg_offset)
+
+        if not pat_lines:
+            # An empty pattern matches anywhere.
+            return first_guess
+
+        # Don't try lines before the start of the file.
+        if first_guess <= max_neg_offset:
+            max_neg_offset = first_guess - 1
+
+        if prefix_fuzz < 0 and hunk.first <= 1:
+            # Can only match at the start of the file.
+            if suffix_fuzz < 0 and (pat_lines != input_lines or prefix_context < self.last_frozen_line):
+                # Can only match the entire file.
+                return 0
+            offset = 1 - first_guess
+            if (
+                self.last_frozen_line <= prefix_context
+                and offset <= max_pos_offset
+                and self._match(pattern, first_guess + offset, 0, max(suffix_fuzz, 0))
+            ):
+                self.offset += offset
+                return first_guess + offset
+            return 0
+        elif prefix_fuzz < 0:
+            prefix_fuzz = 0
+
+        if suffix_fuzz < 0:
+            # Can only match at the end of the file.
+            offset = first_guess - (input_lines - pat_lines + 1)
+            if offset <= max_neg_offset and self._match(pattern, first_guess - offset, prefix_fuzz, 0):
+                self.offset -= offset
+                return first_guess - offset
+            return 0
+
+        for offset in range(max_offset + 1):
+            if offset <= max_pos_offset and self._match(pattern, first_guess + offset, prefix_fuzz, suffix_fuzz):
+                self.offset += offset
+                return first_guess + offset
+            if 0 < offset <= max_neg_offset and self._match(pattern, first_guess - offset, prefix_fuzz, suffix_fuzz):
+                self.offset -= offset
+                return first_guess - offset
+        return 0
+
+
+def apply_hunks(data, hunks, fuzz=0, ignore_whitespace=False):
+    """Apply `hunks` to the file content `data` and return the new content.
+
+    Raises `PatchError` listing the hunks that don't apply.
+    """
+    lines = split_lines(data)
+    matcher = _HunkMatcher(lines, ignore_whitespace)
+    output = []
+    copied = 0
+    failed = []
+    for number, hunk in enumerate(hunks, 1):
+        where = 0
+        # Like GNU patch, never ignore more lines than the hunk has context.
+        max_fuzz = min(fuzz, max(hunk.prefix_context(), hunk.suffix_context()))
+        for f in range(max_fuzz + 1):
+            where = matcher.locate(hunk, f)
+            if where:
+                break
+        if not where:
+            failed.append(f"#{number} at line {hunk.old_start}")
+            continue
+        # Copy the lines before the hunk, then walk the hunk like `apply_hunk` of GNU patch:
+        # context lines are taken from the file, added lines from the patch.
+        start = where - 1
+        output.extend(lines[copied:start])
+        copied = start
+        new_lines = iter(hunk.new)
+        pending = next(new_lines, None)
+        for tag, _ in hunk.old:
+            while pending is not None and pending[0] == "+":
+                output.append(pending[1])
+                pending = next(new_lines, None)
+            if tag == "-":
+                copied += 1
+                continue
+            output.append(lines[copied])
+            copied += 1
+            pending = next(new_lines, None)
+        while pending is not None:
+            output.append(pending[1])
+            pending = next(new_lines, None)
+        matcher.last_frozen_line = copied
+    if failed:
+        raise PatchError(f"Hunk {', '.join(failed)} FAILED")
+    output.extend(lines[copied:])
+    for i in range(len(output) - 1):
+        if not output[i].endswith(b"\n"):
+            output[i] += b"\n"
+    return b"".join(output)
+
+
+class MemoryTree:
+    """A tree of files held in memory: `files` maps relative paths to their content."""
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})
+        self.executables = set()
+        # Paths of symbolic links; their content in `files` is the link target.
+        self.symlinks = set()
+
+    def exists(self, path):
+        return path in self.files
+
+    def read(self, path):
+        try:
+            return self.files[path]
+        except KeyError:
+            raise FileNotFoundError(path) from None
+
+    def write(self, path, data):
+        self.files[path] = data
+        self.symlinks.discard(path)
+
+    def write_symlink(self, path, link_target):
+        self.files[path] = link_target.encode()
+        self.symlinks.add(path)
+
+    def remove(self, path):
+        del self.files[path]
+        self.executables.discard(path)
+        self.symlinks.discard(path)
+
+    def set_executable(self, path, executable):
+        if executable:
+            self.executables.add(path)
+        else:
+            self.executables.discard(path)
+
+
+class DirectoryTree:
+    """The files below the directory `root`."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def _path(self, path):
+        parts = path.split("/")
+        if path.startswith("/") or ".." in parts:
+            raise PatchError(f"Refusing to patch the potentially dangerous file name `{path}`")
+        return self.root.joinpath(*parts)
+
+    def exists(self, path):
+        return self._path(path).is_file()
+
+    def read(self, path):
+        return self._path(path).read_bytes()
+
+    def write(self, path, data):
+        target = self._path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.is_symlink():
+            # Replace the link instead of writing through it.
+            target.unlink()
+        target.write_bytes(data)
+
+    def write_symlink(self, path, link_target):
+        target = self._path(path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if target.is_symlink() or target.exists():
+            target.unlink()
+        target.symlink_to(link_target)
+
+    def remove(self, path):
+        target = self._path(path)
+        target.unlink()
+        # Like GNU patch, remove the directories that became empty.
+        parent = target.parent
+        while parent != self.root and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
+
+    def set_executable(self, path, executable):
+        target = self._path(path)
+        mode = target.stat().st_mode
+        if executable:
+            # Grant execute permission wherever read permission is granted.
+            mode |= (mode & 0o444) >> 2
+        else:
+            mode &= ~0o111
+        os.chmod(target, stat.S_IMODE(mode))
+
+
+def _best_name(names, tree):
+    """Pick the file to patch among `names`, like GNU patch does when not conforming to POSIX."""
+    candidates = [n for n in names if n is not None]
+    existing = [n for n in candidates if tree.exists(n)]
+
+    def key(name):
+        return (name.count("/"), len(name.rsplit("/", 1)[-1]), len(name))
+
+    pool = existing or candidates
+    return min(pool, key=key) if pool else None
+
+
+def apply_file_patch(patch, tree, strip=0, fuzz=0, ignore_whitespace=False):
+    """Apply a single `FilePatch` to `tree`."""
+    old_name = _strip_name(patch.old_name, strip)
+    new_name = _strip_name(patch.new_name, strip)
+    if patch.rename or patch.copy:
+        source, target = old_name, new_name
+    else:
+        source = target = _best_name([old_name, new_name], tree)
+    if target is None:
+        raise PatchError(f"Can't determine the file to patch for `{patch.old_name}` -> `{patch.new_name}`")
+    if patch.creates:
+        # Like `patch --force`, a diff that creates an existing file is applied to it anyway,
+        # which only succeeds if the file is empty.
+        source = target if tree.exists(target) else None
+        if source is not None and patch.hunks and tree.read(source):
+            raise PatchError(
+                f"Hunk #1 FAILED while patching `{target}`: the patch creates the file, but it already exists"
+            )
+
+    if source is None:
+        data = b""
+    else:
+        try:
+            data = tree.read(source)
+        except FileNotFoundError:
+            if patch.hunks and any(hunk.old for hunk in patch.hunks):
+                raise PatchError(f"Can't find file `{source}` to patch") from None
+            data = b""
+
+    try:
+        result = apply_hunks(data, patch.hunks, fuzz, ignore_whitespace) if patch.hunks else data
+    except PatchError as e:
+        raise PatchError(f"{e} while patching `{target}`") from None
+
+    if patch.deletes and not result:
+        if source is not None and tree.exists(source):
+            tree.remove(source)
+        return
+    if patch.new_mode is not None and stat.S_ISLNK(patch.new_mode):
+        tree.write_symlink(target, result.decode("utf-8", "surrogateescape"))
+        return
+    tree.write(target, result)
+    if patch.deletes:
+        raise PatchError(f"Not deleting file `{target}` as its content differs from the patch")
+    if patch.rename and source is not None and source != target:
+        tree.remove(source)
+    if patch.new_mode is not None:
+        tree.set_executable(target, bool(patch.new_mode & 0o111))
+
+
+def apply_patch(patch_data, tree, strip=0, fuzz=0, ignore_whitespace=False):
+    """Apply the diff `patch_data` (bytes) to `tree`, a `DirectoryTree` or a `MemoryTree`.
+
+    Like `patch --force`, all files that can be patched are, and a `PatchError`
+    listing the failures is raised afterwards if some of them couldn't.
+    """
+    errors = []
+    for file_patch in parse_patch(patch_data):
+        try:
+            apply_file_patch(file_patch, tree, strip, fuzz, ignore_whitespace)
+        except PatchError as e:
+            errors.append(str(e))
+    if errors:
+        raise PatchError("\n".join(errors))
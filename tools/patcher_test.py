@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import unittest
+import warnings
+from pathlib import Path
+
+from patcher import DirectoryTree
+from patcher import MemoryTree
+from patcher import PatchError
+from patcher import PatchWarning
+from patcher import apply_patch
+
+REGISTRY_ROOT = Path(__file__).resolve().parent.parent
+
+
+def lines(*items):
+    return b"".join(item + b"\n" for item in items)
+
+
+class TestApplyPatch(unittest.TestCase):
+    def test_modifies_file(self):
+        tree = MemoryTree({"foo.txt": lines(b"a", b"b", b"c")})
+        apply_patch(b"--- a/foo.txt\n+++ b/foo.txt\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n", tree, strip=1)
+        self.assertEqual(tree.files, {"foo.txt": lines(b"a", b"B", b"c")})
+
+    def test_skips_leading_garbage(self):
+        patch = b"From abc Mon Sep 17 00:00:00 2001\nSubject: fix\n\n---\n foo.txt | 2 +-\n\n"
+        patch += (
+            b"diff --git a/foo.txt b/foo.txt\nindex 1..2 100644\n--- a/foo.txt\n+++ b/foo.txt\n@@ -1 +1 @@\n-a\n+b\n"
+        )
+        tree = MemoryTree({"foo.txt": b"a\n"})
+        apply_patch(patch, tree, strip=1)
+        self.assertEqual(tree.files, {"foo.txt": b"b\n"})
+
+    def test_only_garbage(self):
+        with self.assertRaisesRegex(PatchError, "Only garbage"):
+            apply_patch(b"not a patch\n", MemoryTree())
+        # An empty patch does nothing.
+        apply_patch(b"", MemoryTree())
+
+    def test_applies_at_offset(self):
+        original = lines(b"new", b"lines", b"a", b"b", b"c")
+        tree = MemoryTree({"foo.txt": original})
+        apply_patch(b"--- foo.txt\n+++ foo.txt\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n", tree)
+        self.assertEqual(tree.files["foo.txt"], lines(b"new", b"lines", b"a", b"B", b"c"))
+
+    def test_hunk_anchored_at_start_of_file(self):
+        # Without leading context, a hunk at line 1 only applies at the start of the file.
+        tree = MemoryTree({"foo.txt": lines(b"x", b"a", b"b")})
+        with self.assertRaisesRegex(PatchError, "Hunk #1 at line 1 FAILED"):
+            apply_patch(b"--- foo.txt\n+++ foo.txt\n@@ -1,2 +1,2 @@\n-a\n+A\n b\n", tree)
+        self.assertEqual(tree.files["foo.txt"], lines(b"x", b"a", b"b"))
+
+    def test_fuzz(self):
+        patch = b"--- foo.txt\n+++ foo.txt\n@@ -1,3 +1,3 @@\n a\n-b\n+B\n c\n"
+        tree = MemoryTree({"foo.txt": lines(b"x", b"b", b"c")})
+        with self.assertRaises(PatchError):
+            apply_patch(patch, tree)
+        apply_patch(patch, tree, fuzz=1)
+        self.assertEqual(tree.files["foo.txt"], lines(b"x", b"B", b"c"))
+
+    def test_ignore_whitespace(self):
+        patch = b"--- foo.txt\n+++ foo.txt\n@@ -1,3 +1,3 @@\n if (x) {\n-    return;\n+    return 1;\n }\n"
+        tree = MemoryTree({"foo.txt": b"if  (x)\t{ \n\treturn;\n}\n"})
+        with self.assertRaises(PatchError):
+            apply_patch(patch, tree)
+        apply_patch(patch, tree, ignore_whitespace=True)
+        # Context lines are taken from the file, added lines from the patch.
+        self.assertEqual(tree.files["foo.txt"], b"if  (x)\t{ \n    return 1;\n}\n")
+
+    def test_applies_other_files_before_failing(self):
+        patch = b"--- a.txt\n+++ a.txt\n@@ -1 +1 @@\n-x\n+y\n--- b.txt\n+++ b.txt\n@@ -1 +1 @@\n-a\n+b\n"
+        tree = MemoryTree({"a.txt": b"a\n", "b.txt": b"a\n"})
+        with self.assertRaisesRegex(PatchError, "while patching `a.txt`"):
+            apply_patch(patch, tree)
+        self.assertEqual(tree.files, {"a.txt": b"a\n", "b.txt": b"b\n"})
+
+    def test_no_newline_at_end_of_file(self):
+        tree = MemoryTree({"foo.txt": b"a\nb"})
+        patch = b"--- foo.txt\n+++ foo.txt\n@@ -1,2 +1,2 @@\n a\n-b\n\\ No newline at end of file\n+c\n"
+        apply_patch(patch, tree)
+        self.assertEqual(tree.files["foo.txt"], b"a\nc\n")
+
+    def test_creates_and_deletes_files(self):
+        patch = b"--- /dev/null\n+++ b/dir/new.txt\n@@ -0,0 +1,2 @@\n+a\n+b\n"
+        patch += b"diff --git a/old.txt b/old.txt\ndeleted file mode 100644\n--- a/old.txt\n+++ /dev/null\n@@ -1 +0,0 @@\n-x\n"
+        tree = MemoryTree({"old.txt": b"x\n"})
+        apply_patch(patch, tree, strip=1)
+        self.assertEqual(tree.files, {"dir/new.txt": lines(b"a", b"b")})
+
+    def test_creating_existing_file_fails(self):
+        tree = MemoryTree({"new.txt": b"x\n"})
+        patch = b"--- new.txt\t1970-01-01 00:00:00.000000000 +0000\n+++ new.txt\t2024-01-01 00:00:00.000000000 +0000\n"
+        patch += b"@@ -0,0 +1 @@\n+a\n"
+        with self.assertRaisesRegex(PatchError, "already exists"):
+            apply_patch(patch, tree)
+        self.assertEqual(tree.files, {"new.txt": b"x\n"})
+
+    def test_keeps_deleted_file_that_differs(self):
+        tree = MemoryTree({"old.txt": b"x\ny\n"})
+        patch = b"diff --git a/old.txt b/old.txt\ndeleted file mode 100644\n--- a/old.txt\n+++ /dev/null\n@@ -1 +0,0 @@\n-x\n"
+        with self.assertRaisesRegex(PatchError, "Not deleting"):
+            apply_patch(patch, tree, strip=1)
+        self.assertEqual(tree.files, {"old.txt": b"y\n"})
+
+    def test_git_rename_and_mode(self):
+        patch = b"diff --git a/old.sh b/new.sh\nold mode 100644\nnew mode 100755\nsimilarity index 90%\n"
+        patch += b"rename from old.sh\nrename to new.sh\n--- a/old.sh\n+++ b/new.sh\n@@ -1 +1 @@\n-echo a\n+echo b\n"
+        tree = MemoryTree({"old.sh": b"echo a\n"})
+        apply_patch(patch, tree, strip=1)
+        self.assertEqual(tree.files, {"new.sh": b"echo b\n"})
+        self.assertEqual(tree.executables, {"new.sh"})
+
+    def test_picks_existing_file(self):
+        # Like GNU patch, the name with the fewest components among the existing files is patched.
+        patch = b"--- foo.txt.orig\n+++ foo.txt\n@@ -1 +1 @@\n-a\n+b\n"
+        tree = MemoryTree({"foo.txt": b"a\n"})
+        apply_patch(patch, tree)
+        self.assertEqual(tree.files, {"foo.txt": b"b\n"})
+
+    def test_crlf_patch(self):
+        patch = b"--- foo.txt\r\n+++ foo.txt\r\n@@ -1,2 +1,2 @@\r\n a\r\n-b\r\n+c\r\n"
+        tree = MemoryTree({"foo.txt": lines(b"a", b"b")})
+        apply_patch(patch, tree)
+        self.assertEqual(tree.files["foo.txt"], lines(b"a", b"c"))
+
+    def test_indented_patch(self):
+        patch = b"  --- foo.txt\n  +++ foo.txt\n  @@ -1 +1 @@\n  -a\n  +b\n"
+        tree = MemoryTree({"foo.txt": b"a\n"})
+        apply_patch(patch, tree)
+        self.assertEqual(tree.files["foo.txt"], b"b\n")
+
+    def test_missing_final_newline(self):
+        # Like GNU patch, a patch that ends in the middle of a line only gets a warning and keeps the line.
+        tree = MemoryTree({"foo.txt": lines(b"a", b"b")})
+        with self.assertWarnsRegex(PatchWarning, "ends in the middle of a line"):
+            apply_patch(b"--- foo.txt\n+++ foo.txt\n@@ -1,2 +1,2 @@\n-a\n+A\n b", tree)
+        self.assertEqual(tree.files["foo.txt"], lines(b"A", b"b"))
+
+    def test_unparsable_git_names(self):
+        # The names of the "---" and "+++" lines are used instead.
+        patch = (
+            b"diff --git a/foo.txt b/. foo.txt\nindex 1..2 100644\n--- a/foo.txt\n+++ b/foo.txt\n@@ -1 +1 @@\n-a\n+b\n"
+        )
+        tree = MemoryTree({"foo.txt": b"a\n"})
+        apply_patch(patch, tree, strip=1)
+        self.assertEqual(tree.files, {"foo.txt": b"b\n"})
+
+    def test_directory_tree(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            (root / "src").mkdir()
+            (root / "src" / "old.txt").write_bytes(b"x\n")
+            patch = b"diff --git a/run.sh b/run.sh\nnew file mode 100755\n--- /dev/null\n+++ b/run.sh\n@@ -0,0 +1 @@\n+echo\n"
+            patch += (
+                b"diff --git a/src/old.txt b/src/old.txt\ndeleted file mode 100644\n--- a/src/old.txt\n+++ /dev/null\n"
+            )
+            patch += b"@@ -1 +0,0 @@\n-x\n"
+            apply_patch(patch, DirectoryTree(root), strip=1)
+            self.assertEqual((root / "run.sh").read_bytes(), b"echo\n")
+            self.assertTrue(os.access(root / "run.sh", os.X_OK))
+            # Directories that became empty are removed, like GNU patch does.
+            self.assertEqual(sorted(p.name for p in root.iterdir()), ["run.sh"])
+
+    def test_directory_tree_rejects_escaping_paths(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with self.assertRaisesRegex(PatchError, "dangerous"):
+                apply_patch(b"--- /dev/null\n+++ ../evil\n@@ -0,0 +1 @@\n+x\n", DirectoryTree(tmp))
+
+
+def registry_patches():
+    for source_json in sorted((REGISTRY_ROOT / "modules").glob("*/*/source.json")):
+        source = json.loads(source_json.read_text())
+        for patch_name in sorted(source.get("patches", {})):
+            patch_file = source_json.parent / "patches" / patch_name
+            if patch_file.is_file():
+                yield patch_file, int(source.get("patch_strip", 0))
+
+
+_HUNK_HEADER_RE = re.compile(rb"^@@ -(\d+)(?:,(\d+))? \+\d+(?:,(\d+))? @@")
+
+
+def _header_name(line, strip):
+    """Return the file name of a "---" or "+++" line after stripping `strip` components, or None."""
+    name = line[4:].split(b"\t")[0].split()[0].decode("utf-8", "surrogateescape")
+    if name == "/dev/null" or name.count("/") < strip:
+        return None
+    return name.split("/", strip)[-1]
+
+
+def synthesize_tree(patch_data, strip, shift):
+    """Return files on which the hunks of `patch_data` apply, optionally moved by a few lines.
+
+    The diff is read line by line here instead of with `parse_patch`, so that the tree doesn't
+    depend on the parser under test.
+    """
+    files = {}
+    lines = [line + b"\n" for line in patch_data.split(b"\n")]
+    if patch_data.endswith(b"\n") or not patch_data:
+        lines.pop()
+    # The file of a `diff --git` without "---" and "+++" lines, e.g. a rename or a mode change.
+    git_name = None
+    git = False
+    pos = 0
+    while pos < len(lines):
+        line = lines[pos]
+        indent = line[: len(line) - len(line.lstrip(b" \t"))]
+        line = line[len(indent) :]
+        pos += 1
+        if line.startswith(b"diff --git "):
+            if git_name is not None:
+                files[git_name] = b""
+            words = line.split()
+            git = True
+            git_name = words[2].decode("utf-8", "surrogateescape").split("/", strip)[-1] if len(words) == 4 else None
+            continue
+        if line.startswith(b"new file mode "):
+            git_name = None
+        if not (
+            line.startswith(b"--- ")
+            and pos + 1 < len(lines)
+            and lines[pos].startswith(indent + b"+++ ")
+            and lines[pos + 1].startswith(indent + b"@@ -")
+        ):
+            continue
+        old = _header_name(line, strip)
+        new = _header_name(lines[pos][len(indent) :], strip)
+        crlf = line.endswith(b"\r\n")
+        pos += 1
+        name = old if git or new is None else new
+        if old is None and line[4:].startswith(b"/dev/null"):
+            # The patch creates the file.
+            name = None
+        git_name = None
+        content = [b"top %d\n" % i for i in range(3)] if shift else []
+        while pos < len(lines) and lines[pos].startswith(indent) and _HUNK_HEADER_RE.match(lines[pos][len(indent) :]):
+            m = _HUNK_HEADER_RE.match(lines[pos][len(indent) :])
+            pos += 1
+            old_count = int(m.group(2) or 1)
+            new_count = int(m.group(3) or 1)
+            first = int(m.group(1)) + (0 if old_count else 1)
+            while len(content) < first - 1 + (3 if shift else 0):
+                content.append(b"filler %d\n" % len(content))
+            while (old_count or new_count) and pos < len(lines):
+                body = lines[pos][len(indent) :] if lines[pos].startswith(indent) else lines[pos]
+                if crlf and body.endswith(b"\r\n"):
+                    body = body[:-2] + b"\n"
+                pos += 1
+                if body.startswith(b"\\"):
+                    continue
+                if body in (b"\n", b"\r\n"):
+                    body = b" " + body
+                if body[:1] in b" -":
+                    content.append(body[1:])
+                    old_count -= 1
+                if body[:1] in b" +":
+                    new_count -= 1
+            # Trailing blank context lines may have been chopped.
+            content.extend([b"\n"] * old_count)
+        if name is not None:
+            files[name] = b"".join(content)
+        git = False
+    if git_name is not None:
+        files[git_name] = b""
+    return files
+
+
+def snapshot(root):
+    return {
+        str(p.relative_to(root)): (p.read_bytes(), os.access(p, os.X_OK))
+        for p in sorted(root.rglob("*"))
+        if p.is_file() and p.suffix not in (".orig", ".rej")
+    }
+
+
+@unittest.skipUnless((REGISTRY_ROOT / "modules").is_dir(), "the registry's modules are not available")
+class TestRegistryPatches(unittest.TestCase):
+    def test_registry_patches_apply(self):
+        for patch_file, strip in registry_patches():
+            data = patch_file.read_bytes()
+            with self.subTest(patch=str(patch_file.relative_to(REGISTRY_ROOT))):
+                names = re.findall(rb"^\s*\+\+\+ (\S+)", data, re.MULTILINE)
+                if len(names) != len(set(names)):
+                    # The later hunks apply to the result of the earlier ones, which can't be synthesized.
+                    self.skipTest("the patch changes a file more than once")
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", PatchWarning)
+                    apply_patch(
+                        data, MemoryTree(synthesize_tree(data, strip, False)), strip=strip, ignore_whitespace=True
+                    )
+
+
+@unittest.skipUnless(shutil.which("patch"), "GNU patch is not installed")
+@unittest.skipUnless((REGISTRY_ROOT / "modules").is_dir(), "the registry's modules are not available")
+class TestConformance(unittest.TestCase):
+    """Compares the results with GNU patch for the patches in the registry.
+
+    Every 25th patch is checked by default; set BCR_PATCHER_CONFORMANCE=all to check all of them.
+    """
+
+    def test_registry_patches(self):
+        step = 1 if os.environ.get("BCR_PATCHER_CONFORMANCE") == "all" else 25
+        for patch_file, strip in list(registry_patches())[::step]:
+            data = patch_file.read_bytes()
+            for shift in (False, True):
+                with self.subTest(patch=str(patch_file.relative_to(REGISTRY_ROOT)), shift=shift):
+                    self.check(data, strip, synthesize_tree(data, strip, shift))
+
+    def check(self, data, strip, files):
+        with tempfile.TemporaryDirectory() as tmp:
+            expected, actual = Path(tmp, "gnu"), Path(tmp, "py")
+            for root in (expected, actual):
+                root.mkdir()
+                for name, content in files.items():
+                    (root / name).parent.mkdir(parents=True, exist_ok=True)
+                    (root / name).write_bytes(content)
+            # GNU patch turns a last line without a newline into a blank context line, while `apply_patch`
+            # keeps it like Bazel does, so GNU patch gets the completed line.
+            result = subprocess.run(
+                ["patch", "--strip", str(strip), "--force", "--fuzz", "0", "--ignore-whitespace"],
+                input=data if not data or data.endswith(b"\n") else data + b"\n",
+                cwd=expected,
+                capture_output=True,
+            )
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", PatchWarning)
+                    apply_patch(data, DirectoryTree(actual), strip=strip, ignore_whitespace=True)
+                error = None
+            except PatchError as e:
+                error = str(e)
+            self.assertEqual(
+                result.returncode == 0, error is None, f"{result.stdout.decode(errors='replace')}\n{error}"
+            )
+            if error is None:
+                self.assertEqual(snapshot(expected), snapshot(actual))
+
+
+if __name__ == "__main__":
+    unittest.main()
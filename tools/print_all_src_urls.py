@@ -32,6 +32,7 @@ def main():
         elif "urls" in source:
             for url in source["urls"]:
                 print(url)
+    client.save_index()
 
 
 if __name__ == "__main__":
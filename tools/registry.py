@@ -19,21 +19,43 @@
 # pylint: disable=invalid-name
 """Tool classes to handle a Bazel registry"""
 
+import ast
 import base64
+import concurrent.futures
+import contextlib
+import dataclasses
 import difflib
 import functools
 import hashlib
+import http.client
+import io
 import json
 import netrc
+import os
 import pathlib
 import posixpath
 import re
 import shutil
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.error
 import urllib.parse
 import urllib.request
 import yaml
 from urllib.error import HTTPError
 
+import tracing
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: `DownloadCache` only locks its index against other threads.
+    fcntl = None
+
 GREEN = "\x1b[32m"
 RESET = "\x1b[0m"
 
@@ -87,54 +109,322 @@ def _validate_download_url(url):
     return parts
 
 
-def download(url):
-    _validate_download_url(url)
-    authorization_header_name = "Authorization"
+# Size of the blocks `iter_download` and `iter_file` hand to their callers.
+# Large enough to keep per-chunk overhead negligible, small enough that
+# hashing a multi-GB archive never holds more than this in memory.
+CHUNK_SIZE = 1024 * 1024
+
+SRI_ALGORITHMS = frozenset({"sha224", "sha256", "sha384", "sha512"})
+
+
+AUTHORIZATION_HEADER = "Authorization"
 
-    class Github404ErrorProcessor(urllib.request.BaseHandler):
-        """Work around Github authorization header weirdness.
 
-        For private archives, Github requires an authorization token
-        in the initial GET, but no token on the redirected request
-        (which contains a token in the URL).  An authorization token
-        leads to a 404, which we handle here.  By default, urllib
-        includes all the original headers in the redirected request.
+class Github404ErrorProcessor(urllib.request.BaseHandler):
+    """Work around Github authorization header weirdness.
 
+    For private archives, Github requires an authorization token
+    in the initial GET, but no token on the redirected request
+    (which contains a token in the URL).  An authorization token
+    leads to a 404, which we handle here.  By default, urllib
+    includes all the original headers in the redirected request.
+
+    """
+
+    def http_error_404(self, request, fp, code, msg, hdrs):
+        # Try again without the Authorization header.
+        auth = request.headers.pop(AUTHORIZATION_HEADER, None)
+        if auth is None:
+            raise HTTPError(request.full_url, code, msg, hdrs, fp)
+        new = urllib.request.Request(request.full_url, headers=request.headers)
+        fp.read()
+        fp.close()
+        return self.parent.open(new, timeout=request.timeout)
+
+
+class _PooledResponse:
+    """A response whose connection goes back to the `HttpSession` pool once it is closed."""
+
+    def __init__(self, session, key, conn, response, url):
+        self._session = session
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def read(self, amt=None):
+        return self._response.read(amt)
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def getcode(self):
+        return self.status
+
+    def close(self):
+        if self._conn is None:
+            return
+        # The connection can only be reused if the body was consumed completely
+        # and the server didn't ask to close it.
+        reusable = self._response.isclosed() and not self._response.will_close
+        self._response.close()
+        self._session._release(self._key, self._conn, reusable)
+        self._conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class HttpSession:
+    """A thread-safe HTTP client that keeps connections alive between downloads.
+
+    Idle connections are pooled per (scheme, host, port), so fetching thousands
+    of files from the same host pays for the TCP and TLS handshakes only once.
+    `~/.netrc` is parsed on first use instead of on every request. Requests
+    that have to go through a proxy from the environment, as well as the
+    benign `file://` URLs, are handed to a urllib opener instead.
+    """
+
+    MAX_REDIRECTS = 10
+    _REDIRECT_CODES = frozenset({301, 302, 303, 307, 308})
+
+    def __init__(self, timeout=None, max_idle_per_host=8):
+        self.timeout = timeout
+        self.max_idle_per_host = max_idle_per_host
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._netrc = None
+        self._netrc_loaded = False
+        self._ssl_context = ssl.create_default_context()
+        self._proxies = urllib.request.getproxies()
+        self._opener = urllib.request.build_opener(Github404ErrorProcessor)
+
+    def _authenticators(self, netloc):
+        with self._lock:
+            if not self._netrc_loaded:
+                try:
+                    self._netrc = netrc.netrc()
+                except FileNotFoundError:
+                    self._netrc = None
+                self._netrc_loaded = True
+        return self._netrc.authenticators(netloc) if self._netrc else None
+
+    def _headers(self, parts):
+        headers = {"User-Agent": "curl/8.7.1"}
+        authenticators = self._authenticators(parts.netloc)
+        if authenticators is not None:
+            (login, _, password) = authenticators
+            creds = base64.b64encode(str.encode("%s:%s" % (login, password))).decode()
+            headers[AUTHORIZATION_HEADER] = "Basic %s" % creds
+        return headers
+
+    def _needs_urllib(self, parts):
+        if parts.scheme not in ALLOWED_DOWNLOAD_SCHEMES:
+            return True
+        return parts.scheme in self._proxies and not urllib.request.proxy_bypass(parts.hostname or "")
+
+    def open(self, url, headers=None, method="GET", timeout=None):
+        """Request `url` and return a file-like response, raising `HTTPError` for error statuses.
+
+        `headers` are sent in addition to the default ones, e.g. for conditional requests.
+        `timeout` overrides the session's socket timeout for this request.
         """
+        parts = _validate_download_url(url)
+        headers = {**self._headers(parts), **(headers or {})}
+        timeout = self._timeout(timeout)
+        tracing.add(tracing.HTTP_REQUESTS)
+        if self._needs_urllib(parts):
+            return self._opener.open(urllib.request.Request(url, headers=headers, method=method), timeout=timeout)
+
+        for _ in range(self.MAX_REDIRECTS + 1):
+            response = self._request(parts, headers, method, timeout)
+            location = response.getheader("Location")
+            if response.status in self._REDIRECT_CODES and location:
+                response.read()
+                response.close()
+                url = urllib.parse.urljoin(url, location)
+                parts = _validate_download_url(url)
+                if self._needs_urllib(parts):
+                    request = urllib.request.Request(url, headers=headers, method=method)
+                    return self._opener.open(request, timeout=timeout)
+                continue
+            if response.status == 404 and AUTHORIZATION_HEADER in headers:
+                # Same as `Github404ErrorProcessor`: try again without the Authorization header.
+                response.read()
+                response.close()
+                headers = {k: v for k, v in headers.items() if k != AUTHORIZATION_HEADER}
+                continue
+            if response.status >= 400:
+                body = response.read()
+                response.close()
+                raise HTTPError(url, response.status, response.reason, response.headers, io.BytesIO(body))
+            return response
+        raise RegistryException(f"Too many redirects while fetching `{url}`.")
+
+    def _timeout(self, timeout=None):
+        if timeout is not None:
+            return timeout
+        return self.timeout if self.timeout is not None else socket.getdefaulttimeout()
+
+    def _request(self, parts, headers, method, timeout):
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+        while True:
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, target, headers=headers)
+                response = conn.getresponse()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+                conn.close()
+                # The server may have dropped a connection while it sat idle in the pool.
+                if reused:
+                    continue
+                raise urllib.error.URLError(e) from e
+            except OSError as e:
+                conn.close()
+                raise urllib.error.URLError(e) from e
+            except BaseException:
+                conn.close()
+                raise
+            return _PooledResponse(self, key, conn, response, urllib.parse.urlunsplit(parts))
+
+    def _acquire(self, key, timeout):
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is not None:
+            # Pooled connections may have been opened with a different timeout.
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=timeout, context=self._ssl_context), False
+        return http.client.HTTPConnection(host, port, timeout=timeout), False
+
+    def _release(self, key, conn, reusable):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if reusable and len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Return the `HttpSession` shared by all downloads of this process."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = HttpSession()
+        return _session
+
+
+def set_session(session):
+    """Send all downloads through `session`, which has the interface of `HttpSession`, e.g. one of the
+    transport module, or through a new `HttpSession` again with None."""
+    global _session
+    with _session_lock:
+        _session = session
+
+
+def _open_url(url, method="GET", timeout=None):
+    return get_session().open(url, method=method, timeout=timeout)
+
 
-        def http_error_404(self, request, fp, code, msg, hdrs):
-            # Try again without the Authorization header.
-            auth = request.headers.pop(authorization_header_name, None)
-            if auth is None:
-                raise HTTPError(req.full_url, code, msg, headers, fp)
-            new = urllib.request.Request(request.full_url, headers=request.headers)
-            fp.read()
-            fp.close()
-            return self.parent.open(new, timeout=request.timeout)
-
-    opener = urllib.request.build_opener(Github404ErrorProcessor)
-    urllib.request.install_opener(opener)
-    parts = urllib.parse.urlparse(url)
-    headers = {"User-Agent": "curl/8.7.1"}  # Set the User-Agent header
+def download(url):
+    with _open_url(url) as response:
+        data = response.read()
+    tracing.add(tracing.BYTES_DOWNLOADED, len(data))
+    return data
+
+
+def iter_download(url, chunk_size=CHUNK_SIZE, timeout=None):
+    """Yield the body of `url` in chunks of at most `chunk_size` bytes.
+
+    With a `timeout` in seconds, connecting, every read and the download as a
+    whole must each finish within that time, otherwise `TimeoutError` is raised.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    with _open_url(url, timeout=timeout) as response:
+        while chunk := response.read(chunk_size):
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Downloading `{url}` took longer than {timeout} seconds.")
+            tracing.add(tracing.BYTES_DOWNLOADED, len(chunk))
+            yield chunk
+
+
+def content_length(url, timeout=None):
+    """Return the size of `url` announced in response to a HEAD request, or None if it isn't announced."""
+    with _open_url(url, method="HEAD", timeout=timeout) as response:
+        response.read()
+        length = response.getheader("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def iter_file(path, chunk_size=CHUNK_SIZE):
+    """Yield the content of the local file `path` in chunks of at most `chunk_size` bytes."""
+    with open(path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+def hash_chunks(chunks, algorithms=("sha256",), file=None):
+    """Feed `chunks` through one digest per algorithm in a single pass.
+
+    If `file` is given, every chunk is also written to that path, so the data
+    can be hashed and spilled to disk without ever being held in memory as a
+    whole. Returns a dict mapping each algorithm to its SRI integrity string.
+    """
+    for algorithm in algorithms:
+        assert algorithm in SRI_ALGORITHMS, "Unsupported SRI algorithm"
+    digests = [hashlib.new(algorithm) for algorithm in algorithms]
+    out = open(file, "wb") if file is not None else None
     try:
-        authenticators = netrc.netrc().authenticators(parts.netloc)
-    except FileNotFoundError:
-        authenticators = None
-    if authenticators != None:
-        (login, _, password) = authenticators
-        req = urllib.request.Request(url, headers=headers)
-        creds = base64.b64encode(str.encode("%s:%s" % (login, password))).decode()
-        req.add_header(authorization_header_name, "Basic %s" % creds)
-    else:
-        req = urllib.request.Request(url, headers=headers)
+        for chunk in chunks:
+            for digest in digests:
+                digest.update(chunk)
+            if out:
+                out.write(chunk)
+    finally:
+        if out:
+            out.close()
+    return {algorithm: _sri(digest) for algorithm, digest in zip(algorithms, digests)}
 
-    with urllib.request.urlopen(req) as response:
-        return response.read()
 
+def download_and_hash(url, algorithms=("sha256",), file=None, timeout=None):
+    """Stream `url` in bounded memory, see `hash_chunks` and `iter_download`."""
+    return hash_chunks(iter_download(url, timeout=timeout), algorithms, file)
 
-def download_file(url, file):
-    with open(file, "wb") as f:
-        f.write(download(url))
+
+def download_file(url, file, expected_integrity=None):
+    cache = get_download_cache()
+    if cache:
+        path, _ = cache.fetch(url, expected_integrity)
+        shutil.copyfile(path, file)
+        return
+    hash_chunks(iter_download(url), algorithms=(), file=file)
 
 
 def read(path):
@@ -142,16 +432,14 @@ def read(path):
         return file.read()
 
 
+def _sri(digest):
+    encoded = base64.b64encode(digest.digest()).decode()
+    return f"{digest.name}-{encoded}"
+
+
 def integrity(data, algorithm="sha256"):
-    assert algorithm in {
-        "sha224",
-        "sha256",
-        "sha384",
-        "sha512",
-    }, "Unsupported SRI algorithm"
-    hash = getattr(hashlib, algorithm)(data)
-    encoded = base64.b64encode(hash.digest()).decode()
-    return f"{algorithm}-{encoded}"
+    assert algorithm in SRI_ALGORITHMS, "Unsupported SRI algorithm"
+    return _sri(hashlib.new(algorithm, data))
 
 
 def integrity_for_comparison(data, expected_integrity):
@@ -159,58 +447,253 @@ def integrity_for_comparison(data, expected_integrity):
     return integrity(data, algorithm)
 
 
+def url_integrity(url, algorithm="sha256", timeout=None):
+    """Like `integrity(download(url))`, but without buffering the whole body."""
+    cache = get_download_cache()
+    if cache:
+        return cache.fetch(url, algorithm=algorithm, timeout=timeout)[1]
+    return download_and_hash(url, (algorithm,), timeout=timeout)[algorithm]
+
+
+def url_integrity_for_comparison(url, expected_integrity, timeout=None, revalidate=False):
+    cache = get_download_cache()
+    if cache:
+        return cache.fetch(url, expected_integrity, timeout=timeout, revalidate=revalidate)[1]
+    algorithm, _ = expected_integrity.split("-", 1)
+    return url_integrity(url, algorithm, timeout)
+
+
+def file_integrity(path, algorithm="sha256"):
+    """Like `integrity(read(path))`, but without buffering the whole file."""
+    return hash_chunks(iter_file(path), (algorithm,))[algorithm]
+
+
+# Environment variable pointing at the directory of the shared download cache.
+DOWNLOAD_CACHE_ENV = "BCR_DOWNLOAD_CACHE"
+
+DEFAULT_DOWNLOAD_CACHE_MAX_SIZE = 20 * 1024 * 1024 * 1024
+
+
+class DownloadCache:
+    """A content-addressable store of downloaded files, keyed by SRI integrity.
+
+    Blobs live at `<root>/cas/<algorithm>/<hex digest>` and are written
+    atomically, so a crashed or concurrent run never leaves a truncated blob
+    behind. `<root>/urls.json` remembers which integrity each URL produced the
+    last time it was fetched, which lets `fetch` skip the network entirely when
+    the caller already knows what the URL should serve and only needs the
+    content. Once the store grows beyond `max_size` bytes, the least recently
+    used blobs are evicted.
+    """
+
+    # The fraction of `max_size` that eviction shrinks the store to.
+    EVICTION_TARGET = 0.9
+
+    def __init__(self, root, max_size=DEFAULT_DOWNLOAD_CACHE_MAX_SIZE):
+        self.root = pathlib.Path(root)
+        self.max_size = max_size
+        self._cas_dir = self.root / "cas"
+        self._index_path = self.root / "urls.json"
+        self._lock = threading.Lock()
+        # The size of the blobs in bytes, kept up to date as blobs are added and evicted. None until the store
+        # is scanned, see `evict`; blobs that other processes add are only noticed by the next scan.
+        self._size = None
+        self._cas_dir.mkdir(parents=True, exist_ok=True)
+        self._index = self._read_index()
+
+    def path_for(self, integrity):
+        algorithm, encoded = integrity.split("-", 1)
+        if algorithm not in SRI_ALGORITHMS:
+            raise RegistryException(f"Unsupported SRI algorithm in integrity `{integrity}`.")
+        return self._cas_dir / algorithm / base64.b64decode(encoded).hex()
+
+    def get(self, integrity):
+        """Return the path of the blob with the given integrity, or None if it isn't cached."""
+        path = self.path_for(integrity)
+        try:
+            # Bump the mtime, which is what the LRU eviction goes by.
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def lookup_url(self, url):
+        """Return the integrity `url` produced when it was last fetched, or None."""
+        with self._lock:
+            return self._index.get(url)
+
+    def fetch(self, url, expected_integrity=None, algorithm="sha256", timeout=None, revalidate=False):
+        """Return `(path, integrity)` of the content served at `url`.
+
+        If `expected_integrity` is given, its algorithm is used and the cached
+        blob is returned without any network access as long as `url` is known
+        to have served exactly that content before. Without an expected value,
+        any cached result for `url` in `algorithm` is reused. The returned
+        integrity is the one actually observed, so callers can still compare it
+        against `expected_integrity` to detect a mismatch. `timeout` applies to
+        the download, see `iter_download`.
+
+        With `revalidate`, `url` is always downloaded again, for callers that
+        check what it serves now rather than only need its content.
+        """
+        if expected_integrity:
+            algorithm, _ = expected_integrity.split("-", 1)
+        known = None if revalidate else self.lookup_url(url)
+        if known and known.startswith(f"{algorithm}-") and expected_integrity in (None, known):
+            path = self.get(known)
+            if path:
+                return path, known
+        return self._download(url, algorithm, timeout)
+
+    def _download(self, url, algorithm, timeout=None):
+        tmp = tempfile.NamedTemporaryFile(dir=self.root, prefix=".download-", delete=False)
+        tmp.close()
+        try:
+            integrity = download_and_hash(url, (algorithm,), file=tmp.name, timeout=timeout)[algorithm]
+            path = self.path_for(integrity)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            added = 0 if path.exists() else os.stat(tmp.name).st_size
+            os.replace(tmp.name, path)
+        except BaseException:
+            os.unlink(tmp.name)
+            raise
+        with self._locked_index():
+            self._index = self._read_index()
+            self._index[url] = integrity
+            self._write_index()
+            if self._size is not None:
+                self._size += added
+        self.evict(keep=path)
+        return path, integrity
+
+    @contextlib.contextmanager
+    def _locked_index(self):
+        """Lock the index against other threads and, where supported, other processes sharing the cache."""
+        with self._lock, open(self.root / ".urls.json.lock", "a") as lock:
+            if fcntl:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _read_index(self):
+        try:
+            return json.loads(self._index_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self):
+        tmp = self._index_path.with_name(f".{self._index_path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_text(json.dumps(self._index, indent=1, sort_keys=True))
+        os.replace(tmp, self._index_path)
+
+    def evict(self, keep=None):
+        """Delete least recently used blobs, but never `keep`, once the store doesn't fit into `max_size`.
+
+        The store is only scanned when its running size exceeds `max_size` (or isn't known yet), and then
+        shrunk to `EVICTION_TARGET` of it, so that a full store isn't scanned again on every download.
+        """
+        with self._lock:
+            if self._size is not None and self._size <= self.max_size:
+                return
+            blobs = []
+            for path in self._cas_dir.glob("*/*"):
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                blobs.append((st.st_mtime_ns, st.st_size, path))
+            total = sum(size for _, size, _ in blobs)
+            if total > self.max_size:
+                for _, size, path in sorted(blobs):
+                    if total <= self.max_size * self.EVICTION_TARGET:
+                        break
+                    if path == keep:
+                        continue
+                    path.unlink(missing_ok=True)
+                    total -= size
+            self._size = total
+
+
+_download_cache = None
+
+
+def set_download_cache(cache):
+    """Route `download_file` and `url_integrity*` through `cache` (a `DownloadCache` or None)."""
+    global _download_cache
+    _download_cache = cache
+
+
+def get_download_cache():
+    """Return the active `DownloadCache`, creating one from `$BCR_DOWNLOAD_CACHE` if it is set."""
+    global _download_cache
+    if _download_cache is None and os.getenv(DOWNLOAD_CACHE_ENV):
+        _download_cache = DownloadCache(os.getenv(DOWNLOAD_CACHE_ENV))
+    return _download_cache
+
+
 def json_dump(file, data, sort_keys=True):
     with open(file, "w", newline="\n") as f:
         json.dump(data, f, indent=4, sort_keys=sort_keys)
         f.write("\n")
 
 
+_VERSION_PATTERN = re.compile(r"^([a-zA-Z0-9.]+)(?:-([a-zA-Z0-9.-]+))?(?:\+[a-zA-Z0-9.-]+)?$")
+
+
 # Translated from:
 # https://github.com/bazelbuild/bazel/blob/79a53def2ebbd9358450f739ea37bf70662e8614/src/main/java/com/google/devtools/build/lib/bazel/bzlmod/Version.java#L58
-@functools.total_ordering
 class Version:
-    @functools.total_ordering
-    class Identifier:
-        def __init__(self, s):
-            if not s:
-                raise RegistryException("identifier is empty")
-            self.val = int(s) if s.isnumeric() else s
+    """A Bazel module version.
 
-        def __eq__(self, other):
-            if type(self.val) != type(other.val):
-                return False
-            return self.val == other.val
+    The version is reduced to a single tuple `key` on construction, so that
+    comparing and sorting versions boils down to native tuple comparisons.
+    Use `Version.parse` to share instances for repeated version strings.
+    """
 
-        def __lt__(self, other):
-            if type(self.val) != type(other.val):
-                return type(self.val) == int
-            return self.val < other.val
+    __slots__ = ("key",)
 
     @staticmethod
     def convert_to_identifiers(s):
         if s == None:
             return None
-        return [Version.Identifier(i) for i in s.split(".")]
+        identifiers = []
+        for i in s.split("."):
+            if not i:
+                raise RegistryException("identifier is empty")
+            # Numeric identifiers sort before alphanumeric ones.
+            identifiers.append((0, int(i)) if i.isnumeric() else (1, i))
+        return tuple(identifiers)
 
     def __init__(self, version_str):
-        PATTERN = re.compile(r"^([a-zA-Z0-9.]+)(?:-([a-zA-Z0-9.-]+))?(?:\+[a-zA-Z0-9.-]+)?$")
-        m = PATTERN.match(version_str)
+        m = _VERSION_PATTERN.match(version_str)
         if not m:
             raise RegistryException(f"`{version_str}` is not a valid version")
-        self.release = Version.convert_to_identifiers(m.groups()[0])
-        self.prerelease = Version.convert_to_identifiers(m.groups()[1])
+        release = Version.convert_to_identifiers(m.groups()[0])
+        prerelease = Version.convert_to_identifiers(m.groups()[1])
+        # A release sorts after all of its prereleases.
+        self.key = (release, 1, ()) if prerelease is None else (release, 0, prerelease)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=16384)
+    def parse(version_str):
+        return Version(version_str)
 
     def __eq__(self, other):
-        return (self.release, self.prerelease) == (other.release, other.prerelease)
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
 
     def __lt__(self, other):
-        if self.release != other.release:
-            return self.release < other.release
-        if self.prerelease == None:
-            return False
-        if other.prerelease == None:
-            return True
-        return self.prerelease < other.prerelease
+        return self.key < other.key
+
+    def __le__(self, other):
+        return self.key <= other.key
+
+    def __gt__(self, other):
+        return self.key > other.key
+
+    def __ge__(self, other):
+        return self.key >= other.key
 
 
 class Module:
@@ -292,15 +775,265 @@ class RegistryException(Exception):
     """
 
 
+def parse_module_attributes(module_dot_bazel_file, content=None):
+    """Return the keyword arguments of the `module()` call in a MODULE.bazel file.
+
+    Only constants and lists of constants are extracted. Returns None if the
+    file has no top-level `module()` call. If `content` is given, it is parsed
+    instead of reading the file, e.g. for an older revision of it.
+    """
+    if content is None:
+        with open(module_dot_bazel_file, "r") as file:
+            content = file.read()
+    tree = ast.parse(content, filename=str(module_dot_bazel_file))
+    for node in tree.body:
+        if (
+            isinstance(node, ast.Expr)
+            and isinstance(node.value, ast.Call)
+            and isinstance(node.value.func, ast.Name)
+            and node.value.func.id == "module"
+        ):
+            attributes = {}
+            for k in node.value.keywords:
+                if isinstance(k.value, ast.Constant):
+                    attributes[k.arg] = k.value.value
+                elif isinstance(k.value, ast.List):
+                    attributes[k.arg] = [v.value for v in k.value.elts if isinstance(v, ast.Constant)]
+            return attributes
+    return None
+
+
+@dataclasses.dataclass(frozen=True)
+class ModuleVersionAttributes:
+    """The attributes of a module version that checks compare across the versions of a module."""
+
+    # The version declared in MODULE.bazel, which should match the version directory.
+    declared_version: object
+    compatibility_level: int
+    bazel_compatibility: list
+    yanked: bool
+
+
+class ModuleAttributeTable:
+    """The versions of a module and their `ModuleVersionAttributes`.
+
+    The versions are sorted once, and the MODULE.bazel file of each version is
+    parsed on first use by `load_attributes(version)`, which returns the
+    attributes of its `module()` call (see `parse_module_attributes`). Checks
+    that compare a version with its neighbors share the parsed attributes, so
+    validating all versions of a module parses every MODULE.bazel file once.
+    """
+
+    def __init__(self, versions, yanked_versions, load_attributes):
+        self.versions = sorted(versions, key=Version.parse)
+        self.yanked_versions = yanked_versions
+        self._load_attributes = load_attributes
+        self._positions = {version: i for i, version in enumerate(self.versions)}
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def __contains__(self, version):
+        return version in self._positions
+
+    def __getitem__(self, version):
+        with self._lock:
+            if version in self._entries:
+                return self._entries[version]
+        attributes = self._load_attributes(version) or {}
+        entry = ModuleVersionAttributes(
+            declared_version=attributes.get("version"),
+            compatibility_level=attributes.get("compatibility_level", 0),
+            bazel_compatibility=attributes.get("bazel_compatibility", []),
+            yanked=version in self.yanked_versions,
+        )
+        with self._lock:
+            self._entries[version] = entry
+        return entry
+
+    def neighbors(self, version):
+        """Return the versions whose compatibility_level that of `version` is compared with: the most recent
+        non-yanked version before it and the version right after it, either of which may be None."""
+        if version not in self._positions:
+            raise ValueError(f"{version} is not in the list of versions")
+        index = self._positions[version]
+        next_version = self.versions[index + 1] if index < len(self.versions) - 1 else None
+        previous_version = None
+        for candidate_version in reversed(self.versions[:index]):
+            if candidate_version not in self.yanked_versions:
+                previous_version = candidate_version
+                break
+        return previous_version, next_version
+
+
+# A file modified within the file system's timestamp granularity could change
+# again without its stat stamp changing (the "racy git" problem), so stat-based
+# caches only remember files whose mtime is at least this old.
+_RACY_WINDOW_NS = 2 * 1000 * 1000 * 1000
+
+
+def _is_settled(st):
+    return time.time_ns() - st.st_mtime_ns > _RACY_WINDOW_NS
+
+
+# Environment variable pointing at the snapshot file of the registry index.
+REGISTRY_INDEX_ENV = "BCR_REGISTRY_INDEX"
+
+
+class RegistryIndex:
+    """A snapshot of parsed registry files, persisted as a single compact JSON file.
+
+    Every entry is keyed by the file's path under the registry root and
+    remembers the `(mtime_ns, size)` it was parsed at, so a lookup costs one
+    `stat` and the file is only parsed again after it changed. Directory
+    listings are cached the same way by the directory's mtime. Call `save` to
+    write back what changed.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, root, path):
+        self.root = pathlib.Path(root)
+        self.path = pathlib.Path(path)
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            snapshot = json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            snapshot = {}
+        if snapshot.get("format") != self.FORMAT_VERSION or snapshot.get("root") != str(self.root.resolve()):
+            snapshot = {"format": self.FORMAT_VERSION, "root": str(self.root.resolve()), "entries": {}}
+        self._snapshot = snapshot
+        self._entries = snapshot["entries"]
+
+    def lookup(self, kind, path, loader):
+        """Return `loader(path)`, reusing the snapshot while the file at `path` is unchanged."""
+        path = os.fspath(path)
+        st = os.stat(path)
+        key = f"{kind}:{path}"
+        stamp = [st.st_mtime_ns, st.st_size]
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == stamp:
+                return _copy_json(entry[1])
+        value = loader(pathlib.Path(path))
+        if _is_settled(st):
+            with self._lock:
+                self._entries[key] = [stamp, value]
+                self._dirty = True
+        return _copy_json(value)
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+            tmp.write_text(json.dumps(self._snapshot, separators=(",", ":")))
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+
+def default_integrity_cache_path():
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return pathlib.Path(cache_home) / "bcr" / "integrity_cache.json"
+
+
+class IntegrityCache:
+    """A sidecar cache of SRI hashes for incremental `update_integrity` runs.
+
+    Local files are remembered by `(path, size, mtime_ns, inode)`, so only
+    patch and overlay files that changed since the last run are hashed again.
+    Source archives are remembered by URL: as long as a source.json still has
+    the URL and integrity recorded here, the archive isn't downloaded again.
+    """
+
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            data = json.loads(self.path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            data = {}
+        self._files = data.get("files", {})
+        self._urls = data.get("urls", {})
+
+    def file_integrity(self, path, algorithm="sha256"):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ino, algorithm]
+        with self._lock:
+            entry = self._files.get(path)
+            if entry and entry[:-1] == stamp:
+                return entry[-1]
+        result = file_integrity(path, algorithm)
+        if _is_settled(st):
+            with self._lock:
+                self._files[path] = stamp + [result]
+                self._dirty = True
+        return result
+
+    def url_integrity(self, url, current_integrity=None):
+        """Return the integrity of `url`, reusing `current_integrity` if this cache computed it last time."""
+        with self._lock:
+            if current_integrity and self._urls.get(url) == current_integrity:
+                return current_integrity
+        result = url_integrity(url)
+        with self._lock:
+            self._urls[url] = result
+            self._dirty = True
+        return result
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}")
+            tmp.write_text(json.dumps({"files": self._files, "urls": self._urls}, separators=(",", ":")))
+            os.replace(tmp, self.path)
+            self._dirty = False
+
+
+def _copy_json(value):
+    # Much cheaper than `copy.deepcopy` for the plain JSON values in the index.
+    if isinstance(value, dict):
+        return {k: _copy_json(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_json(v) for v in value]
+    return value
+
+
+def _load_json(path):
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _list_dir(path):
+    return [p.name for p in path.iterdir()]
+
+
 class RegistryClient:
     """A class to help create a Bazel registry."""
 
-    def __init__(self, root):
+    def __init__(self, root, index_path=None):
         self.root = pathlib.Path(root)
+        index_path = index_path or os.getenv(REGISTRY_INDEX_ENV)
+        self._index = RegistryIndex(self.root, index_path) if index_path else None
+        self._lock = threading.Lock()
+        self._attribute_tables = {}
+
+    def _read(self, kind, path, loader):
+        if self._index:
+            return self._index.lookup(kind, path, loader)
+        return loader(path)
+
+    def save_index(self):
+        """Persist the registry index snapshot, if one is used."""
+        if self._index:
+            self._index.save()
 
     def get_all_modules(self):
         modules_dir = self.root.joinpath("modules")
-        return [path.name for path in modules_dir.iterdir()]
+        return self._read("dir", modules_dir, _list_dir)
 
     def get_module_versions(self, module_name, include_yanked=True):
         module_versions = []
@@ -317,7 +1050,7 @@ class RegistryClient:
         return module_versions
 
     def get_metadata(self, module_name):
-        return json.loads(self.get_metadata_path(module_name).read_text(encoding="utf-8"))
+        return self._read("json", self.get_metadata_path(module_name), _load_json)
 
     def get_metadata_path(self, module_name):
         return self.root / "modules" / module_name / "metadata.json"
@@ -332,7 +1065,7 @@ class RegistryClient:
         return self.get_version_dir(module_name, version) / "overlay"
 
     def get_source(self, module_name, version):
-        return json.loads(self.get_source_json_path(module_name, version).read_text(encoding="utf-8"))
+        return self._read("json", self.get_source_json_path(module_name, version), _load_json)
 
     def get_source_json_path(self, module_name, version):
         return self.get_version_dir(module_name, version) / "source.json"
@@ -352,6 +1085,28 @@ class RegistryClient:
     def get_module_dot_bazel_path(self, module_name, version):
         return self.get_version_dir(module_name, version) / "MODULE.bazel"
 
+    def get_module_attributes(self, module_name, version):
+        """Return the attributes of the `module()` call in the module version's MODULE.bazel file."""
+        return self._read("module", self.get_module_dot_bazel_path(module_name, version), parse_module_attributes)
+
+    def get_module_attribute_table(self, module_name):
+        """Return the `ModuleAttributeTable` of a module, built from its metadata.json file on first use.
+
+        The table is shared by all callers of this client, so later changes to the
+        versions in metadata.json aren't picked up.
+        """
+        with self._lock:
+            if module_name in self._attribute_tables:
+                return self._attribute_tables[module_name]
+        metadata = self.get_metadata(module_name)
+        table = ModuleAttributeTable(
+            metadata["versions"],
+            metadata.get("yanked_versions", {}),
+            functools.partial(self.get_module_attributes, module_name),
+        )
+        with self._lock:
+            return self._attribute_tables.setdefault(module_name, table)
+
     def get_attestations(self, module_name, version):
         path = self.get_version_dir(module_name, version) / "attestations.json"
         if not path.exists():
@@ -443,7 +1198,7 @@ class RegistryClient:
         # Create source.json & copy patch files to the registry
         source = {
             "url": module.url,
-            "integrity": integrity(download(module.url)),
+            "integrity": url_integrity(module.url),
         }
         if module.strip_prefix:
             source["strip_prefix"] = module.strip_prefix
@@ -457,7 +1212,7 @@ class RegistryClient:
         if module.patches:
             for s in module.patches:
                 patch = pathlib.Path(s)
-                source["patches"][patch.name] = integrity(read(patch))
+                source["patches"][patch.name] = file_integrity(patch)
                 shutil.copy(patch, patch_dir)
 
         # Turn additional BUILD file into a patch
@@ -469,7 +1224,7 @@ class RegistryClient:
             patch = patch_dir.joinpath(patch_name)
             with patch.open("w") as f:
                 f.writelines(patch_content)
-            source["patches"][patch_name] = integrity(read(patch))
+            source["patches"][patch_name] = file_integrity(patch)
 
         json_dump(p.joinpath("source.json"), source, sort_keys=False)
 
@@ -524,7 +1279,7 @@ class RegistryClient:
         metadata = json.load(metadata_path.open())
         metadata["versions"].append(module.version)
         metadata["versions"] = list(set(metadata["versions"]))
-        metadata["versions"].sort(key=Version)
+        metadata["versions"].sort(key=Version.parse)
         json_dump(metadata_path, metadata)
 
     def update_versions(self, module_name):
@@ -532,17 +1287,14 @@ class RegistryClient:
         module_path = self.root / "modules" / module_name
         versions = (v.name for v in module_path.iterdir() if v.is_dir())
         metadata = self.get_metadata(module_name)
-        metadata["versions"] = sorted(versions, key=Version)
+        metadata["versions"] = sorted(versions, key=Version.parse)
         metadata_path = self.get_metadata_path(module_name)
         json_dump(metadata_path, metadata)
 
-    def update_integrity(self, module_name, version):
-        """Update the SRI hashes of the source.json file of module at version."""
+    def _integrity_inputs(self, module_name, version):
+        """Return the source.json content of module at version, plus the patch and overlay files to hash."""
         source = self.get_source(module_name, version)
-        source["integrity"] = integrity(download(source["url"]))
-        source_path = self.get_source_json_path(module_name, version)
-
-        patch_dir = source_path.parent / "patches"
+        patch_dir = self.get_version_dir(module_name, version) / "patches"
         if patch_dir.exists():
             available = sorted(p.name for p in patch_dir.iterdir())
         else:
@@ -550,11 +1302,7 @@ class RegistryClient:
         current = source.get("patches", {}).keys()
         patch_files = [patch_dir / p for p in current]
         patch_files.extend(patch_dir / p for p in available if p not in current)
-        patches = {patch.relative_to(patch_dir).as_posix(): integrity(read(patch)) for patch in patch_files}
-        if patches:
-            source["patches"] = patches
-        else:
-            source.pop("patches", None)
+        patches = {patch.relative_to(patch_dir).as_posix(): patch for patch in patch_files}
 
         overlay_dir = self.get_overlay_dir(module_name, version)
         overlay_files = []
@@ -566,13 +1314,72 @@ class RegistryClient:
                     if p.is_file() and p.name != "MODULE.bazel.lock"
                 ]
             )
-        overlay_integrities = {file.as_posix(): integrity(read(overlay_dir / file)) for file in overlay_files}
-        if overlay_files:
-            source["overlay"] = overlay_integrities
-        else:
-            source.pop("overlay", None)
+        overlay = {file.as_posix(): overlay_dir / file for file in overlay_files}
+        return source, patches, overlay
 
-        json_dump(source_path, source, sort_keys=False)
+    def update_integrity(self, module_name, version):
+        """Update the SRI hashes of the source.json file of module at version."""
+        self.update_integrities([(module_name, version)])
+
+    def update_integrities(self, module_versions, jobs=8, cache=None):
+        """Update the SRI hashes of the source.json files of many (module, version) pairs.
+
+        Source archives are downloaded and patch and overlay files are hashed
+        concurrently on `jobs` threads. The source.json files are only written
+        once every hash is known, so a failure leaves all of them untouched.
+        With an `IntegrityCache`, unchanged files and archives aren't hashed again.
+        """
+        if cache:
+            hash_file = cache.file_integrity
+
+            def hash_url(source):
+                return cache.url_integrity(source["url"], source.get("integrity"))
+
+        else:
+            hash_file = file_integrity
+
+            def hash_url(source):
+                return url_integrity(source["url"])
+
+        pending = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            for module_name, version in module_versions:
+                source, patches, overlay = self._integrity_inputs(module_name, version)
+                pending.append(
+                    (
+                        module_name,
+                        version,
+                        source,
+                        executor.submit(hash_url, source),
+                        {name: executor.submit(hash_file, path) for name, path in patches.items()},
+                        {name: executor.submit(hash_file, path) for name, path in overlay.items()},
+                    )
+                )
+
+            updates = []
+            failures = []
+            for module_name, version, source, archive, patches, overlay in pending:
+                try:
+                    source["integrity"] = archive.result()
+                    if patches:
+                        source["patches"] = {name: f.result() for name, f in patches.items()}
+                    else:
+                        source.pop("patches", None)
+                    if overlay:
+                        source["overlay"] = {name: f.result() for name, f in overlay.items()}
+                    else:
+                        source.pop("overlay", None)
+                except Exception as e:
+                    failures.append(f"{module_name}@{version}: {e}")
+                    continue
+                updates.append((self.get_source_json_path(module_name, version), source))
+
+        if cache:
+            cache.save()
+        if failures:
+            raise RegistryException("Failed to update the integrity of:\n  " + "\n  ".join(failures))
+        for source_path, source in updates:
+            json_dump(source_path, source, sort_keys=False)
 
     def delete(self, module_name, version):
         """Delete an existing module version."""
@@ -595,29 +1402,282 @@ def _download_if_exists(url):
         raise RegistryException(f"Failed to read {url}: {ex.reason}")
 
 
-class UpstreamRegistry:
-    def __init__(self, modules_dir_url):
+class HttpCache:
+    """An on-disk cache of HTTP GET responses that is revalidated with conditional requests.
+
+    Responses are stored together with their ETag and Last-Modified headers and
+    revalidated with If-None-Match / If-Modified-Since, so a file that didn't
+    change costs a bodiless 304. 404s can't be revalidated, so they are cached
+    for `negative_ttl` seconds instead.
+    """
+
+    def __init__(self, root, negative_ttl=600):
+        self.root = pathlib.Path(root)
+        self.negative_ttl = negative_ttl
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return self.root / f"{key}.json", self.root / f"{key}.body"
+
+    def get_if_exists(self, url):
+        """Return the body of `url`, or None if it doesn't exist, like `_download_if_exists`."""
+        meta_path, body_path = self._paths(url)
+        try:
+            meta = json.loads(meta_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = None
+
+        headers = {}
+        if meta and meta["status"] == 404:
+            if time.time() - meta["time"] < self.negative_ttl:
+                return None
+        elif meta and body_path.exists():
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            with get_session().open(url, headers=headers) as response:
+                if response.status == 304 and headers:
+                    return body_path.read_bytes()
+                body = response.read()
+                tracing.add(tracing.BYTES_DOWNLOADED, len(body))
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+        except urllib.error.HTTPError as ex:
+            if ex.code == 304 and headers:
+                return body_path.read_bytes()
+            if ex.code == 404:
+                self._store(meta_path, {"url": url, "status": 404, "time": time.time()})
+                return None
+            raise RegistryException(f"Failed to read {url}: {ex.reason}")
+
+        tmp = body_path.with_name(f".{body_path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_bytes(body)
+        os.replace(tmp, body_path)
+        self._store(
+            meta_path,
+            {"url": url, "status": 200, "time": time.time(), "etag": etag, "last_modified": last_modified},
+        )
+        return body
+
+    def _store(self, meta_path, meta):
+        tmp = meta_path.with_name(f".{meta_path.name}.{os.getpid()}.{threading.get_ident()}")
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, meta_path)
+
+
+class HttpUpstreamBackend:
+    """Reads upstream registry files from a base URL, e.g. https://bcr.bazel.build/modules or a mirror."""
+
+    def __init__(self, modules_dir_url, cache_dir=None):
         self._root_url = modules_dir_url
+        self._http_cache = HttpCache(cache_dir) if cache_dir else None
 
-    def get_latest_module_version(self, module_name):
-        metadata_url = posixpath.join(self._root_url, module_name, "metadata.json")
-        content = _download_if_exists(metadata_url)
-        if not content:
+    def get_if_exists(self, path):
+        url = posixpath.join(self._root_url, path)
+        if self._http_cache:
+            return self._http_cache.get_if_exists(url)
+        return _download_if_exists(url)
+
+    def close(self):
+        pass
+
+
+class LocalUpstreamBackend:
+    """Reads upstream registry files from the modules/ directory of a local checkout."""
+
+    def __init__(self, modules_dir):
+        self._root = pathlib.Path(modules_dir).resolve()
+
+    def get_if_exists(self, path):
+        file = (self._root / path).resolve()
+        try:
+            file.relative_to(self._root)
+        except ValueError as e:
+            raise RegistryException(f"Path `{path}` must point inside {self._root}.") from e
+        try:
+            return file.read_bytes()
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
             return None
 
-        metadata = json.loads(content)
-        latest_version = metadata["versions"][-1]  # Presubmit ensures asc. order
-        module_root_url = posixpath.join(self._root_url, module_name, latest_version)
-        return ModuleSnapshot(latest_version, module_root_url)
+    def close(self):
+        pass
+
+
+class GitUpstreamBackend:
+    """Reads upstream registry files straight from a git object database, without a checkout.
+
+    A single `git cat-file --batch` process serves all reads, so looking up a
+    file costs a pipe round trip rather than a process spawn.
+    """
+
+    def __init__(self, repo, ref="HEAD", modules_dir="modules"):
+        self._repo = str(repo)
+        self._ref = self._resolve(ref)
+        self._modules_dir = modules_dir
+        self._lock = threading.Lock()
+        self._process = None
+
+    def _resolve(self, ref):
+        """Return the commit `ref` points to. `cat-file` reports files at a mistyped ref as missing, which
+        would make every module look new to the upstream checks, so fail early instead."""
+        tracing.add(tracing.SUBPROCESSES)
+        try:
+            result = subprocess.run(
+                ["git", "-C", self._repo, "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"],
+                capture_output=True,
+            )
+        except FileNotFoundError as e:
+            raise RegistryException("Reading the upstream registry from git requires `git`.") from e
+        if result.returncode:
+            raise RegistryException(f"`{ref}` is not a commit in the git repository {self._repo}.")
+        return result.stdout.decode().strip()
+
+    def _cat_file(self):
+        if self._process is None:
+            tracing.add(tracing.SUBPROCESSES)
+            try:
+                self._process = subprocess.Popen(
+                    ["git", "-C", self._repo, "cat-file", "--batch"],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                )
+            except FileNotFoundError as e:
+                raise RegistryException("Reading the upstream registry from git requires `git`.") from e
+        return self._process
+
+    def get_if_exists(self, path):
+        if "\n" in path:
+            raise RegistryException(f"Invalid upstream path `{path!r}`.")
+        with self._lock:
+            process = self._cat_file()
+            process.stdin.write(f"{self._ref}:{posixpath.join(self._modules_dir, path)}\n".encode())
+            process.stdin.flush()
+            header = process.stdout.readline()
+            if not header:
+                raise RegistryException(f"`git cat-file` exited while reading {path} from {self._repo}.")
+            fields = header.split()
+            if len(fields) != 3:
+                # "<object> missing" or "<object> ambiguous"
+                return None
+            _, object_type, size = fields
+            content = process.stdout.read(int(size))
+            process.stdout.read(1)  # Trailing newline.
+            return content if object_type == b"blob" else None
+
+    def close(self):
+        with self._lock:
+            if self._process:
+                self._process.stdin.close()
+                self._process.wait()
+                self._process = None
+
+
+def upstream_backend(spec, cache_dir=None):
+    """Create an upstream registry backend from a command line spec.
+
+    `spec` is one of:
+      - an http(s) URL of a modules/ directory, e.g. https://bcr.bazel.build/modules or a mirror;
+      - `git:<repo>[#<ref>]`, reading the modules/ directory at `<ref>` (default: HEAD) of a git repository;
+      - a local directory, either a registry root or its modules/ directory.
+    """
+    if spec.startswith(("http://", "https://")):
+        return HttpUpstreamBackend(spec, cache_dir)
+    if spec.startswith("git:"):
+        repo, _, ref = spec[len("git:") :].partition("#")
+        return GitUpstreamBackend(repo, ref or "HEAD")
+    path = pathlib.Path(spec)
+    if not path.is_dir():
+        raise RegistryException(f"Upstream registry `{spec}` is neither a URL nor an existing directory.")
+    if (path / "modules").is_dir():
+        path = path / "modules"
+    return LocalUpstreamBackend(path)
+
+
+class UpstreamRegistry:
+    """Read-only access to the latest module versions of an upstream registry.
+
+    Files are read through a backend (HTTP, a local directory or a git
+    repository, see `upstream_backend`), and every file is read at most once
+    per instance. For a plain `modules_dir_url`, a `cache_dir` keeps responses
+    on disk and revalidates them with conditional GETs across runs (see
+    `HttpCache`).
+    """
+
+    def __init__(self, modules_dir_url=None, cache_dir=None, backend=None):
+        self._backend = backend or HttpUpstreamBackend(modules_dir_url, cache_dir)
+        self._lock = threading.Lock()
+        self._responses = {}
+        self._snapshots = {}
+
+    def _fetch_if_exists(self, path):
+        with self._lock:
+            if path in self._responses:
+                return self._responses[path]
+        content = self._backend.get_if_exists(path)
+        with self._lock:
+            self._responses[path] = content
+        return content
+
+    def get_latest_module_version(self, module_name):
+        with self._lock:
+            if module_name in self._snapshots:
+                return self._snapshots[module_name]
+        content = self._fetch_if_exists(posixpath.join(module_name, "metadata.json"))
+        snapshot = None
+        if content:
+            metadata = json.loads(content)
+            latest_version = metadata["versions"][-1]  # Presubmit ensures asc. order
+            module_root = posixpath.join(module_name, latest_version)
+            snapshot = ModuleSnapshot(latest_version, module_root, self._fetch_if_exists)
+        with self._lock:
+            self._snapshots[module_name] = snapshot
+        return snapshot
+
+    def close(self):
+        """Release the resources of the backend, e.g. the process of a `GitUpstreamBackend`."""
+        self._backend.close()
+
+    # The files of the latest version that `ModuleSnapshot` may ask for.
+    SNAPSHOT_FILES = (PRESUBMIT_YML, "attestations.json", MODULE_DOT_BAZEL)
+
+    def prefetch(self, module_names, max_workers=16):
+        """Fetch the upstream files of many modules concurrently.
+
+        Afterwards `get_latest_module_version` and the `ModuleSnapshot` methods
+        are served from memory. Failed fetches aren't remembered, so their
+        errors surface when the file is actually asked for.
+        """
+
+        def fetch_module(module_name):
+            snapshot = self.get_latest_module_version(module_name)
+            if not snapshot:
+                return []
+            return [
+                executor.submit(self._fetch_if_exists, posixpath.join(module_name, snapshot.version, filename))
+                for filename in self.SNAPSHOT_FILES
+            ]
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            modules = [executor.submit(fetch_module, module_name) for module_name in module_names]
+            files = []
+            for future in concurrent.futures.as_completed(modules):
+                if not future.exception():
+                    files.extend(future.result())
+            concurrent.futures.wait(files)
 
 
 class ModuleSnapshot:
-    def __init__(self, version, root_url):
+    def __init__(self, version, root_url, fetch_if_exists=_download_if_exists):
         self.version = version
         self._root_url = root_url
+        self._fetch_if_exists = fetch_if_exists
 
     def _download_if_exists(self, filename):
-        return _download_if_exists(posixpath.join(self._root_url, filename))
+        return self._fetch_if_exists(posixpath.join(self._root_url, filename))
 
     def presubmit_yml_lines(self):
         raw = self._download_if_exists(PRESUBMIT_YML)
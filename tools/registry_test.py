@@ -1,13 +1,36 @@
 #!/usr/bin/env python3
+import concurrent.futures
+import hashlib
+import http.server
+import json
+import os
 import pathlib
+import subprocess
 import tempfile
+import threading
+import time
 import unittest
+import urllib.error
+from unittest import mock
 
+import registry
 from registry import (
     ALLOWED_DOWNLOAD_SCHEMES,
+    DownloadCache,
+    HttpSession,
+    IntegrityCache,
+    ModuleAttributeTable,
     RegistryClient,
     RegistryException,
+    UpstreamRegistry,
     _validate_download_url,
+    upstream_backend,
+    content_length,
+    download,
+    download_and_hash,
+    file_integrity,
+    hash_chunks,
+    integrity,
 )
 
 
@@ -45,6 +68,135 @@ class TestRegistryClient(unittest.TestCase):
             self.registry.get_patch_file_path("foo", "1.0.0", "../outside.patch")
 
 
+class TestModuleAttributeTable(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.root = pathlib.Path(self.tmp_dir.name)
+        module_dir = self.root / "modules" / "foo"
+        versions = {"1.0": 1, "1.1": 1, "2.0-rc1": 2, "2.0": 2, "10.0": 3}
+        for version, level in versions.items():
+            (module_dir / version).mkdir(parents=True)
+            (module_dir / version / "MODULE.bazel").write_text(
+                f'module(name = "foo", version = "{version}", compatibility_level = {level})\n'
+            )
+        (module_dir / "9.0").mkdir()
+        (module_dir / "9.0" / "MODULE.bazel").write_text('bazel_dep(name = "bar", version = "1.0")\n')
+        metadata = {"versions": [*versions, "9.0"], "yanked_versions": {"2.0": "broken"}}
+        (module_dir / "metadata.json").write_text(json.dumps(metadata))
+
+    def test_neighbors(self):
+        table = RegistryClient(self.root).get_module_attribute_table("foo")
+        self.assertEqual(table.versions, ["1.0", "1.1", "2.0-rc1", "2.0", "9.0", "10.0"])
+        self.assertEqual(table.neighbors("1.0"), (None, "1.1"))
+        self.assertEqual(table.neighbors("2.0-rc1"), ("1.1", "2.0"))
+        # Yanked versions are skipped when looking for the previous version only.
+        self.assertEqual(table.neighbors("9.0"), ("2.0-rc1", "10.0"))
+        self.assertEqual(table.neighbors("2.0"), ("2.0-rc1", "9.0"))
+        self.assertEqual(table.neighbors("10.0"), ("9.0", None))
+        with self.assertRaises(ValueError):
+            table.neighbors("3.0")
+
+    def test_attributes(self):
+        table = RegistryClient(self.root).get_module_attribute_table("foo")
+        self.assertEqual(table["2.0-rc1"].declared_version, "2.0-rc1")
+        self.assertEqual(table["2.0-rc1"].compatibility_level, 2)
+        self.assertEqual(table["2.0-rc1"].bazel_compatibility, [])
+        self.assertFalse(table["2.0-rc1"].yanked)
+        self.assertTrue(table["2.0"].yanked)
+        # Without a module() call, the defaults apply.
+        self.assertEqual((table["9.0"].declared_version, table["9.0"].compatibility_level), (None, 0))
+
+    def test_parses_every_module_dot_bazel_once(self):
+        client = RegistryClient(self.root)
+        with mock.patch.object(registry, "parse_module_attributes", wraps=registry.parse_module_attributes) as parse:
+            for version in client.get_module_attribute_table("foo").versions:
+                table = client.get_module_attribute_table("foo")
+                for neighbor in (version, *table.neighbors(version)):
+                    if neighbor is not None:
+                        table[neighbor]
+        self.assertEqual(sorted(call.args[0].parent.name for call in parse.call_args_list), sorted(table.versions))
+
+    def test_lazy_loading(self):
+        loaded = []
+        table = ModuleAttributeTable(["2.0", "1.0"], {}, lambda v: loaded.append(v) or {"compatibility_level": 4})
+        self.assertEqual(table.neighbors("2.0"), ("1.0", None))
+        self.assertEqual(loaded, [])
+        self.assertEqual(table["1.0"].compatibility_level, 4)
+        self.assertEqual(table["1.0"].compatibility_level, 4)
+        self.assertEqual(loaded, ["1.0"])
+
+
+class TestRegistryIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.root = pathlib.Path(self.tmp_dir.name) / "registry"
+        self.index_path = pathlib.Path(self.tmp_dir.name) / "index.json"
+        version_dir = self.root / "modules" / "foo" / "1.0"
+        version_dir.mkdir(parents=True)
+        (self.root / "modules" / "foo" / "metadata.json").write_text('{"versions": ["1.0"]}')
+        (version_dir / "source.json").write_text('{"url": "https://example.com/foo.tar.gz"}')
+        (version_dir / "MODULE.bazel").write_text(
+            'module(name = "foo", version = "1.0", compatibility_level = 2, bazel_compatibility = [">=7.2.1"])\n'
+        )
+        self.settle()
+
+    def settle(self):
+        # The index doesn't trust files modified within the last few seconds.
+        old = time.time_ns() - 3600 * 1000 * 1000 * 1000
+        for path in [self.root, *self.root.rglob("*")]:
+            os.utime(path, ns=(old, old))
+
+    def test_reads_through_index(self):
+        registry = RegistryClient(self.root, index_path=self.index_path)
+        self.assertEqual(registry.get_all_module_versions(), [("foo", "1.0")])
+        self.assertEqual(registry.get_source("foo", "1.0")["url"], "https://example.com/foo.tar.gz")
+        self.assertEqual(
+            registry.get_module_attributes("foo", "1.0"),
+            {"name": "foo", "version": "1.0", "compatibility_level": 2, "bazel_compatibility": [">=7.2.1"]},
+        )
+        registry.save_index()
+        self.assertTrue(self.index_path.exists())
+
+    def test_snapshot_is_reused_until_file_changes(self):
+        registry = RegistryClient(self.root, index_path=self.index_path)
+        registry.get_metadata("foo")
+        registry.save_index()
+
+        metadata_path = self.root / "modules" / "foo" / "metadata.json"
+        st = metadata_path.stat()
+        # Same size and mtime: the snapshot entry is (deliberately) trusted.
+        metadata_path.write_text('{"versions": ["2.0"]}')
+        os.utime(metadata_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        registry = RegistryClient(self.root, index_path=self.index_path)
+        self.assertEqual(registry.get_metadata("foo")["versions"], ["1.0"])
+
+        os.utime(metadata_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        self.assertEqual(registry.get_metadata("foo")["versions"], ["2.0"])
+
+    def test_recently_modified_files_are_not_remembered(self):
+        registry = RegistryClient(self.root, index_path=self.index_path)
+        metadata_path = self.root / "modules" / "foo" / "metadata.json"
+        metadata_path.write_text('{"versions": ["2.0"]}')
+        st = metadata_path.stat()
+        self.assertEqual(registry.get_metadata("foo")["versions"], ["2.0"])
+        metadata_path.write_text('{"versions": ["3.0"]}')
+        os.utime(metadata_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        self.assertEqual(registry.get_metadata("foo")["versions"], ["3.0"])
+
+    def test_new_module_is_listed(self):
+        registry = RegistryClient(self.root, index_path=self.index_path)
+        self.assertEqual(registry.get_all_modules(), ["foo"])
+        (self.root / "modules" / "bar").mkdir()
+        self.assertEqual(sorted(registry.get_all_modules()), ["bar", "foo"])
+
+    def test_returns_copies(self):
+        registry = RegistryClient(self.root, index_path=self.index_path)
+        registry.get_metadata("foo")["versions"].append("9.9")
+        self.assertEqual(registry.get_metadata("foo")["versions"], ["1.0"])
+
+
 class TestValidateDownloadUrl(unittest.TestCase):
     """`_validate_download_url` is the choke point that prevents PR-supplied
     URLs (`source.url`, `mirror_urls`, patch URLs) from triggering local-file
@@ -123,5 +275,476 @@ class TestValidateDownloadUrl(unittest.TestCase):
         self.assertEqual(ALLOWED_DOWNLOAD_SCHEMES, frozenset({"http", "https"}))
 
 
+class TestStreamingHash(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.tmp_path = pathlib.Path(self.tmp_dir.name)
+
+    def test_hash_chunks_matches_integrity(self):
+        chunks = [b"hello ", b"streaming ", b"world"]
+        result = hash_chunks(chunks, algorithms=("sha256", "sha512"))
+        self.assertEqual(result["sha256"], integrity(b"".join(chunks)))
+        self.assertEqual(result["sha512"], integrity(b"".join(chunks), "sha512"))
+
+    def test_hash_chunks_spills_to_file(self):
+        out = self.tmp_path / "archive"
+        result = hash_chunks(iter([b"a" * 10, b"b" * 10]), file=out)
+        self.assertEqual(out.read_bytes(), b"a" * 10 + b"b" * 10)
+        self.assertEqual(result["sha256"], integrity(out.read_bytes()))
+
+    def test_hash_chunks_rejects_unknown_algorithm(self):
+        with self.assertRaises(AssertionError):
+            hash_chunks([b""], algorithms=("md5",))
+
+    def test_file_integrity_matches_integrity(self):
+        path = self.tmp_path / "blob"
+        path.write_bytes(bytes(range(256)) * 4096)
+        self.assertEqual(file_integrity(path), integrity(path.read_bytes()))
+
+    def test_download_and_hash_rejects_disallowed_scheme(self):
+        with self.assertRaisesRegex(RegistryException, "not allowed"):
+            download_and_hash("file:///etc/passwd")
+
+    def test_download_and_hash_dev_null(self):
+        self.assertEqual(download_and_hash("file:///dev/null")["sha256"], integrity(b""))
+
+
+class FakeServer:
+    """Serves `files` (path -> bytes) over HTTP on localhost and counts connections and GET requests."""
+
+    def __init__(self, files, redirects=None, delays=None):
+        self.files = files
+        self.redirects = redirects or {}
+        # Seconds to wait before responding, by path.
+        self.delays = delays or {}
+        self.hits = []
+        self.statuses = []
+        self.connections = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                server.connections += 1
+                super().setup()
+
+            def do_HEAD(self):
+                if self.path in server.redirects:
+                    self.send_response(302)
+                    self.send_header("Location", server.redirects[self.path])
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = server.files.get(self.path)
+                self.send_response(200 if body is not None else 404)
+                self.send_header("Content-Length", str(len(body or b"")))
+                self.end_headers()
+
+            def do_GET(self):
+                server.hits.append(self.path)
+                time.sleep(server.delays.get(self.path, 0))
+                if self.path in server.redirects:
+                    self.send_response(302)
+                    self.send_header("Location", server.redirects[self.path])
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                body = server.files.get(self.path)
+                if body is None:
+                    server.statuses.append(404)
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                etag = '"%s"' % hashlib.sha256(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    server.statuses.append(304)
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                server.statuses.append(200)
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        threading.Thread(target=self._httpd.serve_forever, args=(0.01,), daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+class TestDownloadCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.server = FakeServer({"/a.tar.gz": b"a" * 1000, "/b.tar.gz": b"b" * 1000})
+        self.addCleanup(self.server.close)
+        self.cache = DownloadCache(self.tmp_dir.name)
+
+    def test_fetch_with_known_integrity_skips_network(self):
+        url = f"{self.server.url}/a.tar.gz"
+        path, first = self.cache.fetch(url)
+        self.assertEqual(first, integrity(b"a" * 1000))
+        self.assertEqual(path.read_bytes(), b"a" * 1000)
+
+        again, second = self.cache.fetch(url, expected_integrity=first)
+        self.assertEqual((again, second), (path, first))
+        self.assertEqual(self.server.hits, ["/a.tar.gz"])
+
+    def test_revalidate_downloads_again(self):
+        url = f"{self.server.url}/a.tar.gz"
+        _, expected = self.cache.fetch(url)
+        self.server.files["/a.tar.gz"] = b"changed"
+        _, actual = self.cache.fetch(url, expected_integrity=expected, revalidate=True)
+        self.assertEqual(actual, integrity(b"changed"))
+        self.assertEqual(len(self.server.hits), 2)
+
+    def test_index_survives_new_instance(self):
+        url = f"{self.server.url}/a.tar.gz"
+        _, expected = self.cache.fetch(url)
+        DownloadCache(self.tmp_dir.name).fetch(url, expected_integrity=expected)
+        self.assertEqual(len(self.server.hits), 1)
+
+    def test_mismatched_expected_integrity_downloads_again(self):
+        url = f"{self.server.url}/a.tar.gz"
+        self.cache.fetch(url)
+        _, actual = self.cache.fetch(url, expected_integrity=integrity(b"other"))
+        self.assertEqual(actual, integrity(b"a" * 1000))
+        self.assertEqual(len(self.server.hits), 2)
+
+    def test_other_algorithm_downloads_again(self):
+        url = f"{self.server.url}/a.tar.gz"
+        self.cache.fetch(url)
+        _, actual = self.cache.fetch(url, algorithm="sha512")
+        self.assertEqual(actual, integrity(b"a" * 1000, "sha512"))
+        self.assertEqual(len(self.server.hits), 2)
+
+    def test_failed_download_leaves_no_partial_files(self):
+        with self.assertRaises(Exception):
+            self.cache.fetch(f"{self.server.url}/missing.tar.gz")
+        self.assertEqual(sorted(p.name for p in pathlib.Path(self.tmp_dir.name).iterdir()), ["cas"])
+
+    def test_evicts_least_recently_used(self):
+        self.cache.max_size = 1500
+        a, _ = self.cache.fetch(f"{self.server.url}/a.tar.gz")
+        os.utime(a, ns=(0, 0))
+        b, _ = self.cache.fetch(f"{self.server.url}/b.tar.gz")
+        self.assertFalse(a.exists())
+        self.assertTrue(b.exists())
+
+    def test_never_evicts_the_fetched_blob(self):
+        self.cache.max_size = 500
+        path, _ = self.cache.fetch(f"{self.server.url}/a.tar.gz")
+        self.assertEqual(path.read_bytes(), b"a" * 1000)
+
+    def test_store_is_only_scanned_when_full(self):
+        self.cache.max_size = 2500
+        self.cache.fetch(f"{self.server.url}/a.tar.gz")
+        with mock.patch.object(pathlib.Path, "glob") as glob:
+            self.cache.fetch(f"{self.server.url}/b.tar.gz")
+        glob.assert_not_called()
+
+    def test_index_merges_concurrent_updates(self):
+        other = DownloadCache(self.tmp_dir.name)
+        self.cache.fetch(f"{self.server.url}/a.tar.gz")
+        other.fetch(f"{self.server.url}/b.tar.gz")
+        index = DownloadCache(self.tmp_dir.name)
+        self.assertEqual(index.lookup_url(f"{self.server.url}/a.tar.gz"), integrity(b"a" * 1000))
+        self.assertEqual(index.lookup_url(f"{self.server.url}/b.tar.gz"), integrity(b"b" * 1000))
+
+
+class TestUpdateIntegrities(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.server = FakeServer({"/foo.tar.gz": b"foo", "/bar.tar.gz": b"bar"})
+        self.addCleanup(self.server.close)
+        self.registry = RegistryClient(self.tmp_dir.name)
+        for name in ("foo", "bar"):
+            version_dir = self.registry.get_version_dir(name, "1.0")
+            (version_dir / "patches").mkdir(parents=True)
+            (version_dir / "patches" / "fix.patch").write_text(f"{name} patch")
+            (version_dir / "overlay" / "sub").mkdir(parents=True)
+            (version_dir / "overlay" / "sub" / "BUILD.bazel").write_text(f"{name} build")
+            source = {"url": f"{self.server.url}/{name}.tar.gz", "integrity": "outdated"}
+            self.registry.get_source_json_path(name, "1.0").write_text(json.dumps(source))
+
+    def test_updates_all_module_versions(self):
+        self.registry.update_integrities([("foo", "1.0"), ("bar", "1.0")], jobs=4)
+        for name in ("foo", "bar"):
+            self.assertEqual(
+                self.registry.get_source(name, "1.0"),
+                {
+                    "url": f"{self.server.url}/{name}.tar.gz",
+                    "integrity": integrity(name.encode()),
+                    "patches": {"fix.patch": integrity(f"{name} patch".encode())},
+                    "overlay": {"sub/BUILD.bazel": integrity(f"{name} build".encode())},
+                },
+            )
+
+    def test_incremental_update_only_rehashes_changed_files(self):
+        cache = IntegrityCache(pathlib.Path(self.tmp_dir.name) / "integrity_cache.json")
+        self.registry.update_integrities([("foo", "1.0")], cache=cache)
+        self.assertEqual(self.server.hits, ["/foo.tar.gz"])
+
+        # Rewrite the patch with different content but the same stamp: the cached hash wins.
+        patch = self.registry.get_version_dir("foo", "1.0") / "patches" / "fix.patch"
+        overlay = self.registry.get_version_dir("foo", "1.0") / "overlay" / "sub" / "BUILD.bazel"
+        for path in (patch, overlay):
+            os.utime(path, ns=(0, 0))
+        cache = IntegrityCache(pathlib.Path(self.tmp_dir.name) / "integrity_cache.json")
+        self.registry.update_integrities([("foo", "1.0")], cache=cache)
+        cache = IntegrityCache(pathlib.Path(self.tmp_dir.name) / "integrity_cache.json")
+        patch.write_text("foo PATCH")
+        os.utime(patch, ns=(0, 0))
+        overlay.write_text("new foo build")
+        os.utime(overlay, ns=(0, 1))
+        self.registry.update_integrities([("foo", "1.0")], cache=cache)
+
+        source = self.registry.get_source("foo", "1.0")
+        self.assertEqual(source["patches"], {"fix.patch": integrity(b"foo patch")})
+        self.assertEqual(source["overlay"], {"sub/BUILD.bazel": integrity(b"new foo build")})
+        # The URL and its integrity are unchanged, so the archive was only downloaded once.
+        self.assertEqual(self.server.hits, ["/foo.tar.gz"])
+
+    def test_incremental_update_downloads_new_url(self):
+        cache = IntegrityCache(pathlib.Path(self.tmp_dir.name) / "integrity_cache.json")
+        self.registry.update_integrities([("foo", "1.0")], cache=cache)
+        source = self.registry.get_source("foo", "1.0")
+        source["url"] = f"{self.server.url}/bar.tar.gz"
+        self.registry.get_source_json_path("foo", "1.0").write_text(json.dumps(source))
+        self.registry.update_integrities([("foo", "1.0")], cache=cache)
+        self.assertEqual(self.registry.get_source("foo", "1.0")["integrity"], integrity(b"bar"))
+        self.assertEqual(self.server.hits, ["/foo.tar.gz", "/bar.tar.gz"])
+
+    def test_failure_leaves_every_source_json_untouched(self):
+        source = {"url": f"{self.server.url}/missing.tar.gz", "integrity": "outdated"}
+        self.registry.get_source_json_path("bar", "1.0").write_text(json.dumps(source))
+        with self.assertRaisesRegex(RegistryException, "bar@1.0"):
+            self.registry.update_integrities([("foo", "1.0"), ("bar", "1.0")])
+        self.assertEqual(self.registry.get_source("foo", "1.0")["integrity"], "outdated")
+
+
+class TestUpstreamRegistryCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.cache_dir = pathlib.Path(self.tmp_dir.name) / "upstream"
+        self.server = FakeServer(
+            {
+                "/modules/foo/metadata.json": b'{"versions": ["1.0", "1.1"]}',
+                "/modules/foo/1.1/presubmit.yml": b"tasks: {}\n",
+            }
+        )
+        self.addCleanup(self.server.close)
+
+    def upstream(self):
+        return UpstreamRegistry(f"{self.server.url}/modules", cache_dir=self.cache_dir)
+
+    def test_snapshots_are_memoized_per_instance(self):
+        upstream = self.upstream()
+        snapshot = upstream.get_latest_module_version("foo")
+        self.assertIs(upstream.get_latest_module_version("foo"), snapshot)
+        self.assertEqual(snapshot.version, "1.1")
+        self.assertEqual(snapshot.presubmit_yml_lines(), ["tasks: {}\n"])
+        self.assertEqual(snapshot.presubmit_yml_lines(), ["tasks: {}\n"])
+        self.assertIsNone(snapshot.attestations())
+        self.assertIsNone(snapshot.attestations())
+        self.assertEqual(
+            self.server.hits,
+            ["/modules/foo/metadata.json", "/modules/foo/1.1/presubmit.yml", "/modules/foo/1.1/attestations.json"],
+        )
+
+    def test_unchanged_files_are_revalidated(self):
+        self.upstream().get_latest_module_version("foo").presubmit_yml_lines()
+        self.assertEqual(self.server.statuses, [200, 200])
+        snapshot = self.upstream().get_latest_module_version("foo")
+        self.assertEqual(snapshot.presubmit_yml_lines(), ["tasks: {}\n"])
+        self.assertEqual(self.server.statuses, [200, 200, 304, 304])
+
+    def test_changed_files_are_fetched_again(self):
+        self.upstream().get_latest_module_version("foo")
+        self.server.files["/modules/foo/metadata.json"] = b'{"versions": ["1.0", "1.1", "2.0"]}'
+        self.assertEqual(self.upstream().get_latest_module_version("foo").version, "2.0")
+        self.assertEqual(self.server.statuses, [200, 200])
+
+    def test_not_found_is_cached(self):
+        self.assertIsNone(self.upstream().get_latest_module_version("bar"))
+        self.assertIsNone(self.upstream().get_latest_module_version("bar"))
+        self.assertEqual(self.server.hits, ["/modules/bar/metadata.json"])
+
+    def test_prefetch_serves_snapshots_from_memory(self):
+        upstream = self.upstream()
+        upstream.prefetch(["foo", "bar"])
+        hits = sorted(self.server.hits)
+        self.assertEqual(
+            hits,
+            [
+                "/modules/bar/metadata.json",
+                "/modules/foo/1.1/MODULE.bazel",
+                "/modules/foo/1.1/attestations.json",
+                "/modules/foo/1.1/presubmit.yml",
+                "/modules/foo/metadata.json",
+            ],
+        )
+        snapshot = upstream.get_latest_module_version("foo")
+        self.assertEqual(snapshot.presubmit_yml_lines(), ["tasks: {}\n"])
+        self.assertIsNone(snapshot.attestations())
+        self.assertIsNone(snapshot.module_dot_bazel())
+        self.assertIsNone(upstream.get_latest_module_version("bar"))
+        self.assertEqual(sorted(self.server.hits), hits)
+
+    def test_prefetch_does_not_remember_failures(self):
+        self.server.files["/modules/foo/metadata.json"] = b"not json"
+        upstream = self.upstream()
+        upstream.prefetch(["foo"])
+        with self.assertRaises(json.JSONDecodeError):
+            upstream.get_latest_module_version("foo")
+
+    def test_without_cache_dir(self):
+        upstream = UpstreamRegistry(f"{self.server.url}/modules")
+        self.assertEqual(upstream.get_latest_module_version("foo").version, "1.1")
+        self.assertIsNone(upstream.get_latest_module_version("bar"))
+
+
+class TestUpstreamBackends(unittest.TestCase):
+    FILES = {
+        "modules/foo/metadata.json": '{"versions": ["1.0", "1.1"]}',
+        "modules/foo/1.1/presubmit.yml": "tasks: {}\n",
+        "modules/foo/1.1/MODULE.bazel": 'module(name = "foo", version = "1.1")\n',
+    }
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.root = pathlib.Path(self.tmp_dir.name) / "upstream"
+        for name, content in self.FILES.items():
+            (self.root / name).parent.mkdir(parents=True, exist_ok=True)
+            (self.root / name).write_text(content)
+
+    def check_upstream(self, backend):
+        upstream = UpstreamRegistry(backend=backend)
+        snapshot = upstream.get_latest_module_version("foo")
+        self.assertEqual(snapshot.version, "1.1")
+        self.assertEqual(snapshot.presubmit_yml_lines(), ["tasks: {}\n"])
+        self.assertEqual(snapshot.module_dot_bazel(), 'module(name = "foo", version = "1.1")\n')
+        self.assertIsNone(snapshot.attestations())
+        self.assertIsNone(upstream.get_latest_module_version("bar"))
+        upstream.close()
+
+    def test_local_directory(self):
+        self.check_upstream(upstream_backend(str(self.root)))
+        self.check_upstream(upstream_backend(str(self.root / "modules")))
+
+    def test_local_directory_rejects_paths_outside(self):
+        with self.assertRaisesRegex(RegistryException, "must point inside"):
+            upstream_backend(str(self.root)).get_if_exists("../../etc/passwd")
+
+    def test_git_repository(self):
+        git = ["git", "-C", str(self.root), "-c", "user.name=t", "-c", "user.email=t@example.com"]
+        subprocess.run(git + ["init", "-q"], check=True)
+        subprocess.run(git + ["add", "."], check=True)
+        subprocess.run(git + ["commit", "-q", "-m", "init"], check=True)
+        # Only committed content is visible, independent of the working tree.
+        (self.root / "modules" / "foo" / "1.1" / "presubmit.yml").write_text("changed\n")
+        backend = upstream_backend(f"git:{self.root}#HEAD")
+        self.addCleanup(backend.close)
+        self.check_upstream(backend)
+        # Closing the upstream registry stops the `git cat-file` process.
+        self.assertIsNone(backend._process)
+        with self.assertRaisesRegex(RegistryException, "`mian` is not a commit"):
+            upstream_backend(f"git:{self.root}#mian")
+
+    def test_http_mirror(self):
+        server = FakeServer({"/" + name: content.encode() for name, content in self.FILES.items()})
+        self.addCleanup(server.close)
+        self.check_upstream(upstream_backend(f"{server.url}/modules"))
+
+    def test_unknown_spec(self):
+        with self.assertRaisesRegex(RegistryException, "neither a URL nor an existing directory"):
+            upstream_backend(str(self.root / "missing"))
+
+
+class TestHttpSession(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(
+            {"/a": b"a" * 100, "/b": b"b" * 100, "/slow": b"s"},
+            redirects={"/latest": "/b"},
+            delays={"/slow": 0.5},
+        )
+        self.addCleanup(self.server.close)
+        self.session = HttpSession()
+        self.addCleanup(self.session.close)
+
+    def get(self, path):
+        with self.session.open(self.server.url + path) as response:
+            return response.read()
+
+    def test_reuses_connection(self):
+        self.assertEqual(self.get("/a"), b"a" * 100)
+        self.assertEqual(self.get("/b"), b"b" * 100)
+        self.assertEqual(self.get("/a"), b"a" * 100)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_partially_read_response_is_not_reused(self):
+        with self.session.open(self.server.url + "/a") as response:
+            response.read(10)
+        self.assertEqual(self.get("/b"), b"b" * 100)
+        self.assertEqual(self.server.connections, 2)
+
+    def test_follows_redirects(self):
+        self.assertEqual(self.get("/latest"), b"b" * 100)
+        self.assertEqual(self.server.hits, ["/latest", "/b"])
+
+    def test_not_found_raises_http_error(self):
+        with self.assertRaises(urllib.error.HTTPError) as e:
+            self.get("/missing")
+        self.assertEqual(e.exception.code, 404)
+        # The error body was drained, so the connection is still usable.
+        self.assertEqual(self.get("/a"), b"a" * 100)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_rejects_disallowed_redirect_target(self):
+        self.server.redirects["/evil"] = "file:///etc/passwd"
+        with self.assertRaisesRegex(RegistryException, "not allowed"):
+            self.get("/evil")
+
+    def test_concurrent_downloads(self):
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(self.get, ["/a", "/b"] * 8))
+        self.assertEqual(results, [b"a" * 100, b"b" * 100] * 8)
+        self.assertLessEqual(self.server.connections, 4)
+
+    def test_module_level_download_uses_shared_session(self):
+        self.assertEqual(download(self.server.url + "/a"), b"a" * 100)
+
+    def test_head_request(self):
+        with self.session.open(self.server.url + "/latest", method="HEAD") as response:
+            self.assertEqual(response.read(), b"")
+            self.assertEqual(response.getheader("Content-Length"), "100")
+        self.assertEqual(self.get("/a"), b"a" * 100)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(content_length(self.server.url + "/a"), 100)
+
+    def test_per_request_timeout(self):
+        self.assertEqual(self.get("/a"), b"a" * 100)
+        with self.assertRaises(urllib.error.URLError) as e:
+            self.session.open(self.server.url + "/slow", timeout=0.1)
+        self.assertIsInstance(e.exception.reason, TimeoutError)
+        # The timeout doesn't stick to pooled connections.
+        self.assertEqual(self.get("/slow"), b"s")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Check the whole modules/ tree of a registry in a single pass.
+
+`walk_registry` lists every directory below modules/ exactly once with
+`os.scandir` and hands each listing to a set of `Check`s, optionally sharded
+across threads by module. Checks record errors and warnings (things a BCR
+maintainer should look at), which are sorted once the walk is done, so the
+order doesn't depend on the sharding.
+"""
+
+import concurrent.futures
+import os
+import threading
+
+# The files every module version's directory has.
+REQUIRED_VERSION_FILES = ("MODULE.bazel", "source.json", "presubmit.yml")
+
+
+class Check:
+    """Base class of the checks run by `walk_registry`."""
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+        self._lock = threading.Lock()
+
+    def error(self, message):
+        with self._lock:
+            self.errors.append(message)
+
+    def warn(self, message):
+        with self._lock:
+            self.warnings.append(message)
+
+    def visit_dir(self, parts, entries):
+        """Called with the path components of every directory below modules/ (`()` for modules/ itself)
+        and its entries, as `os.DirEntry`s sorted by name.
+
+        With several threads, this is called concurrently, but all directories of a module are visited
+        by the same thread, parents before their children.
+        """
+
+    def finish(self):
+        """Called once all directories were visited."""
+        self.errors.sort()
+        self.warnings.sort()
+
+
+class VersionCheck(Check):
+    """A check that looks at the directories of module versions, i.e. modules/<module>/<version>."""
+
+    def visit_dir(self, parts, entries):
+        if len(parts) == 2:
+            self.visit_version(*parts, entries)
+
+    def visit_version(self, module_name, version, entries):
+        """Called with the entries of a module version's directory."""
+
+
+class SymlinkCheck(Check):
+    """Symlinks are not allowed anywhere below modules/."""
+
+    def __init__(self, modules_dir):
+        super().__init__()
+        self.modules_dir = modules_dir
+
+    def visit_dir(self, parts, entries):
+        for entry in entries:
+            if entry.is_symlink():
+                self.error(f"Symlink is not allowed: {os.path.join(self.modules_dir, *parts, entry.name)}")
+
+
+class ModuleNameConflictCheck(Check):
+    """Module names must not only differ in case."""
+
+    def visit_dir(self, parts, entries):
+        if parts:
+            return
+        groups = {}
+        for entry in entries:
+            groups.setdefault(entry.name.lower(), []).append(entry.name)
+        for names in groups.values():
+            if len(names) > 1:
+                self.error(f"Module name conflict found: {', '.join(names)}")
+
+
+class RequiredFilesCheck(Check):
+    """Every module has a metadata.json file and every version a MODULE.bazel, source.json and presubmit.yml."""
+
+    def visit_dir(self, parts, entries):
+        names = {entry.name for entry in entries if not entry.is_dir(follow_symlinks=False)}
+        if len(parts) == 1 and "metadata.json" not in names:
+            self.error(f"The directory of module {parts[0]} has no metadata.json file.")
+        elif len(parts) == 2:
+            for name in REQUIRED_VERSION_FILES:
+                if name not in names:
+                    self.error(f"{parts[0]}@{parts[1]} has no {name} file.")
+
+
+def _scan(path):
+    with os.scandir(path) as it:
+        return sorted(it, key=lambda entry: entry.name)
+
+
+def _walk(path, parts, checks):
+    entries = _scan(path)
+    for check in checks:
+        check.visit_dir(parts, entries)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            _walk(entry.path, (*parts, entry.name), checks)
+
+
+def walk_registry(modules_dir, checks, jobs=1):
+    """Run `checks` over `modules_dir` in a single pass, with `jobs` threads, and return them."""
+    entries = _scan(modules_dir)
+    for check in checks:
+        check.visit_dir((), entries)
+    modules = [entry for entry in entries if entry.is_dir(follow_symlinks=False)]
+    if jobs > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            for future in [executor.submit(_walk, entry.path, (entry.name,), checks) for entry in modules]:
+                future.result()
+    else:
+        for entry in modules:
+            _walk(entry.path, (entry.name,), checks)
+    for check in checks:
+        check.finish()
+    return checks
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import registry_walker
+from registry_walker import Check
+from registry_walker import ModuleNameConflictCheck
+from registry_walker import RequiredFilesCheck
+from registry_walker import SymlinkCheck
+from registry_walker import walk_registry
+
+
+class RecordingCheck(Check):
+    def __init__(self):
+        super().__init__()
+        self.dirs = []
+
+    def visit_dir(self, parts, entries):
+        with self._lock:
+            self.dirs.append((parts, [entry.name for entry in entries]))
+
+
+class RegistryWalkerTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.modules = Path(tmp.name, "modules")
+        self.add_version("foo", "1.0")
+        self.add_version("foo", "2.0", patches={"fix.patch": "fix"}, overlay={"BUILD.bazel": "", "sub/BUILD": ""})
+        self.add_version("bar", "1.0", patches={"../../../foo/2.0/patches/fix.patch": None})
+
+    def add_version(self, name, version, patches=None, overlay=None):
+        version_dir = self.modules / name / version
+        version_dir.mkdir(parents=True)
+        (version_dir.parent / "metadata.json").write_text("{}")
+        for file in registry_walker.REQUIRED_VERSION_FILES:
+            (version_dir / file).write_text("")
+        source = {"url": f"https://example.com/{name}-{version}.tar.gz"}
+        for kind, files in [("patches", patches), ("overlay", overlay)]:
+            if files:
+                source[kind] = {file: "sha256-" for file in files}
+                for file, content in files.items():
+                    if content is not None:
+                        (version_dir / kind / file).parent.mkdir(parents=True, exist_ok=True)
+                        (version_dir / kind / file).write_text(content)
+        (version_dir / "source.json").write_text(json.dumps(source))
+        return version_dir
+
+    def walk(self, *checks, jobs=1):
+        walk_registry(self.modules, checks, jobs=jobs)
+        return checks
+
+
+class TestWalkRegistry(RegistryWalkerTestCase):
+    def test_visits_every_directory_once(self):
+        for jobs in (1, 4):
+            with self.subTest(jobs=jobs):
+                (check,) = self.walk(RecordingCheck(), jobs=jobs)
+                dirs = dict(check.dirs)
+                self.assertEqual(len(check.dirs), len(dirs))
+                self.assertEqual(dirs[()], ["bar", "foo"])
+                self.assertEqual(dirs[("foo",)], ["1.0", "2.0", "metadata.json"])
+                self.assertEqual(dirs[("foo", "2.0", "overlay")], ["BUILD.bazel", "sub"])
+                self.assertIn(("foo", "2.0", "overlay", "sub"), dirs)
+                # Parents are visited before their children.
+                order = [parts for parts, _ in check.dirs]
+                self.assertLess(order.index(("foo", "2.0")), order.index(("foo", "2.0", "overlay", "sub")))
+
+    def test_consistent_registry(self):
+        checks = self.walk(
+            SymlinkCheck(str(self.modules)),
+            ModuleNameConflictCheck(),
+            RequiredFilesCheck(),
+            jobs=2,
+        )
+        self.assertEqual([(c.errors, c.warnings) for c in checks], [([], [])] * len(checks))
+
+    def test_symlinks(self):
+        os.symlink("1.0", self.modules / "foo" / "latest")
+        os.symlink("/etc/passwd", self.modules / "foo" / "1.0" / "MODULE.bazel.link")
+        (check,) = self.walk(SymlinkCheck(str(self.modules)))
+        self.assertEqual(
+            check.errors,
+            [
+                f"Symlink is not allowed: {self.modules / 'foo' / '1.0' / 'MODULE.bazel.link'}",
+                f"Symlink is not allowed: {self.modules / 'foo' / 'latest'}",
+            ],
+        )
+
+    def test_module_name_conflict(self):
+        self.add_version("Foo", "1.0")
+        (check,) = self.walk(ModuleNameConflictCheck())
+        self.assertEqual(check.errors, ["Module name conflict found: Foo, foo"])
+
+    def test_required_files(self):
+        (self.modules / "foo" / "metadata.json").unlink()
+        (self.modules / "bar" / "1.0" / "presubmit.yml").unlink()
+        (check,) = self.walk(RequiredFilesCheck())
+        self.assertEqual(
+            check.errors,
+            ["The directory of module foo has no metadata.json file.", "bar@1.0 has no presubmit.yml file."],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
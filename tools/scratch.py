@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Scratch space for the temporary files of a validation run.
+
+A `ScratchSpace` owns a single directory, so that everything a run writes can
+be put on a fast file system (e.g. a tmpfs) and is removed together at the
+end, even if a check fails half-way. Work directories are handed out by
+`new_dir`. Work that is finished, but may be useful again (e.g. a downloaded
+source archive that other module versions share), can be handed back with
+`finish` and picked up again with `reuse`. Finished work is evicted, least
+recently finished first, while the scratch space uses more than its quota.
+
+The usage is metered incrementally instead of walking the tree: it is the
+size of the finished work, measured once when it is finished, plus the bytes
+that users report with `add_usage` for directories that are still in use.
+The worker processes of `--jobs` each have a scratch space of their own with
+a share of the quota.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import weakref
+from pathlib import Path
+
+# Environment variable pointing at the directory to create scratch spaces in.
+SCRATCH_DIR_ENV = "BCR_SCRATCH_DIR"
+
+# How much disk space finished work may occupy by default, in MiB.
+DEFAULT_QUOTA_MB = 2048
+
+
+def disk_usage(path):
+    """Return the number of bytes allocated for the files below `path`."""
+    total = 0
+    try:
+        it = os.scandir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return 0
+    with it:
+        for entry in it:
+            try:
+                st = entry.stat(follow_symlinks=False)
+                if entry.is_dir(follow_symlinks=False):
+                    total += disk_usage(entry.path)
+            except FileNotFoundError:
+                # Removed by another thread or process in the meantime.
+                continue
+            # st_blocks is what a file really takes up on disk, e.g. for sparse files.
+            total += st.st_blocks * 512 if hasattr(st, "st_blocks") else st.st_size
+    return total
+
+
+class ScratchSpace:
+    """A directory for temporary files with a quota for finished work, see the module docstring."""
+
+    def __init__(self, parent=None, quota=DEFAULT_QUOTA_MB * 1024 * 1024, prefix="bcr_validation-"):
+        """Create the scratch space in a new directory in `parent` (default: $BCR_SCRATCH_DIR or the system's
+        temporary directory). `quota` is in bytes, None for no limit."""
+        parent = parent or os.getenv(SCRATCH_DIR_ENV) or None
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.root = Path(tempfile.mkdtemp(prefix=prefix, dir=parent))
+        self.quota = quota
+        self.peak_usage = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # The metered bytes by directory, see the module docstring, and their sum.
+        self._sizes = {}
+        self._usage = 0
+        # The peak usage reported by the scratch spaces of other processes by their name, see `observe`.
+        self._observed = {}
+        # The finished work by key, as (path, value), least recently finished first.
+        self._finished = {}
+        self._cleanup = weakref.finalize(self, shutil.rmtree, str(self.root), ignore_errors=True)
+
+    def new_dir(self, label):
+        """Return a new directory, which lives until it is passed to `remove` or `finish`, or the space is closed."""
+        self.make_room()
+        return Path(tempfile.mkdtemp(prefix=f"{label}-", dir=self.root))
+
+    def add_usage(self, path, size):
+        """Account for `size` bytes written into the directory `path`, which came from `new_dir`."""
+        with self._lock:
+            self._set_size(path, self._sizes.get(path, 0) + size)
+        self.make_room()
+
+    def remove(self, path):
+        with self._lock:
+            self._set_size(path, 0)
+        shutil.rmtree(path, ignore_errors=True)
+
+    def finish(self, key, path, value=None):
+        """Keep the finished work in `path` for `reuse(key)`, which returns `value`, until it is evicted.
+
+        Unless its size was reported with `add_usage`, `path` is measured once.
+        """
+        size = None if self._sizes.get(path) else disk_usage(path)
+        with self._lock:
+            if size is not None:
+                self._set_size(path, size)
+            previous = self._finished.pop(key, None)
+            self._finished[key] = (path, value)
+        if previous and previous[0] != path:
+            self.remove(previous[0])
+        self.make_room()
+
+    def reuse(self, key):
+        """Take back the finished work of `key` and return its `(path, value)`, or None if there is none.
+
+        The work is in use again until it is passed to `finish` or `remove`.
+        """
+        with self._lock:
+            return self._finished.pop(key, None)
+
+    def usage(self):
+        return self._usage
+
+    def _set_size(self, path, size):
+        self._usage += size - self._sizes.pop(path, 0)
+        if size:
+            self._sizes[path] = size
+        self.peak_usage = max(self.peak_usage, self._usage + sum(self._observed.values()))
+
+    def observe(self, name, peak_usage, evictions=0):
+        """Account for the peak usage and the evictions reported by the scratch space `name` of another process.
+
+        The peak usage of all of them together is estimated as the sum of their peaks.
+        """
+        with self._lock:
+            self._observed[name] = max(self._observed.get(name, 0), peak_usage)
+            self.peak_usage = max(self.peak_usage, self._usage + sum(self._observed.values()))
+            self.evictions += evictions
+
+    def make_room(self):
+        """Evict finished work while the usage exceeds the quota."""
+        while True:
+            with self._lock:
+                if self.quota is None or self._usage <= self.quota or not self._finished:
+                    return
+                key = next(iter(self._finished))
+                path, _ = self._finished.pop(key)
+                self.evictions += 1
+            self.remove(path)
+
+    def close(self):
+        """Remove the scratch space and everything in it."""
+        with self._lock:
+            self._finished.clear()
+            self._sizes.clear()
+            self._usage = 0
+        self._cleanup()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import scratch
+from scratch import ScratchSpace
+
+KIB = 1024
+
+
+class ScratchTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.parent = Path(tmp.name)
+
+    def space(self, quota=None):
+        space = ScratchSpace(self.parent, quota)
+        self.addCleanup(space.close)
+        return space
+
+    def write(self, directory, size):
+        # Random data, so that file systems that compress or deduplicate blocks allocate all of it.
+        (directory / "data").write_bytes(os.urandom(size))
+
+
+class TestScratchSpace(ScratchTestCase):
+    def test_directories_are_removed(self):
+        space = self.space()
+        path = space.new_dir("extract")
+        self.assertTrue(path.name.startswith("extract-"))
+        self.assertEqual(path.parent, space.root)
+        self.write(path, 64 * KIB)
+        space.add_usage(path, 64 * KIB)
+        space.remove(path)
+        self.assertFalse(path.exists())
+        self.assertEqual(space.usage(), 0)
+        self.assertEqual(space.peak_usage, 64 * KIB)
+        kept = space.new_dir("kept")
+        space.close()
+        self.assertFalse(kept.exists())
+        self.assertFalse(space.root.exists())
+
+    def test_root_from_environment(self):
+        with mock.patch.dict(os.environ, {scratch.SCRATCH_DIR_ENV: str(self.parent / "tmpfs")}):
+            space = ScratchSpace()
+        self.addCleanup(space.close)
+        self.assertEqual(space.root.parent, self.parent / "tmpfs")
+
+    def test_reuse(self):
+        space = self.space()
+        path = space.new_dir("download")
+        space.finish("a", path, "value")
+        self.assertEqual(space.reuse("a"), (path, "value"))
+        # The work is in use again, so nobody else gets it.
+        self.assertIsNone(space.reuse("a"))
+        self.assertIsNone(space.reuse("b"))
+        self.assertTrue(path.exists())
+
+    def test_finished_work_is_measured(self):
+        space = self.space()
+        path = space.new_dir("download")
+        self.write(path, 64 * KIB)
+        space.finish("a", path)
+        self.assertGreaterEqual(space.usage(), 64 * KIB)
+        # Reporting the size of the new entry avoids measuring the directory.
+        space.reuse("a")
+        space.remove(path)
+        path = space.new_dir("download")
+        space.add_usage(path, 10)
+        with mock.patch.object(scratch, "disk_usage") as disk_usage:
+            space.finish("a", path)
+        disk_usage.assert_not_called()
+        self.assertEqual(space.usage(), 10)
+
+    def test_quota_evicts_least_recently_finished_work(self):
+        space = self.space(quota=250 * KIB)
+        dirs = {}
+        for key in "abc":
+            dirs[key] = space.new_dir(key)
+            self.write(dirs[key], 100 * KIB)
+            space.add_usage(dirs[key], 100 * KIB)
+        space.finish("a", dirs["a"])
+        space.finish("b", dirs["b"])
+        # Only finished work is evicted, the third directory is still in use.
+        space.finish("c", dirs["c"])
+        self.assertEqual(space.evictions, 1)
+        self.assertFalse(dirs["a"].exists())
+        self.assertIsNone(space.reuse("a"))
+        # Reusing and finishing work again makes it the most recently finished.
+        space.finish("b", *space.reuse("b"))
+        space.add_usage(space.new_dir("d"), 100 * KIB)
+        self.assertEqual(space.evictions, 2)
+        self.assertFalse(dirs["c"].exists())
+        self.assertTrue(dirs["b"].exists())
+        self.assertEqual(space.peak_usage, 300 * KIB)
+
+    def test_zero_quota_keeps_no_finished_work(self):
+        space = self.space(quota=0)
+        path = space.new_dir("download")
+        self.write(path, KIB)
+        space.finish("a", path)
+        self.assertFalse(path.exists())
+        self.assertIsNone(space.reuse("a"))
+        self.assertEqual(space.usage(), 0)
+
+    def test_observe_other_processes(self):
+        space = self.space()
+        space.add_usage(space.new_dir("slsa-verifier"), 10 * KIB)
+        space.observe(1, 100 * KIB, 1)
+        space.observe(2, 50 * KIB)
+        space.observe(1, 80 * KIB, 2)
+        self.assertEqual(space.peak_usage, 160 * KIB)
+        self.assertEqual(space.evictions, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
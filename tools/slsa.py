@@ -24,6 +24,7 @@ import re
 import subprocess
 import sys
 import textwrap
+import tracing
 
 from enum import Enum
 from pathlib import Path
@@ -113,11 +114,13 @@ class Verifier:
         )
         eprint(self.format_cmd(cmd, args))
 
-        result = subprocess.run(
-            [self._executable, cmd] + args,
-            capture_output=True,
-            encoding="utf-8",
-        )
+        tracing.add(tracing.SUBPROCESSES)
+        with tracing.span("slsa-verifier " + cmd, "subprocess", module=module_name, attestation=attestation_basename):
+            result = subprocess.run(
+                [self._executable, cmd] + args,
+                capture_output=True,
+                encoding="utf-8",
+            )
 
         if result.returncode:
             raise attestations_lib.Error(
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Lightweight tracing of where the time of the BCR tools goes.
+
+Code marks interesting sections with `span()` and counts events such as
+downloaded bytes or spawned processes with `add()`. Both do nothing unless a
+`Tracer` was installed with `set_tracer`. Every span records its wall time,
+the CPU time of the process while it was open and how much each counter grew
+in the meantime, so counters bumped by helper threads are attributed to the
+span that is waiting for them.
+
+Spans can be written as JSON lines (`write_json_lines`), in the Chrome trace
+event format for chrome://tracing or https://ui.perfetto.dev
+(`write_chrome_trace`), or summarized as tables of the slowest module
+versions and checks (`summary`).
+"""
+
+import collections
+import contextlib
+import dataclasses
+import json
+import os
+import threading
+import time
+
+# Counters maintained by the tools.
+BYTES_DOWNLOADED = "bytes_downloaded"
+HTTP_REQUESTS = "http_requests"
+SUBPROCESSES = "subprocesses"
+
+
+@dataclasses.dataclass
+class Span:
+    name: str
+    category: str
+    # Start time in nanoseconds since the epoch, so that spans of several processes line up.
+    start_ns: int
+    wall_ns: int
+    cpu_ns: int
+    pid: int
+    tid: int
+    args: dict
+    counters: dict
+
+    def to_json(self):
+        return dataclasses.asdict(self)
+
+
+class Tracer:
+    """Collects the spans and counters of a process."""
+
+    def __init__(self):
+        self.spans = []
+        self._counters = collections.Counter()
+        self._lock = threading.Lock()
+
+    def add(self, counter, amount=1):
+        with self._lock:
+            self._counters[counter] += amount
+
+    def _snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """Record the enclosed code as a span. Yields the span's `args`, which may still be extended."""
+        counters = self._snapshot()
+        start_ns = time.time_ns()
+        wall_start = time.perf_counter_ns()
+        cpu_start = time.process_time_ns()
+        try:
+            yield args
+        finally:
+            wall_ns = time.perf_counter_ns() - wall_start
+            cpu_ns = time.process_time_ns() - cpu_start
+            grown = {k: v - counters.get(k, 0) for k, v in self._snapshot().items() if v != counters.get(k, 0)}
+            span = Span(name, category, start_ns, wall_ns, cpu_ns, os.getpid(), threading.get_ident(), args, grown)
+            with self._lock:
+                self.spans.append(span)
+
+    def take_spans(self):
+        """Return the spans recorded so far and forget them."""
+        with self._lock:
+            spans, self.spans = self.spans, []
+        return spans
+
+    def extend(self, spans):
+        """Add spans recorded by another tracer, e.g. in a worker process."""
+        with self._lock:
+            self.spans.extend(spans)
+
+
+_tracer = None
+
+
+def set_tracer(tracer):
+    """Make `span` and `add` record into `tracer` (a `Tracer` or None)."""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, category, **args):
+    """A context manager recording the enclosed code as a span if tracing is enabled."""
+    if _tracer is None:
+        return contextlib.nullcontext(args)
+    return _tracer.span(name, category, **args)
+
+
+def add(counter, amount=1):
+    """Add `amount` to `counter` if tracing is enabled."""
+    if _tracer is not None:
+        _tracer.add(counter, amount)
+
+
+def write_json_lines(spans, path):
+    """Write one JSON object per span to `path`."""
+    with open(path, "w") as file:
+        for s in spans:
+            file.write(json.dumps(s.to_json(), sort_keys=True) + "\n")
+
+
+def write_chrome_trace(spans, path):
+    """Write `spans` as complete ("X") events of the Chrome trace event format to `path`."""
+    events = []
+    for s in spans:
+        events.append(
+            {
+                "name": s.name,
+                "cat": s.category,
+                "ph": "X",
+                "ts": s.start_ns / 1000,
+                "dur": s.wall_ns / 1000,
+                "pid": s.pid,
+                "tid": s.tid,
+                "args": {**s.args, **s.counters, "cpu_ms": round(s.cpu_ns / 1e6, 3)},
+            }
+        )
+    with open(path, "w") as file:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+def _format_bytes(n):
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
+
+
+def _table(header, rows):
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *rows)]
+    lines = []
+    for row in [header, *rows]:
+        # Right-align the numbers, the last column is a label.
+        cells = [str(cell).rjust(width) for cell, width in zip(row[:-1], widths)]
+        lines.append("  ".join(cells + [str(row[-1])]))
+    return "\n".join(lines)
+
+
+def _row(s, label):
+    return [
+        f"{s.wall_ns / 1e9:.2f}",
+        f"{s.cpu_ns / 1e9:.2f}",
+        _format_bytes(s.counters.get(BYTES_DOWNLOADED, 0)),
+        s.counters.get(SUBPROCESSES, 0),
+        label,
+    ]
+
+
+def _check_label(s):
+    label = f"{s.name} of {s.args.get('module')}@{s.args.get('version')}"
+    return label + " (cached)" if s.args.get("cached") else label
+
+
+def summary(spans, top=10):
+    """Return tables of the `top` slowest module versions and checks and of the time spent per check."""
+    header = ["wall s", "cpu s", "downloaded", "subprocesses"]
+    modules = sorted((s for s in spans if s.category == "module"), key=lambda s: -s.wall_ns)[:top]
+    checks = [s for s in spans if s.category == "check"]
+    slowest_checks = sorted(checks, key=lambda s: -s.wall_ns)[:top]
+    per_check = collections.defaultdict(list)
+    for s in checks:
+        per_check[s.name].append(s)
+
+    sections = [
+        "Slowest module versions:\n" + _table(header + ["module version"], [_row(s, s.name) for s in modules]),
+        "Slowest checks:\n" + _table(header + ["check"], [_row(s, _check_label(s)) for s in slowest_checks]),
+        "Time per check:\n"
+        + _table(
+            ["total wall s", "max wall s", "runs", "cached", "check"],
+            [
+                [
+                    f"{sum(s.wall_ns for s in group) / 1e9:.2f}",
+                    f"{max(s.wall_ns for s in group) / 1e9:.2f}",
+                    len(group),
+                    sum(1 for s in group if s.args.get("cached")),
+                    name,
+                ]
+                for name, group in sorted(per_check.items(), key=lambda item: -sum(s.wall_ns for s in item[1]))
+            ],
+        ),
+    ]
+    return "\n\n".join(sections)
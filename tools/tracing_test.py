@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+
+import tracing
+from tracing import Span
+from tracing import Tracer
+
+
+def make_span(name, category="check", wall_s=1.0, **args):
+    return Span(name, category, 0, int(wall_s * 1e9), int(wall_s * 5e8), 1, 1, args, {})
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.tracer = Tracer()
+        tracing.set_tracer(self.tracer)
+        self.addCleanup(tracing.set_tracer, None)
+
+    def test_records_nested_spans(self):
+        with tracing.span("outer", "module", module="foo") as args:
+            with tracing.span("inner", "check"):
+                time.sleep(0.01)
+            args["cached"] = True
+        inner, outer = self.tracer.spans
+        self.assertEqual((inner.name, inner.category), ("inner", "check"))
+        self.assertEqual(outer.args, {"module": "foo", "cached": True})
+        self.assertGreaterEqual(inner.wall_ns, 10_000_000)
+        self.assertGreaterEqual(outer.wall_ns, inner.wall_ns)
+        self.assertLessEqual(outer.start_ns, inner.start_ns)
+        self.assertEqual(outer.pid, os.getpid())
+
+    def test_attributes_counters_to_open_spans(self):
+        tracing.add(tracing.SUBPROCESSES)
+        with tracing.span("outer", "module"):
+            tracing.add(tracing.BYTES_DOWNLOADED, 100)
+            with tracing.span("inner", "check"):
+                # Counters bumped by other threads count as well.
+                thread = threading.Thread(target=tracing.add, args=(tracing.BYTES_DOWNLOADED, 20))
+                thread.start()
+                thread.join()
+                tracing.add(tracing.SUBPROCESSES)
+        inner, outer = self.tracer.spans
+        self.assertEqual(inner.counters, {tracing.BYTES_DOWNLOADED: 20, tracing.SUBPROCESSES: 1})
+        self.assertEqual(outer.counters, {tracing.BYTES_DOWNLOADED: 120, tracing.SUBPROCESSES: 1})
+
+    def test_records_span_on_exception(self):
+        with self.assertRaises(ValueError):
+            with tracing.span("failing", "check"):
+                raise ValueError()
+        self.assertEqual([s.name for s in self.tracer.spans], ["failing"])
+
+    def test_take_spans(self):
+        with tracing.span("a", "check"):
+            pass
+        spans = self.tracer.take_spans()
+        self.assertEqual([s.name for s in spans], ["a"])
+        self.assertEqual(self.tracer.spans, [])
+        self.tracer.extend(spans)
+        self.assertEqual(self.tracer.spans, spans)
+
+
+class TestDisabled(unittest.TestCase):
+    def test_noop_without_tracer(self):
+        tracing.set_tracer(None)
+        with tracing.span("a", "check", module="foo") as args:
+            tracing.add(tracing.BYTES_DOWNLOADED, 1)
+        self.assertEqual(args, {"module": "foo"})
+
+
+class TestOutput(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.spans = [
+            make_span("foo@1.0", "module", 3.0, module="foo", version="1.0"),
+            make_span("url_integrity", "check", 2.0, module="foo", version="1.0", cached=False),
+            make_span("existence", "check", 0.5, module="foo", version="1.0", cached=True),
+            make_span("bar@1.0", "module", 1.0, module="bar", version="1.0"),
+            make_span("url_integrity", "check", 1.0, module="bar", version="1.0", cached=False),
+        ]
+        self.spans[1].counters = {tracing.BYTES_DOWNLOADED: 3 * 1024 * 1024}
+
+    def test_json_lines(self):
+        path = self.tmp / "trace.jsonl"
+        tracing.write_json_lines(self.spans, path)
+        records = [json.loads(line) for line in path.read_text().splitlines()]
+        self.assertEqual(len(records), 5)
+        self.assertEqual(records[1]["name"], "url_integrity")
+        self.assertEqual(records[1]["wall_ns"], 2_000_000_000)
+        self.assertEqual(records[1]["counters"], {"bytes_downloaded": 3 * 1024 * 1024})
+        self.assertEqual(records[2]["args"]["cached"], True)
+
+    def test_chrome_trace(self):
+        path = self.tmp / "trace.json"
+        tracing.write_chrome_trace(self.spans, path)
+        events = json.loads(path.read_text())["traceEvents"]
+        self.assertEqual(len(events), 5)
+        event = events[1]
+        self.assertEqual(event["ph"], "X")
+        self.assertEqual(event["dur"], 2_000_000)
+        self.assertEqual(event["args"]["bytes_downloaded"], 3 * 1024 * 1024)
+        self.assertEqual(event["args"]["cpu_ms"], 1000)
+
+    def test_summary(self):
+        summary = tracing.summary(self.spans)
+        modules, checks, per_check = summary.split("\n\n")
+        self.assertIn("foo@1.0", modules.splitlines()[2])
+        self.assertIn("bar@1.0", modules.splitlines()[3])
+        self.assertIn("url_integrity of foo@1.0", checks.splitlines()[2])
+        self.assertIn("3.0 MiB", checks.splitlines()[2])
+        self.assertIn("existence of foo@1.0 (cached)", checks)
+        self.assertEqual(per_check.splitlines()[2].split(), ["3.00", "2.00", "2", "0", "url_integrity"])
+        self.assertEqual(per_check.splitlines()[3].split(), ["0.50", "0.50", "1", "1", "existence"])
+
+    def test_summary_top(self):
+        summary = tracing.summary(self.spans, top=1)
+        self.assertNotIn("bar@1.0", summary.split("\n\n")[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Record and replay the HTTP traffic of the BCR tools.
+
+Downloads, including the files of an HTTP upstream registry, go through the
+`HttpSession` of the registry module, GitHub API requests through a
+`requests.Session`. A `RecordingNetwork` passes both on to the network and
+keeps every response in a `Cassette`, which is saved as a single
+zstd-compressed file. A `ReplayNetwork` answers the same requests from the
+cassette without any network access, optionally slowed down by a simulated
+latency and bandwidth, so that the end-to-end cost of a validation can be
+measured reproducibly offline. Requests that weren't recorded fail like
+requests to an unreachable host.
+
+Requests are told apart by their method, URL, body and the few headers that
+select a different response (`VARY_HEADERS`); credentials are never
+recorded. A request that was made several times is answered with the
+recorded responses in order, and with the last one after that.
+"""
+
+import hashlib
+import http.client
+import io
+import json
+import os
+import struct
+import threading
+import time
+import urllib.error
+from urllib.error import HTTPError
+
+import requests
+import requests.adapters
+import zstandard
+
+import registry
+import tracing
+
+# The version of the cassette file format, see `Cassette.save`.
+CASSETTE_FORMAT = 1
+
+# Request headers that are part of the identity of a request, e.g. for conditional requests.
+VARY_HEADERS = ("accept", "if-modified-since", "if-none-match", "range")
+
+# Response headers that aren't recorded.
+_PRIVATE_HEADERS = frozenset(["set-cookie"])
+# `requests` decodes compressed bodies, so these headers don't describe the recorded body anymore.
+_DECODED_HEADERS = frozenset(["content-encoding", "content-length", "transfer-encoding"])
+
+
+class CassetteError(Exception):
+    """Raised when a cassette can't be read."""
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _request(method, url, headers=None, body=None):
+    """Return the part of a request that is recorded, see `VARY_HEADERS`."""
+    if isinstance(body, str):
+        body = body.encode()
+    vary = {}
+    for name, value in (headers or {}).items():
+        if name.lower() in VARY_HEADERS:
+            vary[name.lower()] = value
+    return {"method": method, "url": url, "body": _digest(body) if body else None, "vary": vary}
+
+
+def _key(request):
+    return (request["method"], request["url"], request["body"], tuple(sorted(request["vary"].items())))
+
+
+class Cassette:
+    """The recorded responses to HTTP requests. Bodies are kept once per content."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Every interaction, as a dict with the "request" and either the "response" or the "error" it caused.
+        self._interactions = []
+        # The recorded interactions by `_key` of their request, and how many of them were replayed.
+        self._by_key = {}
+        self._replayed = {}
+        self._bodies = {}
+        # The number of interactions that `take_new` returned already.
+        self._taken = 0
+
+    def __len__(self):
+        return len(self._interactions)
+
+    def add(self, interaction, body=b""):
+        """Record an interaction, see `RecordingNetwork`, whose response has `body`."""
+        if "response" in interaction:
+            interaction["response"]["body"] = _digest(body)
+        with self._lock:
+            self._add(interaction, body)
+
+    def _add(self, interaction, body):
+        if "response" in interaction:
+            self._bodies.setdefault(interaction["response"]["body"], body)
+        self._interactions.append(interaction)
+        self._by_key.setdefault(_key(interaction["request"]), []).append(interaction)
+
+    def next(self, request):
+        """Return the next recorded interaction for `request` and the body of its response, or None."""
+        key = _key(request)
+        with self._lock:
+            interactions = self._by_key.get(key)
+            if not interactions:
+                return None
+            index = self._replayed.get(key, 0)
+            self._replayed[key] = index + 1
+        interaction = interactions[min(index, len(interactions) - 1)]
+        body = self._bodies[interaction["response"]["body"]] if "response" in interaction else b""
+        return interaction, body
+
+    def take_new(self):
+        """Return the interactions recorded since the last call as `(interaction, body)` pairs, e.g. to
+        pass them from a worker process to the cassette of the parent with `extend`."""
+        with self._lock:
+            new = self._interactions[self._taken :]
+            self._taken = len(self._interactions)
+            return [(i, self._bodies[i["response"]["body"]] if "response" in i else b"") for i in new]
+
+    def extend(self, interactions):
+        with self._lock:
+            for interaction, body in interactions:
+                self._add(interaction, body)
+
+    def save(self, path):
+        """Write the cassette to `path`: a zstd-compressed stream of the length of a JSON header, the
+        header with all interactions and the sizes of the bodies, and the bodies."""
+        with self._lock:
+            interactions = list(self._interactions)
+            bodies = dict(self._bodies)
+        digests = list(dict.fromkeys(i["response"]["body"] for i in interactions if "response" in i))
+        header = json.dumps(
+            {
+                "format": CASSETTE_FORMAT,
+                "interactions": interactions,
+                "bodies": [[digest, len(bodies[digest])] for digest in digests],
+            }
+        ).encode()
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as file:
+            with zstandard.ZstdCompressor(threads=-1).stream_writer(file, closefd=False) as out:
+                out.write(struct.pack(">Q", len(header)))
+                out.write(header)
+                for digest in digests:
+                    out.write(bodies[digest])
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        cassette = cls()
+        try:
+            with open(path, "rb") as file, zstandard.ZstdDecompressor().stream_reader(file) as stream:
+                (size,) = struct.unpack(">Q", _read_exactly(stream, 8))
+                header = json.loads(_read_exactly(stream, size))
+                if header.get("format") != CASSETTE_FORMAT:
+                    raise CassetteError(f"{path} is a cassette of an unsupported format: {header.get('format')}")
+                for digest, length in header["bodies"]:
+                    cassette._bodies[digest] = _read_exactly(stream, length)
+        except (OSError, EOFError, zstandard.ZstdError, ValueError, KeyError) as e:
+            raise CassetteError(f"Failed to read the cassette {path}: {e}") from e
+        for interaction in header["interactions"]:
+            cassette._add(interaction, cassette._bodies.get(interaction.get("response", {}).get("body")))
+        cassette._taken = len(cassette)
+        return cassette
+
+
+def _read_exactly(stream, size):
+    chunks = []
+    while size:
+        chunk = stream.read(min(size, registry.CHUNK_SIZE))
+        if not chunk:
+            raise EOFError("Unexpected end of file.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def _headers(items, skip=_PRIVATE_HEADERS):
+    return [[name, value] for name, value in items if name.lower() not in skip]
+
+
+def _http_message(headers):
+    message = http.client.HTTPMessage()
+    for name, value in headers:
+        message[name] = value
+    return message
+
+
+def _not_recorded(request):
+    return f"{request['method']} {request['url']} isn't in the cassette."
+
+
+class _Response:
+    """A response with the interface of the ones of `HttpSession`, from a cassette."""
+
+    def __init__(self, response, body, network=None):
+        self.url = response["url"]
+        self.status = response["status"]
+        self.reason = response["reason"]
+        self.headers = _http_message(response["headers"])
+        self._body = io.BytesIO(body)
+        self._network = network
+
+    def read(self, amt=None):
+        data = self._body.read(amt)
+        if self._network:
+            self._network.transfer(len(data))
+        return data
+
+    def getheader(self, name, default=None):
+        return self.headers.get(name, default)
+
+    def getcode(self):
+        return self.status
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingNetwork:
+    """Sends requests to the network and records the responses into `cassette`."""
+
+    def __init__(self, cassette=None):
+        self.cassette = cassette if cassette is not None else Cassette()
+
+    def http_session(self):
+        return _RecordingSession(self.cassette, registry.HttpSession())
+
+    def requests_adapter(self, adapter):
+        """Return a transport adapter for `requests` that records what `adapter` answers."""
+        return _RecordingAdapter(self.cassette, adapter)
+
+
+class _RecordingSession:
+    def __init__(self, cassette, session):
+        self._cassette = cassette
+        self._session = session
+
+    def open(self, url, headers=None, method="GET", timeout=None):
+        request = _request(method, url, headers)
+        try:
+            with self._session.open(url, headers=headers, method=method, timeout=timeout) as response:
+                # Read the whole body, so that the response can be recorded before it is handed out.
+                body = response.read()
+                recorded = {
+                    "url": response.url,
+                    "status": response.status,
+                    "reason": response.reason,
+                    "headers": _headers(response.headers.items()),
+                }
+        except HTTPError as e:
+            body = e.read()
+            recorded = {"url": url, "status": e.code, "reason": e.reason, "headers": _headers(e.headers.items())}
+            self._cassette.add({"request": request, "response": recorded}, body)
+            raise HTTPError(url, e.code, e.reason, e.headers, io.BytesIO(body)) from None
+        except OSError as e:
+            # Includes `URLError` and timeouts.
+            reason = e.reason if isinstance(e, urllib.error.URLError) else e
+            self._cassette.add({"request": request, "error": str(reason)})
+            raise
+        self._cassette.add({"request": request, "response": recorded}, body)
+        return _Response(recorded, body)
+
+    def close(self):
+        self._session.close()
+
+
+class _RecordingAdapter(requests.adapters.BaseAdapter):
+    def __init__(self, cassette, adapter):
+        super().__init__()
+        self._cassette = cassette
+        self._adapter = adapter
+
+    def send(self, request, **kwargs):
+        recorded_request = _request(request.method, request.url, request.headers, request.body)
+        try:
+            response = self._adapter.send(request, **kwargs)
+            body = response.content
+        except requests.RequestException as e:
+            self._cassette.add({"request": recorded_request, "error": str(e)})
+            raise
+        recorded = {
+            "url": response.url,
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": _headers(response.headers.items(), _PRIVATE_HEADERS | _DECODED_HEADERS),
+        }
+        self._cassette.add({"request": recorded_request, "response": recorded}, body)
+        return response
+
+    def close(self):
+        self._adapter.close()
+
+
+class ReplayNetwork:
+    """Answers requests from `cassette` without any network access.
+
+    Every response arrives `latency` seconds after its request and its body is read at `bandwidth` bytes
+    per second (None for no limit), independently of other requests.
+    """
+
+    def __init__(self, cassette, latency=0.0, bandwidth=None):
+        self.cassette = cassette
+        self.latency = latency
+        self.bandwidth = bandwidth
+
+    def http_session(self):
+        return _ReplaySession(self)
+
+    def requests_adapter(self, adapter):
+        """Return a transport adapter for `requests` that is used instead of `adapter`."""
+        return _ReplayAdapter(self)
+
+    def respond(self, request):
+        """Return the next recorded interaction for `request` and the body of its response, or None, after
+        waiting for the simulated latency."""
+        if self.latency:
+            time.sleep(self.latency)
+        return self.cassette.next(request)
+
+    def transfer(self, size):
+        """Wait for `size` bytes to arrive."""
+        if self.bandwidth and size:
+            time.sleep(size / self.bandwidth)
+
+
+class _ReplaySession:
+    def __init__(self, network):
+        self._network = network
+
+    def open(self, url, headers=None, method="GET", timeout=None):
+        tracing.add(tracing.HTTP_REQUESTS)
+        request = _request(method, url, headers)
+        replayed = self._network.respond(request)
+        if replayed is None:
+            raise urllib.error.URLError(_not_recorded(request))
+        interaction, body = replayed
+        if "error" in interaction:
+            raise urllib.error.URLError(interaction["error"])
+        response = interaction["response"]
+        if response["status"] >= 400:
+            headers = _http_message(response["headers"])
+            raise HTTPError(url, response["status"], response["reason"], headers, io.BytesIO(body))
+        return _Response(response, body, self._network)
+
+    def close(self):
+        pass
+
+
+class _ReplayAdapter(requests.adapters.BaseAdapter):
+    def __init__(self, network):
+        super().__init__()
+        self._network = network
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        recorded_request = _request(request.method, request.url, request.headers, request.body)
+        replayed = self._network.respond(recorded_request)
+        if replayed is None:
+            raise requests.ConnectionError(_not_recorded(recorded_request), request=request)
+        interaction, body = replayed
+        if "error" in interaction:
+            raise requests.ConnectionError(interaction["error"], request=request)
+        self._network.transfer(len(body))
+        recorded = interaction["response"]
+        response = requests.Response()
+        response.status_code = recorded["status"]
+        response.reason = recorded["reason"]
+        response.headers = requests.structures.CaseInsensitiveDict(recorded["headers"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = body
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+_network = None
+
+
+def set_network(network):
+    """Send the HTTP requests of this process through `network`, a `RecordingNetwork` or a `ReplayNetwork`,
+    or through the real network again with None.
+
+    `requests` sessions have to mount the adapter returned by `requests_adapter` of `get_network()` themselves.
+    """
+    global _network
+    _network = network
+    registry.set_session(network.http_session() if network else None)
+
+
+def get_network():
+    return _network
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+import http.server
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+from pathlib import Path
+
+import requests
+import zstandard
+
+import registry
+import transport
+from transport import Cassette
+from transport import CassetteError
+from transport import RecordingNetwork
+from transport import ReplayNetwork
+
+ARCHIVE = bytes(range(256)) * 400
+
+
+class FakeServer:
+    """Serves `ARCHIVE`, counts the requests to /counter and echoes the body of POST requests."""
+
+    def __init__(self):
+        self.counter = 0
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def respond(self, status, body=b"", headers=()):
+                self.send_response(status)
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == "/archive.tar.gz":
+                    self.respond(200, ARCHIVE, [("ETag", '"v1"'), ("Set-Cookie", "session=secret")])
+                elif self.path == "/counter":
+                    server.counter += 1
+                    self.respond(200, str(server.counter).encode())
+                else:
+                    self.respond(404, b"not found")
+
+            do_HEAD = do_GET
+
+            def do_POST(self):
+                self.respond(200, b"echo: " + self.rfile.read(int(self.headers["Content-Length"])))
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}"
+        threading.Thread(target=self._httpd.serve_forever, args=(0.01,), daemon=True).start()
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def requests_session():
+    session = requests.Session()
+    network = transport.get_network()
+    session.mount("http://", network.requests_adapter(requests.adapters.HTTPAdapter()))
+    return session
+
+
+class TransportTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cassette_path = Path(tmp.name, "network.cassette")
+        self.server = FakeServer()
+        self.addCleanup(self.server.close)
+        self.url = self.server.url
+        self.addCleanup(transport.set_network, None)
+
+    def record(self, fn):
+        network = RecordingNetwork()
+        transport.set_network(network)
+        try:
+            return fn()
+        finally:
+            transport.set_network(None)
+            network.cassette.save(self.cassette_path)
+
+    def replay(self, fn, latency=0.0, bandwidth=None):
+        transport.set_network(ReplayNetwork(Cassette.load(self.cassette_path), latency, bandwidth))
+        try:
+            return fn()
+        finally:
+            transport.set_network(None)
+
+    def traffic(self):
+        """Make the kinds of requests the BCR tools make and return what they got."""
+        results = [
+            registry.download(f"{self.url}/archive.tar.gz"),
+            registry.content_length(f"{self.url}/archive.tar.gz"),
+            registry.download_and_hash(f"{self.url}/archive.tar.gz", ("sha256",)),
+            registry.download(f"{self.url}/counter"),
+            registry.download(f"{self.url}/counter"),
+        ]
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            registry.download(f"{self.url}/missing")
+        results.append((cm.exception.code, cm.exception.read()))
+        session = requests_session()
+        response = session.get(f"{self.url}/archive.tar.gz", headers={"Authorization": "token secret"})
+        results.append((response.status_code, response.headers["ETag"], response.content))
+        results.append(session.post(f"{self.url}/graphql", json={"query": "a"}).text)
+        results.append(session.post(f"{self.url}/graphql", json={"query": "b"}).text)
+        results.append(session.get(f"{self.url}/counter").text)
+        return results
+
+
+class TestRecordAndReplay(TransportTestCase):
+    def test_replays_recorded_responses(self):
+        recorded = self.record(self.traffic)
+        self.assertEqual(recorded[3:5], [b"1", b"2"])
+        self.server.close()
+        # A replay without the server gets the same responses, repeated requests get them in order.
+        self.assertEqual(self.replay(self.traffic), recorded)
+        self.assertEqual(self.replay(self.traffic), recorded)
+
+    def test_requests_that_were_not_recorded_fail(self):
+        self.record(lambda: registry.download(f"{self.url}/archive.tar.gz"))
+        with self.assertRaisesRegex(urllib.error.URLError, "GET .*/counter isn't in the cassette"):
+            self.replay(lambda: registry.download(f"{self.url}/counter"))
+        with self.assertRaises(requests.ConnectionError):
+            self.replay(lambda: requests_session().get(f"{self.url}/archive.tar.gz", headers={"Accept": "a/b"}))
+
+    def test_network_errors_are_replayed(self):
+        self.server.close()
+        with self.assertRaises(urllib.error.URLError):
+            self.record(lambda: registry.download(f"{self.url}/archive.tar.gz"))
+        with self.assertRaisesRegex(urllib.error.URLError, "refused"):
+            self.replay(lambda: registry.download(f"{self.url}/archive.tar.gz"))
+
+    def test_secrets_are_not_recorded(self):
+        self.record(self.traffic)
+        with open(self.cassette_path, "rb") as file:
+            recorded = zstandard.ZstdDecompressor().stream_reader(file).read()
+        self.assertNotIn(b"secret", recorded)
+        self.assertIn(b"ETag", recorded)
+
+    def test_simulated_network(self):
+        self.record(lambda: registry.download(f"{self.url}/archive.tar.gz"))
+        start = time.monotonic()
+        # 0.05 seconds until the response arrives and 0.2 seconds for the body.
+        self.replay(lambda: registry.download(f"{self.url}/archive.tar.gz"), latency=0.05, bandwidth=5 * len(ARCHIVE))
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+    def test_worker_interactions(self):
+        network = RecordingNetwork()
+        transport.set_network(network)
+        registry.download(f"{self.url}/counter")
+        transport.set_network(None)
+        parent = Cassette()
+        parent.extend(network.cassette.take_new())
+        self.assertEqual(network.cassette.take_new(), [])
+        parent.save(self.cassette_path)
+        self.assertEqual(self.replay(lambda: registry.download(f"{self.url}/counter")), b"1")
+
+
+class TestCassette(TransportTestCase):
+    def test_invalid_cassette(self):
+        self.cassette_path.write_bytes(b"not a cassette")
+        with self.assertRaisesRegex(CassetteError, "Failed to read the cassette"):
+            Cassette.load(self.cassette_path)
+
+    def test_empty_cassette(self):
+        Cassette().save(self.cassette_path)
+        self.assertEqual(len(Cassette.load(self.cassette_path)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,27 +1,57 @@
 import os
 
 import click
+from module_selector import select_modules
+from registry import IntegrityCache
 from registry import RegistryClient
+from registry import default_integrity_cache_path
 
 
 @click.command()
-@click.argument("module")
+@click.argument("modules", nargs=-1, required=True)
 @click.option("--version")
 @click.option("--registry", default=".")
-def update_integrity(module, version, registry):
-    """Update the SRI hashes in source.json of MODULE."""
+@click.option("--jobs", default=8, show_default=True, help="Number of downloads and hashes to run concurrently.")
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Only rehash files that changed and reuse archive hashes for unchanged URLs since the last incremental run.",
+)
+def update_integrity(modules, version, registry, jobs, incremental):
+    """Update the SRI hashes in source.json of MODULES.
+
+    Each of MODULES is either a module name, in which case its latest version
+    (or --version) is updated, or a module_selector pattern such as
+    `boost.*@1.89.0` or `rules_foo@>=1.0`. All given module versions are
+    updated in one go.
+    """
     client = RegistryClient(registry)
-    if not client.contains(module):
-        raise click.BadParameter(
-            f"{module=} not found in {registry=}. Possible modules: {', '.join(client.get_all_modules())}"
-        )
-    client.update_versions(module)
-    versions = [ver for _, ver in client.get_module_versions(module)]
-    version = version or versions[-1]
-    if not client.contains(module, version):
-        raise click.BadParameter(f"{version=} not found for {module=}. Possible versions: {', '.join(versions)}")
-    click.echo(f"Updating integrity of {module=} {version=} in {registry=}")
-    client.update_integrity(module, version)
+    module_versions = []
+    for module in modules:
+        if "@" in module:
+            try:
+                selected = select_modules(client, [module])
+            except ValueError as e:
+                raise click.BadParameter(f"{module}: {e}")
+            module_versions.extend(tuple(s.split("@", 1)) for s in selected)
+            continue
+        if not client.contains(module):
+            raise click.BadParameter(
+                f"{module=} not found in {registry=}. Possible modules: {', '.join(client.get_all_modules())}"
+            )
+        client.update_versions(module)
+        versions = [ver for _, ver in client.get_module_versions(module)]
+        module_version = version or versions[-1]
+        if not client.contains(module, module_version):
+            raise click.BadParameter(
+                f"version={module_version!r} not found for {module=}. Possible versions: {', '.join(versions)}"
+            )
+        module_versions.append((module, module_version))
+
+    for module, module_version in module_versions:
+        click.echo(f"Updating integrity of module={module!r} version={module_version!r} in {registry=}")
+    cache = IntegrityCache(default_integrity_cache_path()) if incremental else None
+    client.update_integrities(module_versions, jobs=jobs, cache=cache)
 
 
 if __name__ == "__main__":
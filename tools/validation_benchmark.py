@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+#
+# Copyright 2026 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measure the end-to-end cost of bcr_validation.py without the network.
+
+The benchmark validates a fixed set of module versions (`MODULE_VERSIONS`)
+that covers the different kinds of source archives and checks. Record the
+HTTP traffic of a validation once:
+
+    bazel run //tools:validation_benchmark -- --record
+
+Later runs replay it from the cassette, with a simulated latency and
+bandwidth, and report the wall time of every run and the median time per
+check:
+
+    bazel run //tools:validation_benchmark -- --repeat=5 --latency=0.05 --bandwidth=20
+
+Every run is a fresh bcr_validation.py process without any caches, so that
+only the code of the validator changes the numbers. Arguments after `--`
+are passed on to bcr_validation.py, e.g. `-- --jobs=4`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import github_users
+from bcr_validation import GITHUB_REF_CACHE_ENV
+from bcr_validation import RESULT_CACHE_ENV
+from registry import DOWNLOAD_CACHE_ENV
+from registry import REGISTRY_INDEX_ENV
+
+# A fixed set of module versions with different kinds of source archives and checks.
+MODULE_VERSIONS = [
+    # A small release archive with attestations.
+    "bazel_skylib@1.9.2",
+    # An overlay and many other versions to check the compatibility level against.
+    "zlib@1.3.1.bcr.8",
+    # A zip archive with a patch for the MODULE.bazel file.
+    "rules_go@0.63.0",
+    # A zip archive of a GitHub tag with several patches.
+    "zstd-jni@1.5.6-9.bcr.2",
+    # A large archive of a GitHub tag with an overlay.
+    "boost.math@1.90.0.bcr.1",
+    # Large release archives.
+    "protobuf@35.1",
+    "abseil-cpp@20260107.1",
+]
+
+DEFAULT_CASSETTE = os.path.join(os.path.expanduser("~"), ".cache", "bcr", "validation_benchmark.cassette")
+
+# Environment variables that would make bcr_validation.py use caches.
+_CACHE_ENV = frozenset(
+    [DOWNLOAD_CACHE_ENV, REGISTRY_INDEX_ENV, RESULT_CACHE_ENV, github_users.USER_ID_CACHE_ENV, GITHUB_REF_CACHE_ENV]
+)
+
+
+def validation_command(registry, module_versions, network_args, extra_args=()):
+    """Return the command line of a bcr_validation.py run without caches."""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bcr_validation.py")
+    command = [sys.executable, script, f"--registry={registry}", *network_args, *extra_args]
+    return command + [f"--check={module_version}" for module_version in module_versions]
+
+
+def run_validation(command, trace_file=None, verbose=False):
+    """Run `command` and return its exit code and wall time in seconds."""
+    env = {name: value for name, value in os.environ.items() if name not in _CACHE_ENV}
+    if trace_file:
+        command = [*command, f"--trace_jsonl={trace_file}"]
+    output = None if verbose else subprocess.DEVNULL
+    start = time.perf_counter()
+    returncode = subprocess.run(command, env=env, stdout=output, stderr=output).returncode
+    return returncode, time.perf_counter() - start
+
+
+def check_times(trace_file):
+    """Return the total wall time in seconds per check in the spans written with `--trace_jsonl`."""
+    times = {}
+    with open(trace_file) as file:
+        for line in file:
+            span = json.loads(line)
+            if span["category"] == "check":
+                times[span["name"]] = times.get(span["name"], 0) + span["wall_ns"] / 1e9
+    return times
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Measure bcr_validation.py on a fixed set of module versions with a recorded network.",
+        epilog="Arguments after -- are passed on to bcr_validation.py.",
+    )
+    parser.add_argument("--registry", default=".", help="The root path of the registry.")
+    parser.add_argument(
+        "--cassette",
+        default=DEFAULT_CASSETTE,
+        help=f"The file to record the HTTP traffic into and replay it from (default: {DEFAULT_CASSETTE}).",
+    )
+    parser.add_argument(
+        "--record", action="store_true", help="Validate the module versions once with the network and record it."
+    )
+    parser.add_argument(
+        "--check",
+        action="append",
+        help="Validate these module versions instead of the built-in set, e.g. to benchmark a single one. "
+        + "They have to be recorded, too.",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="The number of replayed runs (default: 3).")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds until a replayed response arrives (default: 0)."
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, help="MiB per second of a replayed response arrive (default: no limit)."
+    )
+    parser.add_argument("--verbose", action="store_true", help="Show the output of bcr_validation.py.")
+    parser.add_argument("validation_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    module_versions = args.check or MODULE_VERSIONS
+    registry = os.path.abspath(args.registry)
+    if args.record:
+        os.makedirs(os.path.dirname(os.path.abspath(args.cassette)), exist_ok=True)
+        command = validation_command(
+            registry, module_versions, [f"--record_network={args.cassette}"], args.validation_args
+        )
+        returncode, seconds = run_validation(command, verbose=args.verbose)
+        print(
+            f"Recorded the validation of {len(module_versions)} module versions in {seconds:.1f} s "
+            + f"into {args.cassette} (exit code {returncode})."
+        )
+        return 0
+    if not os.path.exists(args.cassette):
+        print(f"{args.cassette} doesn't exist, record it first with --record.", file=sys.stderr)
+        return 1
+
+    network_args = [f"--replay_network={args.cassette}", f"--replay_latency={args.latency}"]
+    if args.bandwidth:
+        network_args.append(f"--replay_bandwidth={args.bandwidth}")
+    command = validation_command(registry, module_versions, network_args, args.validation_args)
+    runs = []
+    per_check = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(args.repeat):
+            trace_file = os.path.join(tmp, f"{i}.jsonl")
+            returncode, seconds = run_validation(command, trace_file, args.verbose)
+            runs.append(seconds)
+            print(f"run {i + 1}: {seconds:.2f} s (exit code {returncode})")
+            if not os.path.exists(trace_file):
+                continue
+            for name, check_seconds in check_times(trace_file).items():
+                per_check.setdefault(name, []).append(check_seconds)
+
+    print(f"\nmedian {statistics.median(runs):.2f} s, best {min(runs):.2f} s of {len(runs)} runs")
+    print(f"\n{'median s':>9}  check")
+    for name, times in sorted(per_check.items(), key=lambda item: -statistics.median(item[1])):
+        print(f"{statistics.median(times):9.2f}  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    # Under 'bazel run' we want to run within the source folder instead of the execroot.
+    if os.getenv("BUILD_WORKSPACE_DIRECTORY"):
+        os.chdir(os.getenv("BUILD_WORKSPACE_DIRECTORY"))
+    sys.exit(main())
@@ -14,11 +14,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import os
 import sys
 from urllib.parse import urlparse
 from enum import Enum
 
-from registry import RegistryClient
+import registry_walker
 
 
 class UrlStability(Enum):
@@ -40,27 +42,37 @@ def verify_stable_archive(url):
     return UrlStability.UNSTABLE
 
 
+class UnstableUrlCheck(registry_walker.VersionCheck):
+    """Reports module versions whose source archive URL isn't stable, see `verify_stable_archive`."""
+
+    def visit_version(self, module_name, version, entries):
+        for entry in entries:
+            if entry.name == "source.json":
+                with open(entry.path, "rb") as file:
+                    # Sources of type git_repository have no URL.
+                    source_url = json.load(file).get("url")
+                if source_url and verify_stable_archive(source_url) == UrlStability.UNSTABLE:
+                    self.error(
+                        f"Version `{version}` of module `{module_name}` is using an unstable source url: `{source_url}`"
+                    )
+
+
 def main(argv=None):
     if argv is None:
         argv = sys.argv[1:]
 
-    client = RegistryClient(".")
-
-    has_failure = False
-    for module_name, version in client.get_all_module_versions():
-        source_url = client.get_source(module_name, version)["url"]
-        stability = verify_stable_archive(source_url)
-        if stability == UrlStability.UNSTABLE:
-            has_failure = True
-            print(f"Version `{version}` of module `{module_name}` is using an unstable source url: `{source_url}`")
-            print(
-                "You should use a release archive URL in the format of "
-                "`https://github.com/<ORGANIZATION>/<REPO>/releases/download/<version>/<name>.tar.gz` "
-                "to ensure the archive checksum stability."
-            )
-            print("See https://blog.bazel.build/2023/02/15/github-archive-checksum.html for more context.")
-
-    if has_failure:
+    # Read all source.json files in a single pass over modules/.
+    (check,) = registry_walker.walk_registry("modules", [UnstableUrlCheck()], jobs=os.cpu_count() or 1)
+    for message in check.errors:
+        print(message)
+        print(
+            "You should use a release archive URL in the format of "
+            "`https://github.com/<ORGANIZATION>/<REPO>/releases/download/<version>/<name>.tar.gz` "
+            "to ensure the archive checksum stability."
+        )
+        print("See https://blog.bazel.build/2023/02/15/github-archive-checksum.html for more context.")
+
+    if check.errors:
         sys.exit(1)
 
 
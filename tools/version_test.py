@@ -1,6 +1,12 @@
 #!/usr/bin/env python3
+import functools
+import json
+import pathlib
+import re
+import timeit
 import unittest
 
+from registry import RegistryException
 from registry import Version
 
 
@@ -36,6 +42,85 @@ class TestVersionCompare(unittest.TestCase):
         self.assertTrue(Version("1.0-pre.patch.3") < Version("1.0-pre.patch.4"))
         self.assertTrue(Version("1.0--") < Version("1.0----"))
 
+    def testParseIsInterned(self):
+        self.assertIs(Version.parse("1.2.3"), Version.parse("1.2.3"))
+        self.assertEqual(Version.parse("1.2.3"), Version("1.2.3"))
+
+    def testHashMatchesEquality(self):
+        self.assertEqual(hash(Version("1.0+build2")), hash(Version("1.0+build3")))
+        self.assertEqual(len({Version("1.0"), Version("1.0+foo"), Version("1.0-pre")}), 2)
+
+    def testInvalidVersion(self):
+        with self.assertRaisesRegex(RegistryException, "not a valid version"):
+            Version("1.0 beta")
+        with self.assertRaisesRegex(RegistryException, "identifier is empty"):
+            Version("1..0")
+
+
+@functools.total_ordering
+class LegacyVersion:
+    """The previous, object-per-identifier implementation of `Version`, kept as a reference."""
+
+    @functools.total_ordering
+    class Identifier:
+        def __init__(self, s):
+            self.val = int(s) if s.isnumeric() else s
+
+        def __eq__(self, other):
+            if type(self.val) != type(other.val):
+                return False
+            return self.val == other.val
+
+        def __lt__(self, other):
+            if type(self.val) != type(other.val):
+                return type(self.val) == int
+            return self.val < other.val
+
+    def __init__(self, version_str):
+        m = re.compile(r"^([a-zA-Z0-9.]+)(?:-([a-zA-Z0-9.-]+))?(?:\+[a-zA-Z0-9.-]+)?$").match(version_str)
+        self.release = [LegacyVersion.Identifier(i) for i in m.groups()[0].split(".")]
+        self.prerelease = m.groups()[1] and [LegacyVersion.Identifier(i) for i in m.groups()[1].split(".")]
+
+    def __eq__(self, other):
+        return (self.release, self.prerelease) == (other.release, other.prerelease)
+
+    def __lt__(self, other):
+        if self.release != other.release:
+            return self.release < other.release
+        if self.prerelease == None:
+            return False
+        if other.prerelease == None:
+            return True
+        return self.prerelease < other.prerelease
+
+
+class TestVersionSortBenchmark(unittest.TestCase):
+    """Sorts every version string in the registry with `Version` and the legacy implementation."""
+
+    def setUp(self):
+        modules_dir = pathlib.Path(__file__).resolve().parent.parent / "modules"
+        if not modules_dir.is_dir():
+            self.skipTest("modules/ is not available (e.g. in the Bazel sandbox)")
+        self.versions = []
+        for metadata in modules_dir.glob("*/metadata.json"):
+            self.versions.extend(json.loads(metadata.read_text())["versions"])
+
+    def testSortBenchmark(self):
+        self.assertEqual(
+            sorted(self.versions, key=Version),
+            sorted(self.versions, key=LegacyVersion),
+        )
+        legacy = min(timeit.repeat(lambda: sorted(self.versions, key=LegacyVersion), number=1, repeat=3))
+        fresh = min(timeit.repeat(lambda: sorted(self.versions, key=Version), number=1, repeat=3))
+        Version.parse.cache_clear()
+        sorted(self.versions, key=Version.parse)
+        interned = min(timeit.repeat(lambda: sorted(self.versions, key=Version.parse), number=1, repeat=3))
+        print(
+            f"\nSorting {len(self.versions)} versions: legacy {legacy * 1000:.1f}ms, "
+            f"Version {fresh * 1000:.1f}ms ({legacy / fresh:.1f}x), "
+            f"Version.parse {interned * 1000:.1f}ms ({legacy / interned:.1f}x)"
+        )
+
 
 if __name__ == "__main__":
     unittest.main()